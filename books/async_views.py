@@ -0,0 +1,107 @@
+"""Async counterparts of the hot books endpoints, routed instead of the APIViews when WITBOOK_SERVER=asgi."""
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from rest_framework import status
+
+from witbook.async_api import async_api_view, drf_request, not_modified, render
+from witbook.conditional import make_etag
+from . import cache as response_cache, representations
+from .filters import filter_books
+from .models import Book, ReadingSession
+from .pagination import BookCursorPagination, ReadingSessionCursorPagination
+from .serializers import BookListQuerySerializer, ReadingSessionFieldsQuerySerializer, ReadingSessionSerializer
+from .views import BookDetailsView, BookListView
+
+User = get_user_model()
+
+BOOK_NOT_FOUND = {"error": "Книга не найдена"}
+
+
+async def cached_response(request, etag, key, build):
+    response = not_modified(request, etag)
+    if response is None:
+        data = response_cache.lookup(key)
+        if data is None:
+            data = await build()
+            if data is None:
+                return render(BOOK_NOT_FOUND, status.HTTP_404_NOT_FOUND)
+            response_cache.store(key, data)
+        response = render(data)
+    if etag is not None:
+        response['ETag'] = etag
+    return response
+
+
+@async_api_view('GET')
+async def book_list(request):
+    params = BookListQuerySerializer(data=request.GET)
+    if not params.is_valid():
+        return render({'error': 'Неверные данные', 'details': params.errors}, status.HTTP_400_BAD_REQUEST)
+
+    async def build():
+        paginator = BookCursorPagination()
+        api_request = drf_request(request)
+        if paginator.is_requested(api_request):
+            return await sync_to_async(BookListView().serialize)(api_request, params.validated_data)
+        books, ordering = filter_books(Book.objects.filter(user=request.user), params.validated_data)
+        books, represent = representations.book_rows(books, ordering, params.validated_data['fields'])
+        return represent([book async for book in books.order_by(*ordering)])
+
+    data_version = await User.acurrent_data_version(request.user.pk)
+    etag = make_etag(request, 'books', request.user.pk, data_version)
+    key = response_cache.make_key('list', request.user.pk, data_version, query=request.META.get('QUERY_STRING', ''))
+    return await cached_response(request, etag, key, build)
+
+
+@async_api_view('GET')
+async def book_details(request, book_id):
+    params = ReadingSessionFieldsQuerySerializer(data=request.GET)
+    if not params.is_valid():
+        return render({'error': 'Неверные данные', 'details': params.errors}, status.HTTP_400_BAD_REQUEST)
+
+    version = await Book.objects.filter(id=book_id, user=request.user).values_list('version', flat=True).afirst()
+    if version is None:
+        return render(BOOK_NOT_FOUND, status.HTTP_404_NOT_FOUND)
+
+    async def build():
+        paginator = ReadingSessionCursorPagination()
+        api_request = drf_request(request)
+        if paginator.is_requested(api_request):
+            book = await Book.objects.aget(id=book_id)
+            return await sync_to_async(BookDetailsView().serialize)(api_request, book, params.validated_data)
+        sessions, represent = representations.session_rows(
+            ReadingSession.objects.filter(book_id=book_id), paginator.ordering, params.validated_data['fields']
+        )
+        return represent([session async for session in sessions.order_by(*paginator.ordering)])
+
+    etag = make_etag(request, 'book', book_id, version)
+    data_version = await User.acurrent_data_version(request.user.pk)
+    key = response_cache.make_key(
+        'details', request.user.pk, data_version, book_id, query=request.META.get('QUERY_STRING', '')
+    )
+    return await cached_response(request, etag, key, build)
+
+
+@async_api_view('POST')
+async def create_session(request, book_id):
+    try:
+        book = await Book.objects.aget(id=book_id, user=request.user)
+    except Book.DoesNotExist:
+        return render(BOOK_NOT_FOUND, status.HTTP_404_NOT_FOUND)
+
+    api_request = drf_request(request)
+    data = await sync_to_async(lambda: api_request.data)()
+    serializer = ReadingSessionSerializer(data=data, context={'book': book, 'request': api_request})
+    if not serializer.is_valid():
+        return render({'error': 'Неверные данные', 'details': serializer.errors}, status.HTTP_400_BAD_REQUEST)
+
+    # The ORM has no async transactions yet, so the write itself runs in the sync thread
+    await sync_to_async(save_session)(serializer, book, request.user)
+    response_cache.invalidate_user(request.user, book.id)
+    return render(serializer.data, status.HTTP_201_CREATED)
+
+
+@transaction.atomic
+def save_session(serializer, book, user):
+    serializer.save(book=book, user=user)
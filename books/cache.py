@@ -0,0 +1,69 @@
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def is_enabled():
+    return settings.BOOKS_CACHE_ENABLED
+
+
+def get_cache():
+    return caches[settings.BOOKS_CACHE_ALIAS]
+
+
+def data_version(request):
+    """The user's committed data_version, read once per request (see CustomUser.current_data_version)."""
+    if not hasattr(request, '_books_data_version'):
+        request._books_data_version = type(request.user).current_data_version(request.user.pk)
+    return request._books_data_version
+
+
+def make_key(kind, user_id, version, *parts, query=''):
+    # data_version is bumped by every write to the user's library, so a write makes all older keys unreachable
+    query_hash = hashlib.sha1(query.encode()).hexdigest()[:12]
+    return ':'.join([
+        'books', settings.API_ETAG_SALT, kind, str(user_id), str(version), *map(str, parts), query_hash
+    ])
+
+
+def _record(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def lookup(key):
+    if not is_enabled():
+        return None
+    data = get_cache().get(key)
+    _record('misses' if data is None else 'hits')
+    return data
+
+
+def store(key, data):
+    if is_enabled():
+        get_cache().set(key, data)
+
+
+def invalidate_user(user, *book_ids):
+    """Drop the user's unpaginated entries for the version that is being replaced."""
+    if not is_enabled():
+        return
+    keys = [make_key('list', user.pk, user.data_version)]
+    keys.extend(make_key('details', user.pk, user.data_version, book_id) for book_id in book_ids)
+    get_cache().delete_many(keys)
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
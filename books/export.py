@@ -0,0 +1,160 @@
+"""
+Streaming export of a user's library: every book with its sessions and notes, as JSONL or CSV.
+
+Books are read in keyset chunks along the (user, created_at, id) index and the sessions of a
+chunk in one query, so memory and the length of every read stay bounded by the chunk size. Each
+record carries the cursor of its book; passing the last received cursor back resumes the export
+after that book.
+
+Under ASGI Django 4.2 reads a synchronous iterator to the end before it sends anything, so the
+whole export would sit in memory; there the chunks are handed over as an async iterator instead.
+"""
+import base64
+import csv
+import io
+import json
+import uuid
+import zlib
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from witbook.compression import accepted_encoding
+from .models import Book, ReadingSession
+from .serializers import BookSerializer, ReadingSessionSerializer
+
+FORMATS = {
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+}
+CSV_BOOK_FIELDS = [
+    'id', 'name', 'author', 'pages_amount', 'description', 'reading_status', 'star_rate', 'average_emotion',
+    'current_page', 'notes_amount',
+]
+CSV_SESSION_FIELDS = ['created_date', 'session_duration', 'from_page_to_page', 'from_time_to_time', 'current_page']
+CSV_HEADER = (
+    ['cursor']
+    + [f'book_{name}' for name in CSV_BOOK_FIELDS]
+    + [f'session_{name}' for name in CSV_SESSION_FIELDS]
+    + ['session_notes']
+)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(book):
+    position = json.dumps([book.created_at.isoformat(), book.pk.hex])
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        created_at, book_id = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        created_at, book_id = parse_datetime(created_at), uuid.UUID(book_id).hex
+    except (ValueError, TypeError, AttributeError):
+        raise InvalidCursor(token)
+    if created_at is None:
+        raise InvalidCursor(token)
+    return created_at, book_id
+
+
+def book_chunks(user, cursor=None, chunk_size=None):
+    """Yield lists of (book, sessions) in (created_at, id) order, one chunk per two queries."""
+    chunk_size = chunk_size or settings.BOOKS_EXPORT_CHUNK_SIZE
+    books = Book.objects.filter(user=user).order_by('created_at', 'id')
+    position = decode_cursor(cursor) if cursor else None
+
+    while True:
+        chunk = books
+        if position is not None:
+            created_at, book_id = position
+            chunk = chunk.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=book_id))
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+
+        sessions = defaultdict(list)
+        for session in ReadingSession.objects.filter(book__in=chunk).order_by('book_id', 'created_at', 'id'):
+            sessions[session.book_id].append(session)
+        yield [(book, sessions[book.pk]) for book in chunk]
+
+        if len(chunk) < chunk_size:
+            return
+        position = chunk[-1].created_at, chunk[-1].pk.hex
+
+
+def jsonl_chunks(user, request, cursor=None):
+    for chunk in book_chunks(user, cursor):
+        lines = []
+        for book, sessions in chunk:
+            record = {
+                'cursor': encode_cursor(book),
+                **BookSerializer(book, context={'request': request}).data,
+                'sessions': ReadingSessionSerializer(sessions, many=True).data,
+            }
+            lines.append(json.dumps(record, ensure_ascii=False, default=str))
+        yield ('\n'.join(lines) + '\n').encode()
+
+
+def csv_chunks(user, request, cursor=None):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if cursor is None:
+        # The BOM makes spreadsheet software read the file as UTF-8, which matters for Cyrillic
+        buffer.write('\ufeff')
+        writer.writerow(CSV_HEADER)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+    for chunk in book_chunks(user, cursor):
+        for book, sessions in chunk:
+            book_data = BookSerializer(book, context={'request': request}).data
+            book_row = [encode_cursor(book)] + [book_data[name] for name in CSV_BOOK_FIELDS]
+            if not sessions:
+                writer.writerow(book_row + [''] * (len(CSV_SESSION_FIELDS) + 1))
+            for session in ReadingSessionSerializer(sessions, many=True).data:
+                writer.writerow(
+                    book_row
+                    + [session[name] for name in CSV_SESSION_FIELDS]
+                    + [json.dumps(session['notes'], ensure_ascii=False)]
+                )
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def gzip_chunks(chunks):
+    """
+    Compress on the fly. Every chunk ends with a sync flush, so an interrupted download still
+    decompresses up to the last complete chunk, and the cursors in it can be used to resume.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+async def async_chunks(chunks):
+    """The chunks as an async iterator; each one is produced (and read from the database) in the sync thread."""
+    next_chunk = sync_to_async(next)
+    while True:
+        chunk = await next_chunk(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def accepts_gzip(request):
+    return accepted_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), ['gzip']) is not None
+
+
+def export_chunks(export_format, user, request, cursor=None):
+    if export_format == 'csv':
+        return csv_chunks(user, request, cursor)
+    return jsonl_chunks(user, request, cursor)
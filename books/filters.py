@@ -0,0 +1,41 @@
+"""Filtering and ordering of the book list, shared by BookListView and its async counterpart."""
+from .models import ACTIVITY_KEY, PROGRESS_KEY, RATING_KEY
+
+DEFAULT_ORDERING = 'created_at'
+# ordering parameter -> (annotation, expression); each one has a (user, key, id) index on Book
+SORT_KEYS = {
+    'rating': ('rating_key', RATING_KEY),
+    'progress': ('progress_key', PROGRESS_KEY),
+    'last_session': ('activity_key', ACTIVITY_KEY),
+}
+BOOK_ORDERINGS = [
+    prefix + name for name in [DEFAULT_ORDERING, *SORT_KEYS] for prefix in ('', '-')
+]
+
+
+def filter_books(queryset, params):
+    """Apply the validated BookListQuerySerializer params; returns the queryset and its ordering."""
+    if 'reading_status' in params:
+        queryset = queryset.filter(reading_status=params['reading_status'])
+    if 'author' in params:
+        queryset = queryset.filter(author=params['author'])
+
+    ordering = params.get('ordering', DEFAULT_ORDERING)
+    name = ordering.lstrip('-')
+    field = name
+    if name in SORT_KEYS:
+        field, expression = SORT_KEYS[name]
+        queryset = queryset.annotate(**{field: expression})
+
+    if 'rating_min' in params or 'rating_max' in params:
+        # Compare the indexed key, not star_rate itself, so the rating index serves the range
+        if 'rating_key' not in queryset.query.annotations:
+            queryset = queryset.annotate(rating_key=RATING_KEY)
+        queryset = queryset.filter(star_rate__isnull=False)
+        if 'rating_min' in params:
+            queryset = queryset.filter(rating_key__gte=params['rating_min'])
+        if 'rating_max' in params:
+            queryset = queryset.filter(rating_key__lte=params['rating_max'])
+
+    prefix = '-' if ordering.startswith('-') else ''
+    return queryset, (prefix + field, prefix + 'id')
@@ -0,0 +1,142 @@
+"""
+Bulk import of a library from a CSV or JSON file.
+
+The upload is parsed in the request and stored on an ImportJob; validation and the inserts run
+in the task worker. Every row goes through BookSerializer's rules, the valid ones are written
+with bulk_create in batches, and invalid rows are reported by number without stopping the import.
+"""
+import csv
+import io
+import json
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from . import cache as response_cache
+from . import search
+from .models import Book, ImportJob
+from .serializers import BookSerializer
+
+User = get_user_model()
+
+FORMATS = ('csv', 'json', 'jsonl')
+COLUMNS = ['name', 'author', 'pages_amount', 'description', 'reading_status', 'star_rate', 'average_emotion']
+
+
+class InvalidImportFile(ValueError):
+    pass
+
+
+class BookImportRowSerializer(BookSerializer):
+    class Meta(BookSerializer.Meta):
+        fields = COLUMNS
+
+
+def file_format(name):
+    extension = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+    if extension not in FORMATS:
+        raise InvalidImportFile(f"Поддерживаются файлы {', '.join('.' + fmt for fmt in FORMATS)}")
+    return extension
+
+
+def parse(upload):
+    """Read the uploaded file into a list of row dicts; raises InvalidImportFile."""
+    import_format = file_format(upload.name)
+    if upload.size > settings.BOOKS_IMPORT['MAX_FILE_SIZE']:
+        raise InvalidImportFile(f"Файл не может быть больше {settings.BOOKS_IMPORT['MAX_FILE_SIZE'] // 2 ** 20} МБ")
+    try:
+        text = upload.read().decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise InvalidImportFile("Файл должен быть в кодировке UTF-8")
+
+    try:
+        if import_format == 'csv':
+            # Empty cells are left out, so optional columns may stay blank
+            rows = [
+                {name: value for name, value in row.items() if name and value not in (None, '')}
+                for row in csv.DictReader(io.StringIO(text))
+            ]
+        elif import_format == 'jsonl':
+            rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+        else:
+            rows = json.loads(text)
+    except (csv.Error, ValueError):
+        raise InvalidImportFile("Не удалось разобрать файл")
+
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise InvalidImportFile("Файл должен содержать список книг")
+    if not rows:
+        raise InvalidImportFile("Файл не содержит ни одной книги")
+    max_rows = settings.BOOKS_IMPORT['MAX_ROWS']
+    if len(rows) > max_rows:
+        raise InvalidImportFile(f"Не больше {max_rows} книг за один импорт")
+    return rows
+
+
+def import_batch(user, rows, first_row):
+    """Validate rows and bulk insert the valid ones; returns (created, errors)."""
+    # One serializer validates every row, the way ListSerializer drives its child; building the
+    # fields of a ModelSerializer costs more than validating a row with them
+    serializer = BookImportRowSerializer()
+    books, errors = [], []
+    for number, row in enumerate(rows, start=first_row):
+        try:
+            data = serializer.run_validation(row)
+        except serializers.ValidationError as exc:
+            errors.append({'row': number, 'errors': exc.detail})
+        else:
+            books.append(Book(user=user, current_page=0, **data))
+
+    with transaction.atomic():
+        Book.objects.bulk_create(books)
+        search.index_books(books)
+    return len(books), errors
+
+
+def run_import(job_id):
+    # A job still marked running was left by a worker that died; it resumes after the last
+    # committed batch, because each batch commits together with the job's progress
+    job = ImportJob.objects.select_related('user').filter(pk=job_id, status__in=['pending', 'running']).first()
+    if job is None:
+        return None
+    job.status = 'running'
+    job.save(update_fields=['status'])
+
+    batch_size = settings.BOOKS_IMPORT['BATCH_SIZE']
+    try:
+        for start in range(job.processed, len(job.rows), batch_size):
+            with transaction.atomic():
+                created, errors = import_batch(job.user, job.rows[start:start + batch_size], first_row=start + 1)
+                job.processed = min(start + batch_size, job.total)
+                job.created += created
+                job.errors.extend(errors)
+                job.save(update_fields=['processed', 'created', 'errors'])
+                if created:
+                    # The batch's books are visible as soon as it commits, even if a later batch never does
+                    response_cache.invalidate_user(job.user)
+                    User.bump_data_version(job.user_id)
+                    job.user.data_version += 1
+    except Exception as exc:
+        job.status = 'failed'
+        job.failure = str(exc)
+        raise
+    else:
+        job.status = 'finished'
+    finally:
+        if job.status != 'running':
+            job.rows = []
+            job.finished_at = timezone.now()
+            job.save(update_fields=['status', 'failure', 'rows', 'finished_at'])
+    return job
+
+
+def start(user, rows):
+    """Create the job and queue it for the task worker; both commit with the request."""
+    from .tasks import import_library
+
+    job = ImportJob.objects.create(user=user, rows=rows, total=len(rows))
+    import_library.defer(str(job.pk))
+    return job
@@ -0,0 +1,52 @@
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from books.models import Book, ReadingSession
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает notes_count и sessions_count для книг по их сессиям чтения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='Пересчитать только книги указанного пользователя (id)')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        books = Book.objects.all()
+        sessions = ReadingSession.objects.all()
+        if options['user'] is not None:
+            books = books.filter(user_id=options['user'])
+            sessions = sessions.filter(book__user_id=options['user'])
+
+        notes_count = defaultdict(int)
+        sessions_count = defaultdict(int)
+        rows = sessions.values_list('book_id', 'notes').iterator(chunk_size=options['batch_size'])
+        for book_id, notes in rows:
+            notes_count[book_id] += len(notes or [])
+            sessions_count[book_id] += 1
+
+        updated = []
+        books = books.only('id', 'user_id', 'notes_count', 'sessions_count')
+        for book in books.iterator(chunk_size=options['batch_size']):
+            new_notes, new_sessions = notes_count[book.id], sessions_count[book.id]
+            if book.notes_count != new_notes or book.sessions_count != new_sessions:
+                book.notes_count = new_notes
+                book.sessions_count = new_sessions
+                book.version = F('version') + 1
+                updated.append(book)
+
+        # New versions, so ETags and the versioned response cache stop serving the old counts
+        with transaction.atomic():
+            Book.objects.bulk_update(
+                updated, ['notes_count', 'sessions_count', 'version'], batch_size=options['batch_size']
+            )
+            for user_id in {book.user_id for book in updated}:
+                User.bump_data_version(user_id)
+
+        self.stdout.write(self.style.SUCCESS(f'Обновлено книг: {len(updated)}'))
@@ -0,0 +1,341 @@
+import json
+import random
+import re
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from books import search, stats
+from books.models import Book, ReadingSession
+from .bench_sqlite import percentile
+from .seed_library import PASSWORD
+
+User = get_user_model()
+
+QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+
+class Rollback(Exception):
+    pass
+
+
+class Fixture:
+    """A sample user with the ids and search terms the scenarios need."""
+
+    def __init__(self, user):
+        self.user = user
+        self.token = str(AccessToken.for_user(user))
+        self.refresh_token = str(RefreshToken.for_user(user))
+        book = Book.objects.filter(user=user).order_by('-sessions_count').first()
+        self.book_id = str(book.id)
+        self.book_word = book.name.split()[0]
+        notes = ReadingSession.objects.filter(user=user).exclude(notes=[]).values_list('notes', flat=True).first()
+        self.note_word = notes[0].split()[0] if notes else 'глава'
+
+
+class Upload(dict):
+    """A request body sent as multipart/form-data instead of JSON."""
+
+
+def encode_body(body):
+    if body is None:
+        return b'', 'application/json'
+    if isinstance(body, Upload):
+        return encode_multipart(BOUNDARY, body), MULTIPART_CONTENT
+    return json.dumps(body).encode(), 'application/json'
+
+
+def scratch_book(fixture, sessions=5):
+    """A book with sessions for a delete to remove, made the way the API makes them; returns its id."""
+    book = Book.objects.create(
+        user=fixture.user, name='Бенчмарк', author='Автор', pages_amount=300, description='', reading_status='now_reading',
+    )
+    rows = ReadingSession.objects.bulk_create([
+        ReadingSession(
+            book=book, user=fixture.user, current_page=10 * (n + 1), session_duration=20,
+            start_page=10 * n, end_page=10 * (n + 1), notes=['Бенчмарк'],
+        )
+        for n in range(sessions)
+    ])
+    Book.adjust_counters(book.pk, notes_delta=sessions, sessions_delta=sessions)
+    stats.record_sessions(rows)
+    search.index_sessions(rows)
+    search.index_books([book])
+    return str(book.pk)
+
+
+def session_payload(fixture):
+    return {
+        'session_duration': 25,
+        'from_page_to_page': '1-2',
+        'from_time_to_time': '10:00-10:25',
+        'notes': ['Бенчмарк'],
+        'current_page': 2,
+    }
+
+
+def sync_payload(fixture):
+    return {'sessions': [
+        dict(session_payload(fixture), book_id=fixture.book_id, idempotency_key=f'bench-{time.time_ns()}-{n}')
+        for n in range(10)
+    ]}
+
+
+def book_payload(fixture):
+    return {
+        'name': 'Бенчмарк', 'author': 'Автор', 'pages_amount': 300, 'description': 'Описание',
+        'reading_status': 'will_read',
+    }
+
+
+def import_payload(fixture):
+    rows = [dict(book_payload(fixture), name=f'Импорт {n}') for n in range(20)]
+    return Upload(file=SimpleUploadedFile('library.json', json.dumps(rows).encode()))
+
+
+# name: (method, url builder, body builder or None). Builders run before the request is timed,
+# inside the rollback of a local run. Not measured: users/delete/, which would delete the sample
+# users, and deleting a single session, which has no endpoint (book_delete removes the sessions
+# of a book). Import times the upload and the queued job; the rows are added by the task worker.
+NOT_MEASURED = {
+    'user_delete': 'удалил бы пользователей, на которых идёт бенчмарк',
+    'session_delete': 'нет эндпоинта; сессии удаляются вместе с книгой (book_delete)',
+}
+SCENARIOS = {
+    'book_list': ('GET', lambda f: reverse('book_list'), None),
+    'book_list_page': ('GET', lambda f: reverse('book_list') + '?page_size=50', None),
+    'book_list_filtered': (
+        'GET', lambda f: reverse('book_list') + '?reading_status=now_reading&ordering=-rating&page_size=50', None
+    ),
+    'book_details': ('GET', lambda f: reverse('book_details', kwargs={'book_id': f.book_id}), None),
+    'reading_stats': ('GET', lambda f: reverse('reading_stats'), None),
+    'reading_histogram': ('GET', lambda f: reverse('reading_histogram'), None),
+    'search_books': ('GET', lambda f: reverse('search_books') + f'?q={f.book_word[:3]}', None),
+    'search_notes': ('GET', lambda f: reverse('search_notes') + f'?q={f.note_word}', None),
+    # Server-Timing is sent before a streamed body, so only the export's setup queries are counted
+    'export_jsonl': ('GET', lambda f: reverse('export_library', kwargs={'export_format': 'jsonl'}), None),
+    'export_csv': ('GET', lambda f: reverse('export_library', kwargs={'export_format': 'csv'}), None),
+    'profile': ('GET', lambda f: reverse('profile'), None),
+    'profile_update': (
+        'POST', lambda f: reverse('update_profile'), lambda f: {'username': f'Читатель {f.user.pk}'}
+    ),
+    'book_create': ('POST', lambda f: reverse('book_create'), book_payload),
+    'book_delete': ('DELETE', lambda f: reverse('book_delete', kwargs={'book_id': scratch_book(f)}), None),
+    'import': ('POST', lambda f: reverse('import_library'), import_payload),
+    'create_session': (
+        'POST', lambda f: reverse('create_session', kwargs={'book_id': f.book_id}), session_payload
+    ),
+    'sync_sessions': ('POST', lambda f: reverse('sync_sessions'), sync_payload),
+    'login': ('POST', lambda f: reverse('login'), lambda f: {'email': f.user.email, 'password': PASSWORD}),
+    'register': (
+        'POST', lambda f: reverse('register'),
+        lambda f: {'email': f'bench-{time.time_ns()}@example.com', 'password': PASSWORD},
+    ),
+    'token_refresh': ('POST', lambda f: reverse('refresh_token'), lambda f: {'refresh_token': f.refresh_token}),
+}
+
+
+def summarize(latencies, queries, elapsed, errors):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'queries': round(statistics.mean(queries), 1) if queries else None,
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Бенчмарк API: гоняет запросы по всем основным эндпоинтам (через тестовый клиент Django или '
+        'запущенный сервер) и выводит p50/p95/p99, число SQL-запросов на запрос и пропускную способность. '
+        'Умеет сохранять базовую линию и сравнивать с ней с порогом регрессии. Данные — seed_library.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                            help='Какие сценарии запускать (по умолчанию все)')
+        parser.add_argument('--requests', type=int, default=200, help='Запросов на сценарий')
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--users', type=int, default=20, help='Сколько пользователей из базы использовать')
+        parser.add_argument('--url', help='Адрес запущенного сервера, например http://127.0.0.1:8000; '
+                                          'без него запросы идут через тестовый клиент в этом процессе')
+        parser.add_argument('--concurrency', type=int, default=1, help='Параллельных клиентов (только с --url)')
+        parser.add_argument('--keep-writes', action='store_true',
+                            help='Не откатывать пишущие запросы тестового клиента')
+        parser.add_argument('--save-baseline', help='Сохранить результаты в JSON-файл')
+        parser.add_argument('--dataset', default='',
+                            help='Какой командой заполнена база, записывается в базовую линию')
+        parser.add_argument('--baseline', help='Сравнить с сохранённой базовой линией (в репозитории: '
+                                               'bench_baseline.json, команда и данные записаны в нём)')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Допустимый рост p50/p95 относительно базовой линии (0.2 = 20%%)')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        fixtures = self.fixtures(options['users'], options['seed'])
+        names = options['scenario'] or list(SCENARIOS)
+
+        results = {}
+        self.stdout.write(f"{'scenario':<22}{'n':>6}{'err':>5}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+                          f"{'queries':>9}{'req/s':>9}")
+        for name in names:
+            result = self.run_scenario(name, fixtures, options)
+            results[name] = result
+            queries = '-' if result['queries'] is None else f"{result['queries']:.1f}"
+            self.stdout.write(
+                f"{name:<22}{result['requests']:>6}{result['errors']:>5}{result['p50_ms']:>9.1f}"
+                f"{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}{queries:>9}{result['rps']:>9.1f}"
+            )
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as baseline_file:
+                json.dump({'options': {k: options[k] for k in ('requests', 'users', 'url', 'concurrency', 'seed')},
+                           'dataset': options['dataset'], 'data': self.data_size(), 'not_measured': NOT_MEASURED,
+                           'results': results}, baseline_file, indent=2, ensure_ascii=False)
+            self.stdout.write(f"Базовая линия сохранена: {options['save_baseline']}")
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['threshold'])
+
+    def fixtures(self, count, seed):
+        user_ids = list(
+            User.objects.filter(is_active=True, book__sessions_count__gt=0).distinct().order_by('pk')
+            .values_list('pk', flat=True)[:count * 10]
+        )
+        if not user_ids:
+            raise CommandError('В базе нет пользователей с сессиями чтения; сначала запустите seed_library')
+        random.Random(seed).shuffle(user_ids)
+        return [Fixture(user) for user in User.objects.filter(pk__in=user_ids[:count])]
+
+    def run_scenario(self, name, fixtures, options):
+        method, url, body = SCENARIOS[name]
+        requests = [fixtures[n % len(fixtures)] for n in range(options['warmup'] + options['requests'])]
+        send = self.remote_sender(options['url']) if options['url'] else self.local_sender(options)
+
+        def measure(fixture):
+            return send(method, lambda: (url(fixture), encode_body(body(fixture) if body else None)), fixture)
+
+        for fixture in requests[:options['warmup']]:
+            measure(fixture)
+
+        measured = requests[options['warmup']:]
+        started = time.perf_counter()
+        if options['url']:
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                outcomes = list(executor.map(measure, measured))
+        else:
+            # The test client runs in this thread, on this thread's database connection
+            outcomes = [measure(fixture) for fixture in measured]
+        elapsed = time.perf_counter() - started
+
+        latencies = [latency for latency, _, _ in outcomes]
+        queries = [count for _, count, _ in outcomes if count is not None]
+        errors = sum(1 for _, _, ok in outcomes if not ok)
+        return summarize(latencies, queries, elapsed, errors)
+
+    def local_sender(self, options):
+        client = Client()
+        metrics = dict(settings.METRICS, SERVER_TIMING=True, SLOW_REQUEST_MS=float('inf'))
+
+        def request(method, build, headers):
+            url, (body, content_type) = build()
+            started = time.perf_counter()
+            if method == 'GET':
+                response = client.get(url, **headers)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            else:
+                response = client.generic(method, url, body, content_type, **headers)
+            return response, time.perf_counter() - started
+
+        def send(method, build, fixture):
+            headers = {'HTTP_AUTHORIZATION': f'Bearer {fixture.token}'}
+            with override_settings(METRICS=metrics):
+                if method == 'GET' or options['keep_writes']:
+                    response, latency = request(method, build, headers)
+                else:
+                    # The write and everything it (or its builders) did are rolled back, so runs are repeatable
+                    try:
+                        with transaction.atomic():
+                            response, latency = request(method, build, headers)
+                            raise Rollback()
+                    except Rollback:
+                        pass
+            return latency, server_queries(response.get('Server-Timing', '')), response.status_code < 400
+
+        return send
+
+    def remote_sender(self, base_url):
+        def send(method, build, fixture):
+            url, (body, content_type) = build()
+            request = urllib.request.Request(
+                base_url.rstrip('/') + url,
+                data=body if method != 'GET' else None,
+                method=method,
+                headers={'Authorization': f'Bearer {fixture.token}', 'Content-Type': content_type},
+            )
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request) as response:
+                    response.read()
+                    status, timing = response.status, response.headers.get('Server-Timing', '')
+            except urllib.error.HTTPError as error:
+                status, timing = error.code, error.headers.get('Server-Timing', '')
+            return time.perf_counter() - started, server_queries(timing), status < 400
+
+        return send
+
+    def data_size(self):
+        return {
+            'users': User.objects.count(),
+            'books': Book.objects.count(),
+            'sessions': ReadingSession.objects.count(),
+        }
+
+    def compare(self, results, path, threshold):
+        with open(path) as baseline_file:
+            saved = json.load(baseline_file)
+        baseline = saved['results']
+        if saved.get('data', self.data_size()) != self.data_size():
+            # Timings of another library size are not comparable; the query counts still are
+            self.stdout.write(self.style.WARNING(
+                f"Базовая линия снята на других данных ({saved.get('dataset') or saved['data']}), "
+                f"сейчас в базе {self.data_size()}"
+            ))
+
+        regressions = []
+        self.stdout.write(f"{'scenario':<22}{'p50 Δ':>9}{'p95 Δ':>9}{'queries':>12}")
+        for name, result in results.items():
+            base = baseline.get(name)
+            if base is None:
+                continue
+            changes = {key: result[key] / base[key] - 1 if base[key] else 0.0 for key in ('p50_ms', 'p95_ms')}
+            queries = f"{base['queries']}→{result['queries']}"
+            self.stdout.write(f"{name:<22}{changes['p50_ms']:>+9.0%}{changes['p95_ms']:>+9.0%}{queries:>12}")
+            if any(change > threshold for change in changes.values()):
+                regressions.append(f'{name}: время выросло больше чем на {threshold:.0%}')
+            if None not in (base['queries'], result['queries']) and result['queries'] > base['queries']:
+                regressions.append(f"{name}: SQL-запросов {base['queries']} → {result['queries']}")
+
+        if regressions:
+            raise CommandError('Регрессия производительности:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
+
+
+def server_queries(header):
+    match = QUERIES_RE.search(header)
+    return int(match.group(1)) if match else None
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+SEED = """
+from rest_framework_simplejwt.tokens import RefreshToken
+from books.models import Book
+from users.models import CustomUser
+user = CustomUser.objects.create_user(email='bench@example.com', username='bench@example.com', password='bench')
+Book.objects.bulk_create([
+    Book(user=user, name=f'Книга {{n}}', author='Автор', description='', pages_amount=500, reading_status='will_read')
+    for n in range({books})
+])
+print(RefreshToken.for_user(user).access_token)
+"""
+
+SERVERS = {
+    'wsgi': ['witbook.wsgi:application'],
+    'asgi': ['witbook.asgi:application', '--worker-class', 'uvicorn.workers.UvicornWorker'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise CommandError('Сервер завершился при запуске')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise CommandError('Сервер не запустился')
+
+
+async def request(port, path, token, client_delay):
+    """One request from a slow client: the headers arrive in two parts ``client_delay`` seconds apart."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n'.encode())
+        await writer.drain()
+        await asyncio.sleep(client_delay)
+        writer.write(f'Authorization: Bearer {token}\r\nConnection: close\r\n\r\n'.encode())
+        await writer.drain()
+        response = await reader.read()
+        return int(response.split(b' ', 2)[1])
+    finally:
+        writer.close()
+
+
+async def drive(port, path, token, connections, duration, client_delay):
+    latencies, statuses = [], {}
+    deadline = time.monotonic() + duration
+
+    async def client():
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                code = await request(port, path, token, client_delay)
+            except (OSError, IndexError, ValueError):
+                code = 'error'
+            statuses[code] = statuses.get(code, 0) + 1
+            latencies.append(time.monotonic() - started)
+
+    await asyncio.gather(*(client() for _ in range(connections)))
+    return latencies, statuses
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пропускную способность gunicorn в режимах WSGI (sync-воркеры) и ASGI (uvicorn-воркеры) '
+        'при множестве одновременных медленных соединений. Работает на временной базе.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', choices=sorted(SERVERS), default=['wsgi', 'asgi'])
+        parser.add_argument('--workers', type=int, default=3)
+        parser.add_argument('--connections', type=int, default=100)
+        parser.add_argument('--duration', type=float, default=10.0)
+        parser.add_argument('--client-delay', type=float, default=0.05,
+                            help='Пауза между частями заголовков запроса, имитирует медленную сеть клиента')
+        parser.add_argument('--books', type=int, default=20)
+        parser.add_argument('--path', default='/books/list/')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(
+                os.environ,
+                WITBOOK_DB_PATH=os.path.join(directory, 'bench.sqlite3'),
+                WITBOOK_DB_PROFILE='production',
+            )
+            env.pop('WITBOOK_SERVER', None)
+            manage = [sys.executable, str(settings.BASE_DIR / 'manage.py')]
+            subprocess.run(manage + ['migrate', '--noinput'], env=env, check=True, stdout=subprocess.DEVNULL)
+            token = subprocess.run(
+                manage + ['shell', '-c', SEED.format(books=options['books'])],
+                env=env, check=True, capture_output=True, text=True,
+            ).stdout.strip()
+
+            for mode in options['modes']:
+                self.report(mode, self.run_server(mode, env, token, options))
+
+    def run_server(self, mode, env, token, options):
+        port = free_port()
+        command = [
+            sys.executable, '-m', 'gunicorn', *SERVERS[mode],
+            '--bind', f'127.0.0.1:{port}', '--workers', str(options['workers']), '--log-level', 'warning',
+        ]
+        process = subprocess.Popen(command, env=env, cwd=settings.BASE_DIR)
+        try:
+            wait_for_port(port, process)
+            started = time.monotonic()
+            latencies, statuses = asyncio.run(drive(
+                port, options['path'], token, options['connections'], options['duration'], options['client_delay']
+            ))
+            return time.monotonic() - started, latencies, statuses
+        finally:
+            process.terminate()
+            process.wait()
+
+    def report(self, mode, result):
+        elapsed, latencies, statuses = result
+        latencies.sort()
+        ok = statuses.get(200, 0)
+        p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0
+        self.stdout.write(
+            f'{mode}: {ok / elapsed:.0f} req/s, '
+            f'latency median {statistics.median(latencies or [0]) * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms, '
+            f'statuses {statuses}'
+        )
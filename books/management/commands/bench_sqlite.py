@@ -0,0 +1,182 @@
+import multiprocessing
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from witbook.sqlite3.base import apply_pragmas
+
+SCHEMA = """
+CREATE TABLE book (
+    id TEXT PRIMARY KEY, user_id INTEGER NOT NULL, name TEXT NOT NULL, pages_amount INTEGER NOT NULL,
+    current_page INTEGER, reading_status TEXT NOT NULL, notes_count INTEGER NOT NULL DEFAULT 0,
+    sessions_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX book_user ON book (user_id);
+CREATE TABLE session (
+    id INTEGER PRIMARY KEY, book_id TEXT NOT NULL REFERENCES book (id), user_id INTEGER NOT NULL,
+    current_page INTEGER NOT NULL, session_duration INTEGER NOT NULL, notes TEXT NOT NULL,
+    created_at TEXT NOT NULL, start_page INTEGER, end_page INTEGER, start_minute INTEGER, end_minute INTEGER
+);
+CREATE INDEX session_book ON session (book_id, created_at);
+"""
+
+
+def profiles():
+    production = settings.SQLITE_PRODUCTION_OPTIONS
+    return {
+        # Stock Django: rollback journal, BEGIN (deferred), a new connection per request
+        'default': {'timeout': 5, 'pragmas': {}, 'begin': 'BEGIN', 'persistent': False},
+        'production': {
+            'timeout': production['timeout'],
+            'pragmas': production['pragmas'],
+            'begin': f"BEGIN {production['transaction_mode']}",
+            'persistent': True,
+        },
+    }
+
+
+def connect(path, profile):
+    conn = sqlite3.connect(path, timeout=profile['timeout'], isolation_level=None)
+    conn.execute('PRAGMA foreign_keys = ON')
+    apply_pragmas(conn, profile['pragmas'])
+    return conn
+
+
+def seed(path, users, books_per_user):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.executescript(SCHEMA)
+    conn.execute('BEGIN')
+    conn.executemany(
+        'INSERT INTO book (id, user_id, name, pages_amount, current_page, reading_status) VALUES (?, ?, ?, 500, 0, ?)',
+        [
+            (uuid.uuid4().hex, user_id, f'Книга {n}', 'will_read')
+            for user_id in range(users) for n in range(books_per_user)
+        ],
+    )
+    conn.execute('COMMIT')
+    conn.close()
+
+
+def write_session(conn, profile, user_id):
+    """The statements of ReadingSessionCreateView: read the book, update it, insert the session."""
+    conn.execute(profile['begin'])
+    try:
+        book_id, current_page = conn.execute(
+            'SELECT id, current_page FROM book WHERE user_id = ? ORDER BY random() LIMIT 1', (user_id,)
+        ).fetchone()
+        page = (current_page or 0) + 1
+        conn.execute(
+            'UPDATE book SET current_page = ?, reading_status = ?, notes_count = notes_count + 1, '
+            'sessions_count = sessions_count + 1 WHERE id = ?',
+            (page, 'now_reading', book_id),
+        )
+        conn.execute(
+            'INSERT INTO session (book_id, user_id, current_page, session_duration, notes, created_at, '
+            "start_page, end_page, start_minute, end_minute) "
+            "VALUES (?, ?, ?, 30, '[\"заметка\"]', datetime('now'), ?, ?, 600, 630)",
+            (book_id, user_id, page, page - 1, page),
+        )
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def read_library(conn, profile, user_id):
+    """The query of BookListView."""
+    conn.execute('SELECT * FROM book WHERE user_id = ?', (user_id,)).fetchall()
+
+
+def worker(path, profile, kind, users, duration, results):
+    operation = write_session if kind == 'write' else read_library
+    latencies, errors = [], 0
+    conn = connect(path, profile) if profile['persistent'] else None
+    deadline = time.monotonic() + duration
+    user_id = os.getpid() % users
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        current = conn or connect(path, profile)
+        try:
+            operation(current, profile, user_id)
+            latencies.append(time.monotonic() - started)
+        except sqlite3.OperationalError:
+            errors += 1
+        finally:
+            if conn is None:
+                current.close()
+        user_id = (user_id + 1) % users
+    results.put((kind, latencies, errors))
+
+
+def percentile(values, fraction):
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[round(fraction * 100) - 1]
+
+
+class Command(BaseCommand):
+    help = ('Многопроцессный бенчмарк SQLite: пропускная способность чтения и записи '
+            'для стандартного и production-профиля базы')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--duration', type=float, default=5.0, help='Секунд на профиль')
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--books-per-user', type=int, default=20)
+        parser.add_argument('--profile', choices=sorted(profiles()), action='append',
+                            help='Какие профили запускать (по умолчанию все)')
+
+    def handle(self, *args, **options):
+        selected = options['profile'] or sorted(profiles())
+        self.stdout.write(
+            f"readers={options['readers']} writers={options['writers']} duration={options['duration']}s "
+            f"users={options['users']} books/user={options['books_per_user']}"
+        )
+        self.stdout.write(f"{'profile':<12}{'reads/s':>10}{'writes/s':>10}{'read p95 ms':>13}"
+                          f"{'write p95 ms':>14}{'locked':>8}")
+        for name in selected:
+            row = self.run_profile(profiles()[name], options)
+            self.stdout.write(
+                f"{name:<12}{row['reads']:>10.0f}{row['writes']:>10.0f}{row['read_p95']:>13.1f}"
+                f"{row['write_p95']:>14.1f}{row['errors']:>8}"
+            )
+
+    def run_profile(self, profile, options):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.sqlite3')
+            seed(path, options['users'], options['books_per_user'])
+            if profile['pragmas'].get('journal_mode'):
+                # journal_mode is stored in the file; switch it before the workers start
+                connect(path, profile).close()
+
+            context = multiprocessing.get_context('spawn')
+            results = context.Queue()
+            processes = [
+                context.Process(target=worker, args=(path, profile, kind, options['users'], options['duration'], results))
+                for kind in ['read'] * options['readers'] + ['write'] * options['writers']
+            ]
+            for process in processes:
+                process.start()
+            collected = [results.get() for _ in processes]
+            for process in processes:
+                process.join()
+
+        latencies = {'read': [], 'write': []}
+        errors = 0
+        for kind, values, failed in collected:
+            latencies[kind].extend(values)
+            errors += failed
+        return {
+            'reads': len(latencies['read']) / options['duration'],
+            'writes': len(latencies['write']) / options['duration'],
+            'read_p95': percentile(latencies['read'], 0.95) * 1000,
+            'write_p95': percentile(latencies['write'], 0.95) * 1000,
+            'errors': errors,
+        }
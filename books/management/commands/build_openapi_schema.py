@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from witbook import schema
+
+
+class Command(BaseCommand):
+    help = ('Генерирует OpenAPI-документ (JSON и YAML) для текущей версии кода, чтобы /swagger/ '
+            'отдавал его из файла; запускайте при сборке образа')
+
+    def handle(self, *args, **options):
+        schema.reset()
+        for path in schema.build():
+            self.stdout.write(f'{path} ({path.stat().st_size} байт)')
+        self.stdout.write(self.style.SUCCESS(f'Версия {schema.code_version()}'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from books import search
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает поисковый индекс библиотеки по названиям и авторам книг (books_book_fts)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='Переиндексировать только книги указанного пользователя (id)')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        books = search.rebuild_books(user_id=options['user'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Книг в индексе: {books}'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from books import search
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс заметок (books_note_fts) и сжимает его сегменты'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='Переиндексировать только заметки указанного пользователя (id)')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        notes = search.rebuild(user_id=options['user'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Заметок в индексе: {notes}'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from books import stats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает дневную статистику чтения (DailyReadingStat) по всем сессиям'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='Пересчитать только статистику указанного пользователя (id)')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        rows = stats.rebuild(user_id=options['user'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Записей статистики: {rows}'))
@@ -0,0 +1,33 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from books.models import Book
+from witbook.images import generate_renditions
+
+IMAGE_FIELDS = {
+    'books': (Book, 'book_photo'),
+    'avatars': (get_user_model(), 'avatar'),
+}
+
+
+class Command(BaseCommand):
+    help = 'Пересоздаёт превью (thumbnail/detail, WebP и JPEG) для обложек книг и аватаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', choices=sorted(IMAGE_FIELDS), help='Обработать только обложки или только аватары')
+
+    def handle(self, *args, **options):
+        targets = [options['only']] if options['only'] else sorted(IMAGE_FIELDS)
+        for target in targets:
+            model, field_name = IMAGE_FIELDS[target]
+            done = failed = 0
+            queryset = model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+            for instance in queryset.only('pk', field_name).iterator():
+                field_file = getattr(instance, field_name)
+                try:
+                    generate_renditions(field_file.name, field_file.storage)
+                    done += 1
+                except (OSError, ValueError) as e:
+                    failed += 1
+                    self.stderr.write(f'{field_file.name}: {e}')
+            self.stdout.write(self.style.SUCCESS(f'{target}: обработано {done}, ошибок {failed}'))
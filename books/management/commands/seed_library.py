@@ -0,0 +1,155 @@
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from books import search, stats
+from books.models import Book, ReadingSession
+
+User = get_user_model()
+
+PASSWORD = 'witbook-bench'
+EMAIL_DOMAIN = 'seed.witbook.test'
+
+AUTHORS = [
+    'Лев Толстой', 'Фёдор Достоевский', 'Антон Чехов', 'Михаил Булгаков', 'Николай Гоголь',
+    'Александр Пушкин', 'Иван Тургенев', 'Иван Бунин', 'Владимир Набоков', 'Борис Пастернак',
+    'Марина Цветаева', 'Анна Ахматова', 'Михаил Лермонтов', 'Максим Горький', 'Евгений Замятин',
+]
+TITLE_WORDS = [
+    'война', 'мир', 'преступление', 'наказание', 'мастер', 'ночь', 'сад', 'дом', 'дорога', 'море',
+    'город', 'зима', 'письма', 'дневник', 'история', 'тайна', 'остров', 'сердце', 'время', 'свет',
+]
+NOTE_WORDS = [
+    'герой', 'глава', 'мысль', 'цитата', 'сюжет', 'автор', 'любовь', 'смерть', 'память', 'детство',
+    'страх', 'надежда', 'описание', 'диалог', 'финал', 'образ', 'природа', 'вопрос', 'ответ', 'судьба',
+]
+
+
+@contextmanager
+def explicit_created_at(*models):
+    """bulk_create() normally stamps auto_now_add fields with the current time; keep the generated dates."""
+    fields = [model._meta.get_field('created_at') for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу реалистичными тестовыми данными: пользователи, книги, сессии чтения с заметками. '
+        f'Пароль всех пользователей — {PASSWORD}. Запускайте на отдельной базе (WITBOOK_DB_PATH).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--books-per-user', type=int, default=30, help='Среднее число книг на пользователя')
+        parser.add_argument('--sessions', type=int, default=10000, help='Всего сессий чтения')
+        parser.add_argument('--days', type=int, default=365, help='За сколько последних дней распределить сессии')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-users', type=int, default=200, help='Пользователей на одну транзакцию')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.now = timezone.now()
+        self.days = options['days']
+        password = make_password(PASSWORD)
+        first_id = (User.objects.order_by('-pk').values_list('pk', flat=True).first() or 0) + 1
+        sessions_per_book = options['sessions'] / max(options['users'] * options['books_per_user'], 1)
+
+        created = {'users': 0, 'books': 0, 'sessions': 0}
+        for start in range(0, options['users'], options['batch_users']):
+            count = min(options['batch_users'], options['users'] - start)
+            with transaction.atomic(), explicit_created_at(Book, ReadingSession):
+                users = User.objects.bulk_create([
+                    User(
+                        email=f'reader{first_id + start + n}@{EMAIL_DOMAIN}',
+                        username=f'Читатель {first_id + start + n}',
+                        password=password,
+                    )
+                    for n in range(count)
+                ])
+                books, sessions = self.generate(users, options['books_per_user'], sessions_per_book)
+                Book.objects.bulk_create(books, batch_size=2000)
+                ReadingSession.objects.bulk_create(sessions, batch_size=2000)
+            created['users'] += len(users)
+            created['books'] += len(books)
+            created['sessions'] += len(sessions)
+            self.stdout.write(f"пользователей {created['users']}, книг {created['books']}, сессий {created['sessions']}")
+
+        self.stdout.write('Индексы и статистика...')
+        stats.rebuild()
+        search.rebuild()
+        search.rebuild_books()
+        self.stdout.write(self.style.SUCCESS(
+            f"Создано: пользователей {created['users']}, книг {created['books']}, сессий {created['sessions']}"
+        ))
+
+    def generate(self, users, books_per_user, sessions_per_book):
+        books, sessions = [], []
+        for user in users:
+            for _ in range(max(round(self.random.expovariate(1 / books_per_user)), 1)):
+                book, book_sessions = self.generate_book(user, sessions_per_book)
+                books.append(book)
+                sessions.extend(book_sessions)
+        return books, sessions
+
+    def generate_book(self, user, sessions_per_book):
+        rng = self.random
+        pages = rng.randint(80, 1200)
+        added = self.now - timedelta(days=rng.uniform(0, self.days), seconds=rng.randint(0, 86400))
+        book = Book(
+            user=user,
+            name=' '.join(rng.sample(TITLE_WORDS, rng.randint(1, 3))).capitalize(),
+            author=rng.choice(AUTHORS),
+            pages_amount=pages,
+            description=' '.join(rng.choices(NOTE_WORDS, k=rng.randint(5, 20))).capitalize(),
+            reading_status='will_read',
+            star_rate=round(rng.uniform(1, 5), 1) if rng.random() < 0.4 else None,
+            average_emotion=rng.randint(1, 5) if rng.random() < 0.3 else None,
+            current_page=0,
+            created_at=added,
+        )
+
+        sessions = []
+        page = 0
+        count = round(rng.expovariate(1 / sessions_per_book)) if sessions_per_book else 0
+        moments = sorted(added + (self.now - added) * rng.random() for _ in range(count))
+        step = max(2 * pages // max(count, 1), 5)
+        for created_at in moments:
+            if page >= pages:
+                break
+            start_page, page = page, min(page + rng.randint(1, step), pages)
+            start_minute = rng.randint(6 * 60, 23 * 60)
+            duration = rng.randint(10, 90)
+            notes = [
+                ' '.join(rng.choices(NOTE_WORDS, k=rng.randint(3, 12))).capitalize()
+                for _ in range(rng.choices([0, 1, 2, 3], weights=[5, 3, 1, 1])[0])
+            ]
+            sessions.append(ReadingSession(
+                book=book,
+                user=user,
+                current_page=page,
+                session_duration=duration,
+                notes=notes,
+                created_at=created_at,
+                start_page=start_page,
+                end_page=page,
+                start_minute=start_minute,
+                end_minute=min(start_minute + duration, 24 * 60 - 1),
+            ))
+
+        book.apply_reading_progress(page)
+        book.sessions_count = len(sessions)
+        book.notes_count = sum(len(session.notes) for session in sessions)
+        book.last_session_at = sessions[-1].created_at if sessions else None
+        return book, sessions
@@ -0,0 +1,183 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from witbook.startup import LAZY_MODULES
+
+# Loads the WSGI application and the urlconf the way a gunicorn worker does before its first request
+LOAD = '''
+import os, time
+started, started_cpu = time.perf_counter(), time.process_time()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'witbook.settings')
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+from django.urls import get_resolver
+get_resolver().url_patterns
+ready, ready_cpu = time.perf_counter() - started, time.process_time() - started_cpu
+'''
+
+REPORT = LOAD + '''
+import json, sys
+print(json.dumps({'ready': ready, 'cpu': ready_cpu, 'rss': memory()['rss'], 'modules': sorted(sys.modules)}))
+'''
+
+# A master that loads the application (and warms it up when preloading), forks one worker, and
+# has it serve a request; the worker reports how much of its memory is its own
+WORKER = '''
+import json, os, sys
+preload = sys.argv[1] == 'preload'
+if preload:
+''' + ''.join('    ' + line + '\n' for line in LOAD.strip().splitlines()) + '''
+    from witbook.startup import warm_up
+    warm_up()
+
+read_end, write_end = os.pipe()
+if os.fork() == 0:
+    if not preload:
+''' + ''.join('        ' + line + '\n' for line in LOAD.strip().splitlines()) + '''
+    from wsgiref.util import setup_testing_defaults
+    environ = {'PATH_INFO': '/books/list/', 'wsgi.url_scheme': 'https', 'HTTP_HOST': 'localhost'}
+    setup_testing_defaults(environ)
+    b''.join(application(environ, lambda status, headers, exc_info=None: None))
+    os.write(write_end, json.dumps(memory()).encode())
+    os._exit(0)
+os.close(write_end)
+result = b''
+while True:
+    chunk = os.read(read_end, 65536)
+    if not chunk:
+        break
+    result += chunk
+os.wait()
+print(result.decode())
+'''
+
+MEMORY = '''
+def memory():
+    """RSS and, where /proc has it, the private (unshared) part of this process, in bytes."""
+    values = {}
+    for filename in ('/proc/self/status', '/proc/self/smaps_rollup'):
+        try:
+            with open(filename) as proc_file:
+                for line in proc_file:
+                    key, _, rest = line.partition(':')
+                    if rest.strip().endswith('kB'):
+                        values[key] = int(rest.split()[0]) * 1024
+        except OSError:
+            pass
+    if 'VmRSS' not in values:
+        import resource
+        scale = 1 if sys.platform == 'darwin' else 1024
+        values['VmRSS'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    private = values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)
+    return {'rss': values['VmRSS'], 'private': private or None}
+'''
+
+
+def import_times(stderr):
+    """(total ms, {top-level module: cumulative ms}) from ``python -X importtime`` output."""
+    total = 0
+    top_level = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        total += int(own)
+        if not name[1:].startswith(' '):
+            top_level[name.strip()] = int(cumulative) / 1000
+    return total / 1000, top_level
+
+
+def megabytes(value):
+    return round(value / 2 ** 20, 1) if value else None
+
+
+class Command(BaseCommand):
+    help = (
+        'Отчёт о старте приложения: время импорта (в том числе самые тяжёлые модули), время до '
+        'готовности, RSS и собственная (не разделяемая) память воркера с предзагрузкой и без. '
+        'Умеет сохранять базовую линию и сравнивать с ней, чтобы замечать регрессии старта.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Сколько раз запускать; берётся медиана')
+        parser.add_argument('--top', type=int, default=15, help='Сколько самых тяжёлых импортов показать')
+        parser.add_argument('--save-baseline', help='Сохранить результаты в JSON-файл')
+        parser.add_argument('--baseline', help='Сравнить с сохранённой базовой линией')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Допустимый рост относительно базовой линии (0.2 = 20%%)')
+
+    def handle(self, *args, **options):
+        runs = [self.run_python(MEMORY + REPORT) for _ in range(options['repeat'])]
+        reports = [json.loads(stdout) for stdout, _ in runs]
+        imports = [import_times(stderr) for _, stderr in runs]
+
+        loaded_lazy = [name for name in LAZY_MODULES if name in reports[0]['modules']]
+        result = {
+            'ready_ms': round(statistics.median(report['ready'] for report in reports) * 1000, 1),
+            'cpu_ms': round(statistics.median(report['cpu'] for report in reports) * 1000, 1),
+            'import_ms': round(statistics.median(total for total, _ in imports), 1),
+            'modules': len(reports[0]['modules']),
+            'rss_mb': megabytes(statistics.median(report['rss'] for report in reports)),
+        }
+        if hasattr(os, 'fork'):
+            for mode in ('preload', 'fork'):
+                worker = json.loads(self.run_python(MEMORY + WORKER, mode)[0])
+                result[f'worker_{mode}_private_mb'] = megabytes(worker['private'])
+
+        self.stdout.write(
+            f"Готовность:     {result['ready_ms']} мс, процессорное время {result['cpu_ms']} мс "
+            f"(медиана из {options['repeat']})"
+        )
+        self.stdout.write(f"Импорт:         {result['import_ms']} мс, модулей {result['modules']}")
+        self.stdout.write(f"RSS:            {result['rss_mb']} МБ")
+        if 'worker_preload_private_mb' in result:
+            self.stdout.write(
+                f"Память воркера: {result['worker_preload_private_mb']} МБ своей с предзагрузкой, "
+                f"{result['worker_fork_private_mb']} МБ без неё"
+            )
+        self.stdout.write('Самые тяжёлые импорты верхнего уровня, мс:')
+        heaviest = sorted(imports[0][1].items(), key=lambda item: item[1], reverse=True)
+        for name, duration in heaviest[:options['top']]:
+            self.stdout.write(f'  {duration:8.1f}  {name}')
+        for name in loaded_lazy:
+            self.stdout.write(self.style.WARNING(f'{name} импортируется при старте, а должен — при первом использовании'))
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as baseline_file:
+                json.dump(result, baseline_file, indent=2)
+            self.stdout.write(f"Базовая линия сохранена: {options['save_baseline']}")
+        if options['baseline']:
+            self.compare(result, loaded_lazy, options['baseline'], options['threshold'])
+
+    def run_python(self, code, *args):
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code, *args],
+            cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        if process.returncode:
+            raise CommandError(f'Не удалось запустить приложение:\n{process.stderr[-2000:]}')
+        return process.stdout, process.stderr
+
+    def compare(self, result, loaded_lazy, path, threshold):
+        with open(path) as baseline_file:
+            baseline = json.load(baseline_file)
+
+        regressions = [f'{name} импортируется при старте' for name in loaded_lazy]
+        for key, value in result.items():
+            base = baseline.get(key)
+            if not base or value is None or key == 'modules':
+                continue
+            change = value / base - 1
+            self.stdout.write(f'{key:<28}{base:>10} → {value:<10}{change:+.0%}')
+            if change > threshold:
+                regressions.append(f'{key}: {base} → {value}')
+
+        if regressions:
+            raise CommandError('Регрессия старта:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:12
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def backfill_counters(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    ReadingSession = apps.get_model('books', 'ReadingSession')
+
+    notes_count = defaultdict(int)
+    sessions_count = defaultdict(int)
+    for book_id, notes in ReadingSession.objects.values_list('book_id', 'notes').iterator():
+        notes_count[book_id] += len(notes or [])
+        sessions_count[book_id] += 1
+
+    books = list(Book.objects.filter(pk__in=sessions_count.keys()).only('id'))
+    for book in books:
+        book.notes_count = notes_count[book.id]
+        book.sessions_count = sessions_count[book.id]
+    Book.objects.bulk_update(books, ['notes_count', 'sessions_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0002_alter_readingsession_from_time_to_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='notes_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='sessions_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:13
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0003_book_notes_count_sessions_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='book_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='readingsession',
+            index=models.Index(fields=['book', 'created_at', 'id'], name='session_book_created_idx'),
+        ),
+    ]
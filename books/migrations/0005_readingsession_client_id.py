@@ -0,0 +1,22 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_book_created_at_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='readingsession',
+            name='client_id',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='readingsession',
+            constraint=models.UniqueConstraint(fields=('user', 'client_id'), name='session_unique_client_id'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0005_readingsession_client_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
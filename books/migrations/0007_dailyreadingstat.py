@@ -0,0 +1,76 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:20
+
+import re
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+import django.db.models.deletion
+
+PAGE_RANGE_RE = re.compile(r'(\d+)\s*-\s*(\d+)')
+BATCH_SIZE = 2000
+
+
+def pages_read(from_page_to_page):
+    match = PAGE_RANGE_RE.search(from_page_to_page or '')
+    if not match:
+        return 0
+    return max(int(match.group(2)) - int(match.group(1)), 0)
+
+
+def backfill_rollups(apps, schema_editor):
+    """Roll up the existing sessions, so the stats cover them and deleting one does not go negative."""
+    ReadingSession = apps.get_model('books', 'ReadingSession')
+    DailyReadingStat = apps.get_model('books', 'DailyReadingStat')
+
+    rollups = defaultdict(lambda: {'sessions': 0, 'duration': 0, 'pages': 0, 'notes': 0})
+    sessions = ReadingSession.objects.only(
+        'user_id', 'book_id', 'created_at', 'session_duration', 'from_page_to_page', 'notes'
+    )
+    for session in sessions.iterator(chunk_size=BATCH_SIZE):
+        rollup = rollups[(session.user_id, session.book_id, timezone.localdate(session.created_at))]
+        rollup['sessions'] += 1
+        rollup['duration'] += session.session_duration
+        rollup['pages'] += pages_read(session.from_page_to_page)
+        rollup['notes'] += len(session.notes or [])
+
+    DailyReadingStat.objects.bulk_create(
+        [
+            DailyReadingStat(user_id=user_id, book_id=book_id, date=date, **rollup)
+            for (user_id, book_id, date), rollup in rollups.items()
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('books', '0006_book_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyReadingStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('sessions', models.IntegerField(default=0)),
+                ('duration', models.IntegerField(default=0)),
+                ('pages', models.IntegerField(default=0)),
+                ('notes', models.IntegerField(default=0)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='books.book')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'date'], name='daily_stat_user_date_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyreadingstat',
+            constraint=models.UniqueConstraint(fields=('user', 'book', 'date'), name='daily_stat_unique_day'),
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
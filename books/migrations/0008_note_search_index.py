@@ -0,0 +1,43 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:45
+
+from django.db import migrations
+
+POSITION_BITS = 16
+
+
+def index_notes(apps, schema_editor):
+    ReadingSession = apps.get_model('books', 'ReadingSession')
+
+    rows = []
+    sessions = ReadingSession.objects.values_list('id', 'user_id', 'book_id', 'notes').iterator(chunk_size=2000)
+    for session_id, user_id, book_id, notes in sessions:
+        for position, note in enumerate(notes or []):
+            text = note.strip() if isinstance(note, str) else str(note or '')
+            if text:
+                rows.append(((session_id << POSITION_BITS) | position, text, f'u{user_id}', f'b{book_id.hex}'))
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO books_note_fts (rowid, body, user_key, book_key) VALUES (%s, %s, %s, %s)', rows
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0007_dailyreadingstat'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            """
+            CREATE VIRTUAL TABLE books_note_fts USING fts5(
+                body, user_key, book_key,
+                tokenize = 'unicode61 remove_diacritics 2',
+                prefix = '2 3'
+            )
+            """,
+            'DROP TABLE books_note_fts',
+        ),
+        migrations.RunPython(index_notes, migrations.RunPython.noop),
+    ]
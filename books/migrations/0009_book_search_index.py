@@ -0,0 +1,56 @@
+# Generated by Django 4.2.16 on 2026-10-18 19:05
+
+import re
+
+from django.db import migrations
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+MIN_FRAGMENT = 3
+
+
+def normalize(text):
+    return (text or '').casefold().replace('ё', 'е')
+
+
+def fragments(*texts):
+    suffixes = set()
+    for text in texts:
+        for word in TERM_RE.findall(text):
+            suffixes.update(word[start:] for start in range(1, len(word) - MIN_FRAGMENT + 1))
+    return ' '.join(sorted(suffixes))
+
+
+def index_books(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+
+    rows = []
+    for book_id, user_id, name, author in Book.objects.values_list('id', 'user_id', 'name', 'author').iterator():
+        name, author = normalize(name), normalize(author)
+        rows.append((name, author, fragments(name, author), f'u{user_id}', f'b{book_id.hex}'))
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO books_book_fts (name, author, fragments, user_key, book_key) VALUES (%s, %s, %s, %s, %s)',
+            rows,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0008_note_search_index'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            """
+            CREATE VIRTUAL TABLE books_book_fts USING fts5(
+                name, author, fragments, user_key, book_key,
+                tokenize = 'unicode61 remove_diacritics 2',
+                prefix = '2 3'
+            )
+            """,
+            'DROP TABLE books_book_fts',
+        ),
+        migrations.RunPython(index_books, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.16 on 2026-10-18 19:20
+
+from django.db import migrations, models
+import django.db.models.expressions
+import django.db.models.functions.comparison
+
+
+def backfill_last_session_at(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    ReadingSession = apps.get_model('books', 'ReadingSession')
+    Book.objects.filter(sessions_count__gt=0).update(
+        last_session_at=models.Subquery(
+            ReadingSession.objects.filter(book=models.OuterRef('pk')).order_by('-created_at').values('created_at')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_book_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='last_session_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_last_session_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['user', 'reading_status', 'created_at', 'id'], name='book_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['user', 'author', 'created_at', 'id'], name='book_user_author_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(models.F('user'), models.Func(models.F('star_rate'), output_field=models.FloatField(), template='COALESCE(%(expressions)s, 0.0)'), models.F('id'), name='book_user_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(models.F('user'), models.Func(django.db.models.expressions.CombinedExpression(django.db.models.functions.comparison.Cast('current_page', models.FloatField()), '/', models.F('pages_amount')), output_field=models.FloatField(), template='COALESCE(%(expressions)s, 0.0)'), models.F('id'), name='book_user_progress_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(models.F('user'), django.db.models.functions.comparison.Coalesce(models.F('last_session_at'), models.F('created_at')), models.F('id'), name='book_user_activity_idx'),
+        ),
+    ]
@@ -0,0 +1,141 @@
+# Generated by Django 4.2.16 on 2026-10-18 19:45
+
+import re
+
+from django.db import migrations, models
+
+PAGE_RANGE_RE = re.compile(r'(\d+)\s*-\s*(\d+)')
+TIME_RANGE_RE = re.compile(r'^(\d{2}):(\d{2})-(\d{2}):(\d{2})$')
+BATCH_SIZE = 2000
+
+
+def parse_pages(value):
+    match = PAGE_RANGE_RE.search(value or '')
+    if not match:
+        return None, None
+    return int(match.group(1)), int(match.group(2))
+
+
+def parse_minutes(value):
+    match = TIME_RANGE_RE.match(value or '')
+    if not match:
+        return None, None
+    start_hour, start_minute, end_hour, end_minute = (int(part) for part in match.groups())
+    if max(start_hour, end_hour) > 23 or max(start_minute, end_minute) > 59:
+        return None, None
+    return start_hour * 60 + start_minute, end_hour * 60 + end_minute
+
+
+def batches(queryset):
+    """The queryset in primary key order, BATCH_SIZE rows at a time, safe to update as it goes."""
+    last_pk = None
+    while True:
+        batch = queryset.order_by('pk')
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        batch = list(batch[:BATCH_SIZE])
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1].pk
+
+
+def split_ranges(apps, schema_editor):
+    """
+    Parse the free-text ranges. The text stays (in what becomes legacy_page_range and
+    legacy_time_range) wherever it is not exactly one range, so nothing that did not parse is lost.
+    """
+    ReadingSession = apps.get_model('books', 'ReadingSession')
+
+    for sessions in batches(ReadingSession.objects.only('from_page_to_page', 'from_time_to_time')):
+        for session in sessions:
+            pages, minutes = session.from_page_to_page, session.from_time_to_time
+            session.start_page, session.end_page = parse_pages(pages)
+            session.start_minute, session.end_minute = parse_minutes(minutes)
+            if not pages or PAGE_RANGE_RE.fullmatch(pages.strip()):
+                session.from_page_to_page = None
+            if not minutes or session.start_minute is not None:
+                session.from_time_to_time = None
+        ReadingSession.objects.bulk_update(
+            sessions,
+            ['start_page', 'end_page', 'start_minute', 'end_minute', 'from_page_to_page', 'from_time_to_time'],
+        )
+
+
+def join_ranges(apps, schema_editor):
+    ReadingSession = apps.get_model('books', 'ReadingSession')
+
+    fields = ['start_page', 'end_page', 'start_minute', 'end_minute', 'from_page_to_page', 'from_time_to_time']
+    for sessions in batches(ReadingSession.objects.only(*fields)):
+        for session in sessions:
+            if session.from_page_to_page is None:
+                if session.start_page is not None and session.end_page is not None:
+                    session.from_page_to_page = f'{session.start_page}-{session.end_page}'
+                else:
+                    session.from_page_to_page = ''
+            if session.from_time_to_time is None and session.start_minute is not None and session.end_minute is not None:
+                session.from_time_to_time = '{:02d}:{:02d}-{:02d}:{:02d}'.format(
+                    *divmod(session.start_minute, 60), *divmod(session.end_minute, 60)
+                )
+        ReadingSession.objects.bulk_update(sessions, ['from_page_to_page', 'from_time_to_time'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0010_book_list_filters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='readingsession',
+            name='start_page',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='readingsession',
+            name='end_page',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='readingsession',
+            name='start_minute',
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='readingsession',
+            name='end_minute',
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+        # Nullable, so that only the text that did not parse is kept
+        migrations.AlterField(
+            model_name='readingsession',
+            name='from_page_to_page',
+            field=models.CharField(max_length=100, null=True),
+        ),
+        migrations.RunPython(split_ranges, join_ranges),
+        migrations.RenameField(
+            model_name='readingsession',
+            old_name='from_page_to_page',
+            new_name='legacy_page_range',
+        ),
+        migrations.RenameField(
+            model_name='readingsession',
+            old_name='from_time_to_time',
+            new_name='legacy_time_range',
+        ),
+        migrations.AlterField(
+            model_name='readingsession',
+            name='legacy_page_range',
+            field=models.CharField(editable=False, max_length=100, null=True),
+        ),
+        migrations.AlterField(
+            model_name='readingsession',
+            name='legacy_time_range',
+            field=models.CharField(editable=False, max_length=11, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='readingsession',
+            index=models.Index(fields=['user', 'created_at'], name='session_user_created_idx'),
+        ),
+    ]
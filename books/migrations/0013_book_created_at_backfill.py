@@ -0,0 +1,44 @@
+from datetime import timedelta
+
+from django.db import migrations
+from django.db.models import Count
+from django.db.models.expressions import RawSQL
+
+BATCH_SIZE = 500
+TIE_STEP = timedelta(microseconds=1)
+
+
+def stagger_created_at(apps, schema_editor):
+    """
+    0004 gave every book that existed then one created_at (the time it ran). Within each such tie,
+    spread the books a microsecond apart, earlier than the tie, in insertion (rowid) order, so that
+    the list has an order that means something and stays before every book added since.
+    """
+    Book = apps.get_model('books', 'Book')
+
+    ties = (
+        Book.objects.values('user_id', 'created_at').annotate(books=Count('id')).filter(books__gt=1)
+        .order_by().values_list('user_id', 'created_at', 'books')
+    )
+    for user_id, created_at, count in list(ties):
+        # The ids are read first: the updates take the books out of the filter
+        ids = list(
+            Book.objects.filter(user_id=user_id, created_at=created_at)
+            .annotate(row=RawSQL('rowid', ())).order_by('row').values_list('id', flat=True)
+        )
+        for start in range(0, count, BATCH_SIZE):
+            Book.objects.bulk_update([
+                Book(id=book_id, created_at=created_at - (count - position) * TIE_STEP)
+                for position, book_id in enumerate(ids[start:start + BATCH_SIZE], start)
+            ], ['created_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0012_import_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(stagger_created_at, migrations.RunPython.noop),
+    ]
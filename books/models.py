@@ -1,10 +1,27 @@
 import uuid
+from collections import defaultdict
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Cast, Coalesce
 from django.contrib.auth import get_user_model
 
+from witbook.images import prepare_image_upload, render_image
+
 User = get_user_model()
 
+# Sort keys of the book list. They are non-null, so they work as cursor positions, and they
+# contain no query parameters: SQLite matches an indexed expression only against the same SQL
+# text, and a bound parameter (e.g. Coalesce's default as Value) never matches.
+RATING_KEY = models.Func(F('star_rate'), template='COALESCE(%(expressions)s, 0.0)', output_field=models.FloatField())
+PROGRESS_KEY = models.Func(
+    Cast('current_page', models.FloatField()) / F('pages_amount'),
+    template='COALESCE(%(expressions)s, 0.0)',
+    output_field=models.FloatField(),
+)
+# Books without sessions count as last touched when they were added
+ACTIVITY_KEY = Coalesce(F('last_session_at'), F('created_at'))
+
 class Book(models.Model):
     READING_STATUS_CHOICES = [
         ('will_read', 'Буду читать'),
@@ -23,10 +40,73 @@ class Book(models.Model):
     star_rate = models.FloatField(null=True, blank=True)
     average_emotion = models.IntegerField(null=True, blank=True)
     current_page = models.IntegerField(null=True, blank=True)
+    notes_count = models.IntegerField(default=0, editable=False)
+    sessions_count = models.IntegerField(default=0, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    version = models.PositiveIntegerField(default=0, editable=False)
+    last_session_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='book_user_created_idx'),
+            models.Index(fields=['user', 'reading_status', 'created_at', 'id'], name='book_user_status_idx'),
+            models.Index(fields=['user', 'author', 'created_at', 'id'], name='book_user_author_idx'),
+            models.Index(F('user'), RATING_KEY, F('id'), name='book_user_rating_idx'),
+            models.Index(F('user'), PROGRESS_KEY, F('id'), name='book_user_progress_idx'),
+            models.Index(F('user'), ACTIVITY_KEY, F('id'), name='book_user_activity_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        new_photo = prepare_image_upload(self, 'book_photo')
+        super().save(*args, **kwargs)
+        if new_photo:
+            render_image.defer(self.book_photo.name)
+
+    def apply_reading_progress(self, current_page):
+        self.current_page = current_page
+        if 0 < current_page < self.pages_amount:
+            self.reading_status = 'now_reading'
+        if current_page == self.pages_amount:
+            self.reading_status = 'finished_reading'
+
+    @classmethod
+    def adjust_counters(cls, book_id, notes_delta=0, sessions_delta=0):
+        cls.objects.filter(pk=book_id).update(
+            notes_count=F('notes_count') + notes_delta,
+            sessions_count=F('sessions_count') + sessions_delta,
+            last_session_at=Subquery(
+                ReadingSession.objects.filter(book=OuterRef('pk')).order_by('-created_at').values('created_at')[:1]
+            ),
+            version=F('version') + 1,
+        )
+
+class ReadingSessionQuerySet(models.QuerySet):
+    def delete(self):
+        from . import search
+        from .stats import forget_sessions
+
+        sessions = list(self.only(
+            'book_id', 'user_id', 'notes', 'created_at', 'session_duration', 'start_page', 'end_page'
+        ))
+        deltas = defaultdict(lambda: [0, 0])
+        for session in sessions:
+            deltas[session.book_id][0] -= len(session.notes or [])
+            deltas[session.book_id][1] -= 1
+
+        with transaction.atomic(using=self.db):
+            result = super().delete()
+            for book_id, (notes_delta, sessions_delta) in deltas.items():
+                Book.adjust_counters(book_id, notes_delta, sessions_delta)
+            forget_sessions(sessions)
+            search.forget_sessions(session.pk for session in sessions)
+            for user_id in {session.user_id for session in sessions}:
+                User.bump_data_version(user_id)
+        return result
+
+
 class ReadingSession(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='sessions')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -34,8 +114,89 @@ class ReadingSession(models.Model):
     session_duration = models.IntegerField()
     notes = models.JSONField(default=list)
     created_at = models.DateTimeField(auto_now_add=True)
-    from_page_to_page = models.CharField(max_length=100)
-    from_time_to_time = models.CharField(max_length=11, null=True)
+    # "10-25" and "HH:MM-HH:MM" in the API; the time range is in minutes of the day, device-local
+    start_page = models.PositiveIntegerField(null=True)
+    end_page = models.PositiveIntegerField(null=True)
+    start_minute = models.PositiveSmallIntegerField(null=True)
+    end_minute = models.PositiveSmallIntegerField(null=True)
+    # The free text of sessions from before the ranges were structured, where it was not exactly one range
+    legacy_page_range = models.CharField(max_length=100, null=True, editable=False)
+    legacy_time_range = models.CharField(max_length=11, null=True, editable=False)
+    client_id = models.CharField(max_length=64, null=True, blank=True, editable=False)
+
+    objects = ReadingSessionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['book', 'created_at', 'id'], name='session_book_created_idx'),
+            models.Index(fields=['user', 'created_at'], name='session_user_created_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'client_id'], name='session_unique_client_id'),
+        ]
+
+    def delete(self, *args, **kwargs):
+        from . import search
+        from .stats import forget_sessions
+
+        session_id = self.pk
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            Book.adjust_counters(self.book_id, -len(self.notes or []), -1)
+            forget_sessions([self])
+            search.forget_sessions([session_id])
+            User.bump_data_version(self.user_id)
+        return result
+
+    @property
+    def pages_read(self):
+        if self.start_page is None or self.end_page is None:
+            return 0
+        return max(self.end_page - self.start_page, 0)
+
+    def __str__(self):
+        return f"Сессия для {self.book.name} пользователя {self.user.username}"
+
+class DailyReadingStat(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='daily_stats')
+    date = models.DateField()
+    sessions = models.IntegerField(default=0)
+    duration = models.IntegerField(default=0)
+    pages = models.IntegerField(default=0)
+    notes = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'book', 'date'], name='daily_stat_unique_day'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'date'], name='daily_stat_user_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"Статистика {self.date} для {self.book_id}"
+
+class ImportJob(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('finished', 'Завершён'),
+        ('failed', 'Ошибка'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='import_jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # Parsed rows waiting to be imported; cleared once the job is done
+    rows = models.JSONField(default=list)
+    total = models.IntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    created = models.IntegerField(default=0)
+    errors = models.JSONField(default=list)
+    failure = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
-        return f"Сессия для {self.book.name} пользователя {self.user.username}"
\ No newline at end of file
+        return f"Импорт {self.id} пользователя {self.user_id}"
@@ -0,0 +1,110 @@
+"""
+Opt-in keyset pagination of the book list and the session history.
+
+DRF's CursorPagination puts only the first ordering column in the cursor, plus an offset among the
+rows that share its value, and that offset stops at offset_cutoff (1000). When more than 1000 rows
+tie on the sort key (unrated books ordered by rating, a legacy library with one created_at), the
+pages repeat forever. Here the cursor holds the whole (sort key, id) position of the row at the edge
+of the page, and the next page is the rows after that position, so ties cannot repeat or skip
+rows. One range of the (user, key, id) index serves each page.
+"""
+import base64
+import datetime
+import json
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+def position_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return value.hex
+    return value
+
+
+class OptInCursorPagination(CursorPagination):
+    page_size = getattr(settings, 'BOOKS_PAGE_SIZE', 50)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'BOOKS_MAX_PAGE_SIZE', 200)
+
+    def is_requested(self, request):
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        The page after (or, for a previous link, before) the cursor's position. ``ordering`` is a
+        sort key and the primary key in the same direction, as filter_books() returns it.
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        key, pk = (name.lstrip('-') for name in self.ordering)
+        reverse, position = self.decode_position(request, queryset, key, pk)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = [name[1:] if name.startswith('-') else '-' + name for name in ordering]
+        if position is not None:
+            lookup = 'lt' if ordering[0].startswith('-') else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{key}__{lookup}': position[0]}) | Q(**{key: position[0], f'{pk}__{lookup}': position[1]})
+            )
+
+        rows = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if reverse:
+            self.page.reverse()
+        # A page read from a position has rows on the side it was read from
+        self.has_next = has_more if not reverse else position is not None
+        self.has_previous = position is not None if not reverse else has_more
+        self.key, self.pk = key, pk
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_position(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_position(self.page[0], reverse=True)
+
+    def encode_position(self, row, reverse):
+        values = [row[name] if isinstance(row, dict) else getattr(row, name) for name in (self.key, self.pk)]
+        token = json.dumps([int(reverse), *map(position_value, values)])
+        token = base64.urlsafe_b64encode(token.encode()).decode().rstrip('=')
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_position(self, request, queryset, key, pk):
+        """(reverse, (key value, pk value) or None) from the cursor parameter."""
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return False, None
+        annotations = queryset.query.annotations
+        key_field = annotations[key].output_field if key in annotations else queryset.model._meta.get_field(key)
+        try:
+            reverse, key_value, pk_value = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            position = key_field.to_python(key_value), queryset.model._meta.get_field(pk).to_python(pk_value)
+        except (ValueError, TypeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        if position[0] is None or position[1] is None:
+            raise NotFound(self.invalid_cursor_message)
+        return bool(reverse), position
+
+
+class BookCursorPagination(OptInCursorPagination):
+    ordering = ('created_at', 'id')
+
+
+class ReadingSessionCursorPagination(OptInCursorPagination):
+    ordering = ('created_at', 'id')
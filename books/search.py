@@ -0,0 +1,332 @@
+"""
+Full-text search backed by SQLite FTS5 tables: reading-session notes (books_note_fts) and the
+library itself, book names and authors (books_book_fts).
+
+Every note is one row. The rowid packs the session id and the note position, so the rows of a
+session form a contiguous rowid range and can be dropped without scanning the table. The user and
+the book are indexed columns as well ('u<id>', 'b<hex>'), which lets MATCH restrict a query to one
+user's (or one book's) notes instead of filtering the global result set.
+
+Snippets are HTML: the note text is escaped and the matched terms are wrapped in <b>...</b>.
+"""
+import re
+import uuid
+
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.html import escape
+
+from .models import Book, ReadingSession
+
+TABLE = 'books_note_fts'
+POSITION_BITS = 16
+MAX_POSITION = (1 << POSITION_BITS) - 1
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+MAX_TERMS = 8
+
+# FTS5 marks the matches with noncharacters; note_text() drops them from the indexed text
+SNIPPET_MARKS = ('\ufdd0', '\ufdd1')
+SNIPPET_START = '<b>'
+SNIPPET_END = '</b>'
+SNIPPET_TOKENS = 12
+
+BOOK_TABLE = 'books_book_fts'
+MIN_FRAGMENT = 3
+
+
+def user_key(user_id):
+    return f'u{user_id}'
+
+
+def book_key(book_id):
+    return f'b{book_id.hex}'
+
+
+def row_id(session_id, position):
+    return (session_id << POSITION_BITS) | position
+
+
+def split_row_id(rowid):
+    return rowid >> POSITION_BITS, rowid & MAX_POSITION
+
+
+def note_text(note):
+    text = note if isinstance(note, str) else str(note) if note is not None else ''
+    return ''.join(char for char in text if char not in SNIPPET_MARKS).strip()
+
+
+def note_rows(sessions):
+    for session in sessions:
+        for position, note in enumerate((session.notes or [])[:MAX_POSITION + 1]):
+            text = note_text(note)
+            if text:
+                yield row_id(session.pk, position), text, user_key(session.user_id), book_key(session.book_id)
+
+
+def _with_ids(sessions):
+    """bulk_create() leaves pk unset on SQLite without RETURNING; look the ids up by idempotency key."""
+    missing = [session for session in sessions if session.pk is None]
+    if missing:
+        ids = dict(
+            ReadingSession.objects.filter(
+                user_id=missing[0].user_id, client_id__in=[session.client_id for session in missing]
+            ).values_list('client_id', 'id')
+        )
+        for session in missing:
+            session.pk = ids[session.client_id]
+    return sessions
+
+
+def index_sessions(sessions):
+    rows = list(note_rows(_with_ids(sessions)))
+    if rows:
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {TABLE} (rowid, body, user_key, book_key) VALUES (%s, %s, %s, %s)', rows
+            )
+
+
+def forget_sessions(session_ids):
+    session_ids = list(session_ids)
+    if session_ids:
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {TABLE} WHERE rowid BETWEEN %s AND %s',
+                [(row_id(session_id, 0), row_id(session_id, MAX_POSITION)) for session_id in session_ids],
+            )
+
+
+def forget_book(book_id):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {TABLE} WHERE rowid IN (SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s)',
+            [f'book_key:{book_key(book_id)}'],
+        )
+
+
+@receiver(post_delete, sender=Book)
+def forget_deleted_book(sender, instance, **kwargs):
+    # Cascaded session deletes bypass ReadingSessionQuerySet.delete(), so the book's notes go here
+    forget_book(instance.pk)
+    unindex_book(instance.pk)
+
+
+@receiver(post_save, sender=Book)
+def index_saved_book(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {'name', 'author'} & set(update_fields):
+        index_books([instance], replace=not kwargs.get('created'))
+
+
+def match_expression(query, user_id, book_id=None):
+    """
+    Turn free text into an FTS5 query: every word is a quoted prefix term, so user input can't
+    inject FTS syntax and 'книг' finds 'книга' and 'книги'. Returns None if there are no words.
+    """
+    terms = TERM_RE.findall(query.lower())[:MAX_TERMS]
+    if not terms:
+        return None
+    expression = ' AND '.join(f'body:"{term}"*' for term in terms)
+    scope = f'user_key:{user_key(user_id)}'
+    if book_id is not None:
+        scope += f' AND book_key:{book_key(book_id)}'
+    return f'{scope} AND {expression}'
+
+
+def snippet_html(snippet):
+    start, end = SNIPPET_MARKS
+    return escape(snippet).replace(start, SNIPPET_START).replace(end, SNIPPET_END)
+
+
+def search(user, query, book_id=None, limit=50, offset=0):
+    """Rank the user's notes by bm25; returns (hits, has_more)."""
+    expression = match_expression(query, user.pk, book_id)
+    if expression is None:
+        return [], False
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT rowid, snippet({TABLE}, 0, %s, %s, '…', %s), bm25({TABLE})
+            FROM {TABLE} WHERE {TABLE} MATCH %s
+            ORDER BY bm25({TABLE}) LIMIT %s OFFSET %s
+            """,
+            [*SNIPPET_MARKS, SNIPPET_TOKENS, expression, limit + 1, offset],
+        )
+        rows = cursor.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    sessions = {
+        session['id']: session
+        for session in ReadingSession.objects.filter(
+            id__in={split_row_id(rowid)[0] for rowid, _, _ in rows}
+        ).values('id', 'book_id', 'book__name', 'created_at')
+    }
+
+    hits = []
+    for rowid, snippet, bm25 in rows:
+        session_id, position = split_row_id(rowid)
+        session = sessions.get(session_id)
+        if session is None:
+            continue
+        hits.append({
+            'session_id': session_id,
+            'note_index': position,
+            'book_id': session['book_id'],
+            'book_name': session['book__name'],
+            'created_at': session['created_at'],
+            'snippet': snippet_html(snippet),
+            'score': round(-bm25, 4),
+        })
+    return hits, has_more
+
+
+def rebuild(user_id=None, batch_size=2000):
+    """Re-index all notes (or one user's) and merge the index into as few segments as possible."""
+    sessions = ReadingSession.objects.only('id', 'user_id', 'book_id', 'notes')
+    with transaction.atomic(), connection.cursor() as cursor:
+        if user_id is None:
+            cursor.execute(f'DELETE FROM {TABLE}')
+        else:
+            sessions = sessions.filter(user_id=user_id)
+            cursor.execute(
+                f'DELETE FROM {TABLE} WHERE rowid IN (SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s)',
+                [f'user_key:{user_key(user_id)}'],
+            )
+
+        indexed = 0
+        batch = []
+        for session in sessions.order_by('id').iterator(chunk_size=batch_size):
+            batch.append(session)
+            if len(batch) >= batch_size:
+                indexed += _index_batch(cursor, batch)
+                batch = []
+        indexed += _index_batch(cursor, batch)
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+    return indexed
+
+
+def _index_batch(cursor, sessions):
+    rows = list(note_rows(sessions))
+    cursor.executemany(f'INSERT INTO {TABLE} (rowid, body, user_key, book_key) VALUES (%s, %s, %s, %s)', rows)
+    return len(rows)
+
+
+def normalize(text):
+    """Case-fold and treat ё as е; unicode61 folds case but keeps ё a separate letter."""
+    return (text or '').casefold().replace('ё', 'е')
+
+
+def fragments(*texts):
+    """
+    Inner suffixes of every word ('мастер' -> 'астер', 'стер', 'тер'). FTS5 only matches terms by
+    prefix, so indexing suffixes turns substring matches into indexed prefix matches.
+    """
+    suffixes = set()
+    for text in texts:
+        for word in TERM_RE.findall(text):
+            suffixes.update(word[start:] for start in range(1, len(word) - MIN_FRAGMENT + 1))
+    return ' '.join(sorted(suffixes))
+
+
+def book_rows(books):
+    for book in books:
+        name, author = normalize(book.name), normalize(book.author)
+        yield name, author, fragments(name, author), user_key(book.user_id), book_key(book.pk)
+
+
+def index_books(books, replace=False):
+    books = list(books)
+    with connection.cursor() as cursor:
+        if replace:
+            for book in books:
+                _unindex_book(cursor, book.pk)
+        cursor.executemany(
+            f'INSERT INTO {BOOK_TABLE} (name, author, fragments, user_key, book_key) VALUES (%s, %s, %s, %s, %s)',
+            list(book_rows(books)),
+        )
+
+
+def unindex_book(book_id):
+    with connection.cursor() as cursor:
+        _unindex_book(cursor, book_id)
+
+
+def _unindex_book(cursor, book_id):
+    cursor.execute(
+        f'DELETE FROM {BOOK_TABLE} WHERE rowid IN (SELECT rowid FROM {BOOK_TABLE} WHERE {BOOK_TABLE} MATCH %s)',
+        [f'book_key:{book_key(book_id)}'],
+    )
+
+
+def book_match_expressions(query, user_id):
+    """
+    FTS5 queries from the most to the least relevant kind of match: word prefixes in the name,
+    word prefixes in the name or author, then substrings anywhere. Empty if there are no words.
+    """
+    terms = TERM_RE.findall(normalize(query))[:MAX_TERMS]
+    if not terms:
+        return []
+
+    def expression(columns, substring=False):
+        parts = []
+        for term in terms:
+            term_columns = columns + ' fragments' if substring and len(term) >= MIN_FRAGMENT else columns
+            parts.append(f'{{{term_columns}}}:"{term}"*')
+        return f'user_key:{user_key(user_id)} AND ' + ' AND '.join(parts)
+
+    return [expression('name'), expression('name author'), expression('name author', substring=True)]
+
+
+def search_books(user, query, limit=20):
+    """
+    Case-insensitive prefix and substring search over the user's book names and authors.
+
+    Instead of ranking every match with bm25, which costs time in proportion to the number of
+    matches, each relevance tier is a separate indexed MATCH with a LIMIT, and the tiers stop as
+    soon as there are enough results.
+    """
+    book_ids = []
+    with connection.cursor() as cursor:
+        for expression in book_match_expressions(query, user.pk):
+            cursor.execute(
+                f'SELECT book_key FROM {BOOK_TABLE} WHERE {BOOK_TABLE} MATCH %s LIMIT %s',
+                [expression, limit + len(book_ids)],
+            )
+            for key, in cursor.fetchall():
+                book_id = uuid.UUID(key[1:])
+                if book_id not in book_ids:
+                    book_ids.append(book_id)
+            if len(book_ids) >= limit:
+                break
+    book_ids = book_ids[:limit]
+
+    books = Book.objects.filter(user=user).only('id', 'name', 'author', 'reading_status').in_bulk(book_ids)
+    return [books[book_id] for book_id in book_ids if book_id in books]
+
+
+def rebuild_books(user_id=None, batch_size=2000):
+    books = Book.objects.only('id', 'user_id', 'name', 'author')
+    with transaction.atomic(), connection.cursor() as cursor:
+        if user_id is None:
+            cursor.execute(f'DELETE FROM {BOOK_TABLE}')
+        else:
+            books = books.filter(user_id=user_id)
+            cursor.execute(
+                f'DELETE FROM {BOOK_TABLE} WHERE rowid IN (SELECT rowid FROM {BOOK_TABLE} WHERE {BOOK_TABLE} MATCH %s)',
+                [f'user_key:{user_key(user_id)}'],
+            )
+
+        indexed = 0
+        batch = []
+        for book in books.order_by('pk').iterator(chunk_size=batch_size):
+            batch.append(book)
+            if len(batch) >= batch_size:
+                indexed += len(batch)
+                index_books(batch)
+                batch = []
+        indexed += len(batch)
+        index_books(batch)
+        cursor.execute(f"INSERT INTO {BOOK_TABLE} ({BOOK_TABLE}) VALUES ('optimize')")
+    return indexed
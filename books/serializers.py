@@ -1,15 +1,42 @@
+import re
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Book, ReadingSession
+
+from witbook.images import rendition_urls
+from . import search, stats
+from .filters import BOOK_ORDERINGS
+from .models import Book, ImportJob, ReadingSession
+
+User = get_user_model()
+
+
+class SparseFieldsMixin:
+    """Takes ``fields``, the names of the fields to keep (all of them when None)."""
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
 
 
-class BookSerializer(serializers.ModelSerializer):
-    notes_amount = serializers.SerializerMethodField()
+class BookSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    notes_amount = serializers.IntegerField(source='notes_count', read_only=True)
+    book_photo_renditions = serializers.SerializerMethodField()
 
     class Meta:
         model = Book
         fields = [
             'id',
             'book_photo',
+            'book_photo_renditions',
             'name',
             'author',
             'pages_amount',
@@ -21,18 +48,80 @@ class BookSerializer(serializers.ModelSerializer):
             'current_page'
         ]
 
-    def get_notes_amount(self, obj):
-        return sum(len(session.notes) for session in obj.sessions.all())
+    def get_book_photo_renditions(self, obj):
+        return rendition_urls(obj.book_photo, self.context.get('request'))
 
     def create(self, validated_data):
         reading_status = validated_data.get('reading_status')
         validated_data['current_page'] = 0
-        return super().create(validated_data)
+        book = super().create(validated_data)
+        User.bump_data_version(book.user_id)
+        return book
+
+
+def page_range(start_page, end_page):
+    if start_page is None or end_page is None:
+        return None
+    return f'{start_page}-{end_page}'
+
+
+def time_range(start_minute, end_minute):
+    if start_minute is None or end_minute is None:
+        return None
+    return '{:02d}:{:02d}-{:02d}:{:02d}'.format(*divmod(start_minute, 60), *divmod(end_minute, 60))
+
 
+class PageRangeField(serializers.CharField):
+    """'10-25' in the API, start_page/end_page on the model; old text that did not parse is kept as is."""
 
-class ReadingSessionSerializer(serializers.ModelSerializer):
-    from_page_to_page = serializers.CharField(required=True)
-    from_time_to_time = serializers.CharField(required=True)
+    PATTERN = re.compile(r'^\s*(\d+)\s*-\s*(\d+)\s*$')
+
+    def __init__(self, **kwargs):
+        super().__init__(source='*', **kwargs)
+
+    def to_internal_value(self, data):
+        match = self.PATTERN.match(super().to_internal_value(data))
+        if not match:
+            raise serializers.ValidationError("Страницы должны быть в формате 'N-M' (например, '10-25')")
+        start_page, end_page = int(match.group(1)), int(match.group(2))
+        if start_page > end_page:
+            raise serializers.ValidationError("Начальная страница не может быть больше конечной")
+        return {'start_page': start_page, 'end_page': end_page}
+
+    def to_representation(self, session):
+        return session.legacy_page_range or page_range(session.start_page, session.end_page)
+
+
+class TimeRangeField(serializers.CharField):
+    """'HH:MM-HH:MM' in the API, start_minute/end_minute (minute of the day) on the model."""
+
+    PATTERN = re.compile(r'^(\d{2}):(\d{2})-(\d{2}):(\d{2})$')
+
+    def __init__(self, **kwargs):
+        super().__init__(source='*', **kwargs)
+
+    def to_internal_value(self, data):
+        match = self.PATTERN.match(super().to_internal_value(data))
+        if not match:
+            raise serializers.ValidationError(
+                "Время должно быть в формате 'HH:MM-HH:MM' (например, '11:23-12:20')"
+            )
+        start_hour, start_minute, end_hour, end_minute = (int(part) for part in match.groups())
+        if max(start_hour, end_hour) > 23 or max(start_minute, end_minute) > 59:
+            raise serializers.ValidationError("Неверный формат времени")
+        return {'start_minute': start_hour * 60 + start_minute, 'end_minute': end_hour * 60 + end_minute}
+
+    def to_representation(self, session):
+        return session.legacy_time_range or time_range(session.start_minute, session.end_minute)
+
+
+class ReadingSessionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    from_page_to_page = PageRangeField()
+    from_time_to_time = TimeRangeField()
+    # The counters, the stats and the search index count notes as the items of a list of strings
+    notes = serializers.ListField(
+        child=serializers.CharField(allow_blank=True, trim_whitespace=False), required=False
+    )
     created_date = serializers.SerializerMethodField()
 
     class Meta:
@@ -47,44 +136,244 @@ class ReadingSessionSerializer(serializers.ModelSerializer):
         if current_page > book.pages_amount:
             raise serializers.ValidationError("Текущая страница не может быть больше общего количества страниц")
 
-        book.current_page = current_page
-        if 0 < current_page < book.pages_amount:
-            book.reading_status = 'now_reading'
-        if current_page == book.pages_amount:
-            book.reading_status = 'finished_reading'
+        book.apply_reading_progress(current_page)
 
-        book.save()
+        with transaction.atomic():
+            book.save(update_fields=['current_page', 'reading_status'])
+            session = super().create(validated_data)
+            Book.adjust_counters(book.pk, notes_delta=len(session.notes or []), sessions_delta=1)
+            stats.record_sessions([session])
+            search.index_sessions([session])
+            User.bump_data_version(session.user_id)
 
-        return super().create(validated_data)
+        return session
 
     def get_created_date(self, obj):
         return obj.created_at.strftime('%d.%m.%Y')
 
-    def validate_from_time_to_time(self, value):
-        import re
-        from datetime import datetime
 
-        pattern = r'^([0-2][0-9]):([0-5][0-9])-([0-2][0-9]):([0-5][0-9])$'
-        if not re.match(pattern, value):
-            raise serializers.ValidationError(
-                "Время должно быть в формате 'HH:MM-HH:MM' (например, '11:23-12:20')"
-            )
+class ReadingStatsQuerySerializer(serializers.Serializer):
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    book_id = serializers.UUIDField(required=False)
+
+    def validate(self, attrs):
+        today = timezone.localdate()
+        attrs.setdefault('date_to', today)
+        attrs.setdefault('date_from', attrs['date_to'] - timedelta(days=6))
+        if attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError("Начальная дата не может быть позже конечной")
+        if (attrs['date_to'] - attrs['date_from']).days >= settings.BOOKS_STATS_MAX_DAYS:
+            raise serializers.ValidationError(f"Период не может быть длиннее {settings.BOOKS_STATS_MAX_DAYS} дней")
+        return attrs
+
+
+class NotesSearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=200)
+    book_id = serializers.UUIDField(required=False)
+    limit = serializers.IntegerField(required=False, min_value=1)
+    offset = serializers.IntegerField(required=False, min_value=0, default=0)
+
+    def validate_q(self, value):
+        if not search.TERM_RE.search(value):
+            raise serializers.ValidationError("Запрос должен содержать хотя бы одно слово")
+        return value
+
+    def validate_limit(self, value):
+        return min(value, settings.BOOKS_MAX_PAGE_SIZE)
+
+
+class ReadingHistogramQuerySerializer(ReadingStatsQuerySerializer):
+    speed_step = serializers.FloatField(required=False, default=0.5, min_value=0.1, max_value=10)
+
+
+class FieldNamesField(serializers.CharField):
+    """A comma-separated list of response field names."""
+
+    def to_internal_value(self, data):
+        return [name.strip() for name in super().to_internal_value(data).split(',') if name.strip()]
+
+
+class SparseFieldsQuerySerializer(serializers.Serializer):
+    """
+    ``?fields=name,author`` or ``?exclude=description`` of a response made by a SparseFieldsMixin
+    serializer; validated_data['fields'] holds the fields to return, in the serializer's order.
+    """
+    response_fields = []
+
+    fields = FieldNamesField(required=False)
+    exclude = FieldNamesField(required=False)
 
-        start_time_str, end_time_str = value.split('-')
+    def validate(self, attrs):
+        for param in ('fields', 'exclude'):
+            unknown = [name for name in attrs.get(param, []) if name not in self.response_fields]
+            if unknown:
+                raise serializers.ValidationError({param: f"Неизвестные поля: {', '.join(unknown)}"})
+        selected = attrs.get('fields') or self.response_fields
+        excluded = attrs.pop('exclude', [])
+        attrs['fields'] = [name for name in self.response_fields if name in selected and name not in excluded]
+        if not attrs['fields']:
+            raise serializers.ValidationError("Нужно оставить хотя бы одно поле")
+        return attrs
+
+
+class ReadingSessionFieldsQuerySerializer(SparseFieldsQuerySerializer):
+    response_fields = ReadingSessionSerializer.Meta.fields
+
+
+class BookListQuerySerializer(SparseFieldsQuerySerializer):
+    response_fields = BookSerializer.Meta.fields
+
+    reading_status = serializers.ChoiceField(choices=Book.READING_STATUS_CHOICES, required=False)
+    author = serializers.CharField(max_length=255, required=False)
+    rating_min = serializers.FloatField(required=False, min_value=0)
+    rating_max = serializers.FloatField(required=False, min_value=0)
+    ordering = serializers.ChoiceField(choices=list(BOOK_ORDERINGS), required=False, default='created_at')
+
+    def validate(self, attrs):
+        if attrs.get('rating_min', 0) > attrs.get('rating_max', float('inf')):
+            raise serializers.ValidationError("Минимальная оценка не может быть больше максимальной")
+        return super().validate(attrs)
+
+
+class BookSearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=200)
+    limit = serializers.IntegerField(required=False, min_value=1)
+
+    def validate_q(self, value):
+        if not search.TERM_RE.search(value):
+            raise serializers.ValidationError("Запрос должен содержать хотя бы одно слово")
+        return value
+
+    def validate_limit(self, value):
+        return min(value, settings.BOOKS_SEARCH_MAX_LIMIT)
+
+
+class BookSuggestionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Book
+        fields = ['id', 'name', 'author', 'reading_status']
+
+
+class ImportUploadSerializer(serializers.Serializer):
+    file = serializers.FileField()
+
+    def validate_file(self, upload):
+        from .imports import InvalidImportFile, parse
 
         try:
-            start_time = datetime.strptime(start_time_str, '%H:%M')
-            end_time = datetime.strptime(end_time_str, '%H:%M')
-
-            start_hour = int(start_time_str.split(':')[0])
-            if start_hour > 23:
-                if start_hour > 24:
-                    raise serializers.ValidationError(
-                        "Час не может быть больше 24"
-                    )
-        except ValueError:
-            raise serializers.ValidationError(
-                "Неверный формат времени"
+            self.rows = parse(upload)
+        except InvalidImportFile as exc:
+            raise serializers.ValidationError(str(exc))
+        return upload
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ImportJob
+        fields = ['id', 'status', 'total', 'processed', 'created', 'errors', 'failure', 'created_at', 'finished_at']
+
+
+class ReadingSessionSyncItemSerializer(ReadingSessionSerializer):
+    book_id = serializers.UUIDField(write_only=True)
+    idempotency_key = serializers.CharField(source='client_id', max_length=64)
+
+    class Meta(ReadingSessionSerializer.Meta):
+        fields = ReadingSessionSerializer.Meta.fields + ['book_id', 'idempotency_key']
+
+
+class ReadingSessionSyncSerializer(serializers.Serializer):
+    sessions = ReadingSessionSyncItemSerializer(many=True, allow_empty=False)
+
+    def validate_sessions(self, sessions):
+        max_sessions = settings.BOOKS_SYNC_MAX_SESSIONS
+        if len(sessions) > max_sessions:
+            raise serializers.ValidationError(f"Не больше {max_sessions} сессий за один запрос")
+
+        books = self._load_books(sessions)
+        errors = []
+        for item in sessions:
+            book = books.get(item['book_id'])
+            if book is None:
+                errors.append({'book_id': ["Книга не найдена"]})
+            elif item['current_page'] > book.pages_amount:
+                errors.append({'current_page': ["Текущая страница не может быть больше общего количества страниц"]})
+            else:
+                errors.append({})
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+        self._books = books
+        return sessions
+
+    def create(self, validated_data):
+        sessions = validated_data['sessions']
+        try:
+            return self._sync(sessions, self._books)
+        except IntegrityError:
+            # A concurrent retry inserted some of the keys first; the second pass reports them as duplicates
+            return self._sync(sessions, self._load_books(sessions))
+
+    def _load_books(self, sessions):
+        user = self.context['request'].user
+        return Book.objects.filter(user=user).only(
+            'id', 'pages_amount', 'current_page', 'reading_status'
+        ).in_bulk({item['book_id'] for item in sessions})
+
+    def _sync(self, sessions, books):
+        user = self.context['request'].user
+
+        with transaction.atomic():
+            keys = [item['client_id'] for item in sessions]
+            seen = set(
+                ReadingSession.objects.filter(user=user, client_id__in=keys).values_list('client_id', flat=True)
+            )
+
+            results = []
+            new_sessions = []
+            deltas = defaultdict(lambda: [0, 0])
+            for item in sessions:
+                key = item['client_id']
+                if key in seen:
+                    results.append({'idempotency_key': key, 'status': 'duplicate'})
+                    continue
+                seen.add(key)
+
+                book = books[item['book_id']]
+                book.apply_reading_progress(item['current_page'])
+                deltas[book.pk][0] += len(item.get('notes') or [])
+                deltas[book.pk][1] += 1
+                new_sessions.append(ReadingSession(
+                    book=book,
+                    user=user,
+                    current_page=item['current_page'],
+                    session_duration=item['session_duration'],
+                    notes=item.get('notes', []),
+                    start_page=item['start_page'],
+                    end_page=item['end_page'],
+                    start_minute=item['start_minute'],
+                    end_minute=item['end_minute'],
+                    client_id=key,
+                ))
+                results.append({'idempotency_key': key, 'status': 'created'})
+
+            ReadingSession.objects.bulk_create(new_sessions)
+            stats.record_sessions(new_sessions)
+            search.index_sessions(new_sessions)
+            for session in new_sessions:
+                session.book.last_session_at = session.created_at
+
+            changed_books = [books[book_id] for book_id in deltas]
+            for book in changed_books:
+                notes_delta, sessions_delta = deltas[book.pk]
+                book.notes_count = F('notes_count') + notes_delta
+                book.sessions_count = F('sessions_count') + sessions_delta
+                book.version = F('version') + 1
+            Book.objects.bulk_update(
+                changed_books,
+                ['current_page', 'reading_status', 'notes_count', 'sessions_count', 'last_session_at', 'version'],
             )
+            if new_sessions:
+                User.bump_data_version(user.pk)
 
-        return value
\ No newline at end of file
+        return results
@@ -0,0 +1,201 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, FloatField, IntegerField, Sum, Value
+from django.db.models.functions import Cast, Greatest, Least
+from django.utils import timezone
+
+from .models import DailyReadingStat, ReadingSession
+
+COUNTERS = ('sessions', 'duration', 'pages', 'notes')
+SPEED_BUCKETS = 10
+
+
+def session_day(created_at):
+    return timezone.localdate(created_at)
+
+
+def collect_deltas(sessions, sign=1):
+    """Sum sessions into {(user_id, book_id, date): {counter: delta}}."""
+    deltas = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    for session in sessions:
+        delta = deltas[(session.user_id, session.book_id, session_day(session.created_at))]
+        delta['sessions'] += sign
+        delta['duration'] += sign * session.session_duration
+        delta['pages'] += sign * session.pages_read
+        delta['notes'] += sign * len(session.notes or [])
+    return deltas
+
+
+def apply_deltas(deltas):
+    if not deltas:
+        return
+
+    user_ids, book_ids, dates = (set(part) for part in zip(*deltas))
+    existing = {
+        (row.user_id, row.book_id, row.date): row
+        for row in DailyReadingStat.objects.filter(user_id__in=user_ids, book_id__in=book_ids, date__in=dates)
+        if (row.user_id, row.book_id, row.date) in deltas
+    }
+
+    for key, row in existing.items():
+        for name, value in deltas[key].items():
+            setattr(row, name, F(name) + value)
+    DailyReadingStat.objects.bulk_update(existing.values(), COUNTERS)
+
+    new_rows = [
+        DailyReadingStat(user_id=user_id, book_id=book_id, date=date, **delta)
+        for (user_id, book_id, date), delta in deltas.items()
+        if (user_id, book_id, date) not in existing
+    ]
+    try:
+        with transaction.atomic():
+            DailyReadingStat.objects.bulk_create(new_rows)
+    except IntegrityError:
+        # A concurrent request created some of the rows first; fall back to row-by-row upserts
+        for row in new_rows:
+            _upsert(row, deltas[(row.user_id, row.book_id, row.date)])
+
+
+def _upsert(row, delta):
+    lookup = {'user_id': row.user_id, 'book_id': row.book_id, 'date': row.date}
+    changes = {name: F(name) + value for name, value in delta.items()}
+    if not DailyReadingStat.objects.filter(**lookup).update(**changes):
+        DailyReadingStat.objects.create(**lookup, **delta)
+
+
+def record_sessions(sessions):
+    apply_deltas(collect_deltas(sessions))
+
+
+def forget_sessions(sessions):
+    apply_deltas(collect_deltas(sessions, sign=-1))
+
+
+def rebuild(user_id=None, batch_size=2000):
+    sessions = ReadingSession.objects.only(
+        'user_id', 'book_id', 'created_at', 'session_duration', 'start_page', 'end_page', 'notes'
+    )
+    rollups = DailyReadingStat.objects.all()
+    if user_id is not None:
+        sessions = sessions.filter(user_id=user_id)
+        rollups = rollups.filter(user_id=user_id)
+
+    deltas = collect_deltas(sessions.iterator(chunk_size=batch_size))
+    with transaction.atomic():
+        rollups.delete()
+        DailyReadingStat.objects.bulk_create(
+            [
+                DailyReadingStat(user_id=user_id, book_id=book_id, date=date, **delta)
+                for (user_id, book_id, date), delta in deltas.items()
+            ],
+            batch_size=batch_size,
+        )
+    return len(deltas)
+
+
+def current_streak(user, today):
+    """Number of consecutive days up to today (or yesterday) with at least one session."""
+    days = (
+        DailyReadingStat.objects.filter(user=user, date__lte=today, sessions__gt=0)
+        .order_by('-date').values_list('date', flat=True).distinct().iterator()
+    )
+    streak = 0
+    expected = today
+    for day in days:
+        if day == expected:
+            streak += 1
+        elif streak == 0 and day == today - timedelta(days=1):
+            streak, expected = 1, day
+        else:
+            break
+        expected = day - timedelta(days=1)
+    return streak
+
+
+def summary(user, date_from, date_to, book_id=None):
+    rollups = DailyReadingStat.objects.filter(user=user, date__range=(date_from, date_to))
+    if book_id is not None:
+        rollups = rollups.filter(book_id=book_id)
+    per_day = {
+        row['date']: row
+        for row in rollups.values('date').annotate(**{name: Sum(name) for name in COUNTERS})
+    }
+
+    days = []
+    totals = dict.fromkeys(COUNTERS, 0)
+    day = date_from
+    while day <= date_to:
+        row = per_day.get(day, {})
+        values = {name: row.get(name) or 0 for name in COUNTERS}
+        for name in COUNTERS:
+            totals[name] += values[name]
+        days.append({'date': day.isoformat(), **values})
+        day += timedelta(days=1)
+
+    return {
+        'from': date_from.isoformat(),
+        'to': date_to.isoformat(),
+        'totals': totals,
+        'pages_per_day': round(totals['pages'] / len(days), 2),
+        'duration_per_day': round(totals['duration'] / len(days), 2),
+        'streak': current_streak(user, timezone.localdate()),
+        'days': days,
+    }
+
+
+def histograms(user, date_from, date_to, book_id=None, speed_step=0.5):
+    """
+    Reading time by hour of day (the hour a session started, device-local) and sessions by
+    reading speed in pages per minute. Both are GROUP BY queries over the user's sessions.
+    """
+    start = timezone.make_aware(datetime.combine(date_from, time.min))
+    end = timezone.make_aware(datetime.combine(date_to + timedelta(days=1), time.min))
+    sessions = ReadingSession.objects.filter(user=user, created_at__gte=start, created_at__lt=end)
+    if book_id is not None:
+        sessions = sessions.filter(book_id=book_id)
+    pages = Greatest(F('end_page') - F('start_page'), Value(0))
+
+    per_hour = {
+        row['hour']: row
+        for row in sessions.filter(start_minute__isnull=False)
+        .values(hour=F('start_minute') / 60)
+        .annotate(sessions=Count('id'), minutes=Sum('session_duration'), pages=Sum(pages))
+        .order_by()
+    }
+    hours = []
+    for hour in range(24):
+        row = per_hour.get(hour, {})
+        minutes, pages_total = row.get('minutes') or 0, row.get('pages') or 0
+        hours.append({
+            'hour': hour,
+            'sessions': row.get('sessions', 0),
+            'minutes': minutes,
+            'pages': pages_total,
+            'pages_per_minute': round(pages_total / minutes, 2) if minutes else 0,
+        })
+
+    speed = Cast(pages, FloatField()) / F('session_duration')
+    per_bucket = {
+        row['bucket']: row['sessions']
+        for row in sessions.filter(session_duration__gt=0, start_page__isnull=False, end_page__isnull=False)
+        .values(bucket=Least(Cast(speed / speed_step, IntegerField()), Value(SPEED_BUCKETS - 1)))
+        .annotate(sessions=Count('id'))
+        .order_by()
+    }
+    buckets = [
+        {
+            'from': round(bucket * speed_step, 2),
+            'to': round((bucket + 1) * speed_step, 2) if bucket < SPEED_BUCKETS - 1 else None,
+            'sessions': per_bucket.get(bucket, 0),
+        }
+        for bucket in range(SPEED_BUCKETS)
+    ]
+
+    return {
+        'from': date_from.isoformat(),
+        'to': date_to.isoformat(),
+        'hours': hours,
+        'speed': buckets,
+    }
@@ -0,0 +1,9 @@
+from tasks.runner import task
+from . import imports
+
+
+# The default attempts resume the job after a worker that died; a job that raised is already
+# marked failed, so retrying its task does nothing
+@task(timeout=600)
+def import_library(job_id):
+    imports.run_import(job_id)
@@ -1,3 +1,1363 @@
-from django.test import TestCase
+import csv
+import gzip
+import importlib
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from asgiref.sync import async_to_sync, sync_to_async
+from django.db import connection
+from django.db.models import F
+from django.db.migrations.executor import MigrationExecutor
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from tasks.models import Task
+from users import async_views as users_async_views
+from tasks.runner import claim, execute, run_pending
+from witbook.renderers import FastJSONRenderer
+
+from . import async_views, cache as response_cache, imports, search
+from .management.commands.bench_api import NOT_MEASURED, SCENARIOS
+from .filters import filter_books
+from .models import Book, ImportJob, ReadingSession
+from .serializers import BookSerializer
+
+User = get_user_model()
+
+
+def make_book(user, **kwargs):
+    data = {
+        'name': 'Мастер и Маргарита',
+        'author': 'Булгаков',
+        'pages_amount': 400,
+        'description': 'Роман',
+        'reading_status': 'will_read',
+        'current_page': 0,
+    }
+    data.update(kwargs)
+    return Book.objects.create(user=user, **data)
+
+
+def make_jpeg(size=(1200, 900), orientation=None):
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = BytesIO()
+    Image.new('RGB', size, (200, 10, 10)).save(buffer, 'JPEG', exif=exif)
+    return SimpleUploadedFile('cover.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+
+class BookApiTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='reader@example.com', email='reader@example.com', password='secret-pass-123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        response_cache.get_cache().clear()
+
+    def create_session(self, book, **kwargs):
+        data = {
+            'session_duration': 30,
+            'from_page_to_page': '1-10',
+            'from_time_to_time': '10:00-10:30',
+            'notes': ['первая', 'вторая'],
+            'current_page': 10,
+        }
+        data.update(kwargs)
+        return self.client.post(
+            reverse('create_session', kwargs={'book_id': book.id}), data, format='json'
+        )
+
+
+class BookCountersTests(BookApiTestCase):
+    def test_session_create_updates_counters(self):
+        book = make_book(self.user)
+        self.assertEqual(self.create_session(book).status_code, 201)
+        self.assertEqual(self.create_session(book, notes=['третья'], current_page=20).status_code, 201)
+
+        book.refresh_from_db()
+        self.assertEqual(book.notes_count, 3)
+        self.assertEqual(book.sessions_count, 2)
+        self.assertEqual(book.current_page, 20)
+        self.assertEqual(book.reading_status, 'now_reading')
+
+    def test_notes_must_be_a_list_of_strings(self):
+        book = make_book(self.user)
+        for notes in ({'первая': 'вторая'}, 'заметка', [{'text': 'заметка'}]):
+            response = self.create_session(book, notes=notes)
+            self.assertEqual(response.status_code, 400, notes)
+        book.refresh_from_db()
+        self.assertEqual((book.notes_count, book.sessions_count), (0, 0))
+
+    def test_session_delete_updates_counters(self):
+        book = make_book(self.user)
+        self.create_session(book)
+        self.create_session(book, notes=['третья'])
+        self.create_session(book, notes=[])
+
+        book.sessions.filter(notes=[]).delete()
+        book.refresh_from_db()
+        self.assertEqual((book.notes_count, book.sessions_count), (3, 2))
+
+        book.sessions.first().delete()
+        book.refresh_from_db()
+        self.assertEqual(book.sessions_count, 1)
+        self.assertEqual(book.notes_count, sum(len(s.notes) for s in book.sessions.all()))
+
+    def test_backfill_command(self):
+        book = make_book(self.user)
+        self.create_session(book)
+        Book.objects.filter(pk=book.pk).update(notes_count=0, sessions_count=0)
+        url = reverse('book_details', kwargs={'book_id': book.id})
+        etags = [self.client.get(url)['ETag'], self.client.get(reverse('book_list'))['ETag']]
+
+        call_command('backfill_book_counters', stdout=StringIO())
+        book.refresh_from_db()
+        self.assertEqual((book.notes_count, book.sessions_count), (2, 1))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etags[0]).status_code, 200)
+        response = self.client.get(reverse('book_list'), HTTP_IF_NONE_MATCH=etags[1])
+        self.assertEqual(response.data[0]['notes_amount'], 2)
+
+        # Nothing to fix, nothing bumped
+        version = User.objects.get(pk=self.user.pk).data_version
+        call_command('backfill_book_counters', stdout=StringIO())
+        self.assertEqual(User.objects.get(pk=self.user.pk).data_version, version)
+
+    @override_settings(BOOKS_CACHE_ENABLED=False)
+    def test_list_query_count_is_constant(self):
+        url = reverse('book_list')
+        book = make_book(self.user)
+        self.create_session(book)
+        # The user's data_version and the books
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.data[0]['notes_amount'], 2)
+
+        for _ in range(20):
+            self.create_session(make_book(self.user), notes=['заметка'])
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data), 21)
+
+
+class CursorPaginationTests(BookApiTestCase):
+    def test_list_without_cursor_returns_plain_list(self):
+        make_book(self.user)
+        response = self.client.get(reverse('book_list'))
+        self.assertIsInstance(response.data, list)
+
+    def test_book_list_pages_cover_library_once(self):
+        ids = {str(make_book(self.user, name=f'Книга {i}').id) for i in range(7)}
+        seen = []
+        url = reverse('book_list') + '?page_size=3'
+        while url:
+            response = self.client.get(url)
+            self.assertLessEqual(len(response.data['results']), 3)
+            seen.extend(book['id'] for book in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(set(seen), ids)
+
+    def walk(self, params):
+        seen = []
+        url = reverse('book_list') + '?' + params
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(book['id'] for book in response.data['results'])
+            url = response.data['next']
+            # A cursor that repeats pages would never finish
+            self.assertLessEqual(len(seen), Book.objects.count())
+        return seen
+
+    def test_pages_cover_more_than_a_thousand_tied_keys_once(self):
+        Book.objects.bulk_create([
+            Book(user=self.user, name=f'Книга {i}', author='Автор', pages_amount=100, reading_status='will_read')
+            for i in range(1250)
+        ])
+        Book.objects.filter(user=self.user).update(created_at=timezone.now())
+        ids = {str(pk) for pk in Book.objects.filter(user=self.user).values_list('id', flat=True)}
+
+        for params in ('ordering=rating&page_size=200', 'ordering=-created_at&page_size=200'):
+            with self.subTest(params=params):
+                seen = self.walk(params)
+                self.assertEqual(len(seen), len(ids))
+                self.assertEqual(set(seen), ids)
+
+    def test_legacy_created_at_ties_are_staggered(self):
+        migration = importlib.import_module('books.migrations.0013_book_created_at_backfill')
+        books = [make_book(self.user, name=f'Книга {i}') for i in range(3)]
+        other = make_book(self.user, name='Новая')
+        tie = timezone.now() - timedelta(days=1)
+        Book.objects.filter(pk__in=[book.pk for book in books]).update(created_at=tie)
+
+        migration.stagger_created_at(django_apps, None)
+        created = list(Book.objects.filter(user=self.user).order_by('created_at').values_list('id', 'created_at'))
+        self.assertEqual([pk for pk, _ in created], [book.pk for book in books] + [other.pk])
+        self.assertEqual(len({value for _, value in created}), 4)
+        self.assertLess(created[2][1], tie)
+
+    def test_previous_link_returns_the_page_before(self):
+        for i in range(5):
+            make_book(self.user, name=f'Книга {i}')
+        first = self.client.get(reverse('book_list'), {'page_size': 2}).data
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNotNone(back['next'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('book_list'), {'cursor': 'xyz'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_session_history_is_paginated(self):
+        book = make_book(self.user)
+        for page in range(1, 6):
+            self.create_session(book, current_page=page * 10)
+        url = reverse('book_details', kwargs={'book_id': book.id})
+
+        first = self.client.get(url, {'page_size': 2}).data
+        self.assertEqual([s['current_page'] for s in first['results']], [10, 20])
+        second = self.client.get(first['next']).data
+        self.assertEqual([s['current_page'] for s in second['results']], [30, 40])
+
+
+class BookListFilterTests(BookApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.unread = make_book(self.user, name='Бесы', author='Достоевский', pages_amount=700)
+        self.half = make_book(self.user, name='Идиот', author='Достоевский', star_rate=4.5, pages_amount=600)
+        self.done = make_book(self.user, name='Нос', author='Гоголь', star_rate=3.0, pages_amount=50)
+        self.create_session(self.half, current_page=300)
+        self.create_session(self.done, current_page=50)
+
+    def names(self, **params):
+        response = self.client.get(reverse('book_list'), params)
+        self.assertEqual(response.status_code, 200)
+        return [book['name'] for book in response.data]
+
+    def test_filters(self):
+        self.assertEqual(self.names(reading_status='now_reading'), ['Идиот'])
+        self.assertEqual(self.names(author='Достоевский'), ['Бесы', 'Идиот'])
+        self.assertEqual(self.names(rating_min=4), ['Идиот'])
+        self.assertEqual(self.names(rating_max=4), ['Нос'])
+        self.assertEqual(self.names(author='Достоевский', reading_status='will_read'), ['Бесы'])
+        self.assertEqual(self.client.get(reverse('book_list'), {'rating_min': 5, 'rating_max': 1}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('book_list'), {'ordering': 'name'}).status_code, 400)
+
+    def test_ordering(self):
+        self.assertEqual(self.names(ordering='-rating'), ['Идиот', 'Нос', 'Бесы'])
+        self.assertEqual(self.names(ordering='-progress'), ['Нос', 'Идиот', 'Бесы'])
+        self.assertEqual(self.names(ordering='-last_session'), ['Нос', 'Идиот', 'Бесы'])
+
+        self.create_session(self.half, current_page=310)
+        self.user.refresh_from_db()
+        self.assertEqual(self.names(ordering='-last_session'), ['Идиот', 'Нос', 'Бесы'])
+        ReadingSession.objects.filter(book=self.half).delete()
+        self.user.refresh_from_db()
+        self.half.refresh_from_db()
+        self.assertIsNone(self.half.last_session_at)
+        self.assertEqual(self.names(ordering='-last_session')[0], 'Нос')
+
+    def test_sorted_pages_cover_library_once(self):
+        for i in range(5):
+            make_book(self.user, name=f'Книга {i}', star_rate=4.5)
+        seen = []
+        url = reverse('book_list') + '?page_size=2&ordering=-rating'
+        while url:
+            response = self.client.get(url)
+            seen.extend(book['name'] for book in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(len(seen), 8)
+        self.assertEqual(seen[-2:], ['Нос', 'Бесы'])
+
+    def test_filters_use_indexes(self):
+        books = Book.objects.filter(user=self.user)
+        cases = [
+            ({'reading_status': 'now_reading'}, 'book_user_status_idx'),
+            ({'author': 'Гоголь'}, 'book_user_author_idx'),
+            ({'rating_min': 4.0, 'rating_max': 5.0, 'ordering': '-rating'}, 'book_user_rating_idx'),
+            ({'ordering': 'rating'}, 'book_user_rating_idx'),
+            ({'ordering': '-progress'}, 'book_user_progress_idx'),
+            ({'ordering': '-last_session'}, 'book_user_activity_idx'),
+            ({}, 'book_user_created_idx'),
+        ]
+        for params, index in cases:
+            with self.subTest(params=params):
+                queryset, ordering = filter_books(books, params)
+                plan = queryset.order_by(*ordering).explain()
+                self.assertIn(index, plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+        plan = self.half.sessions.order_by('-created_at').explain()
+        self.assertIn('session_book_created_idx', plan)
+
+    def test_filtered_list_query_count_is_constant(self):
+        for _ in range(10):
+            make_book(self.user, author='Гоголь', star_rate=5.0)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('book_list'), {'author': 'Гоголь', 'ordering': '-rating'})
+        self.assertEqual(len(response.data), 11)
+
+
+class BookPhotoRenditionTests(BookApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_DELETE_GRACE=0)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, True)
+
+    def create_book_with_photo(self, photo):
+        response = self.client.post(reverse('book_create'), {
+            'name': 'Идиот',
+            'author': 'Достоевский',
+            'pages_amount': 600,
+            'description': 'Роман',
+            'reading_status': 'will_read',
+            'book_photo': photo,
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return response.data['data']
+
+    def test_renditions_are_made_by_the_task_worker(self):
+        data = self.create_book_with_photo(make_jpeg())
+        name = data['book_photo_renditions']['thumbnail']['webp'].split('/media/', 1)[-1]
+        self.assertFalse(default_storage.exists(name))
+        self.assertEqual(Task.objects.get().name, 'witbook.images.render_image')
+
+        run_pending()
+        self.assertTrue(default_storage.exists(name))
+
+    def test_upload_is_normalized_and_renditions_are_exposed(self):
+        data = self.create_book_with_photo(make_jpeg(orientation=6))
+        run_pending()
+
+        book = Book.objects.get(pk=data['id'])
+        with Image.open(book.book_photo.path) as original:
+            self.assertEqual(original.size, (900, 1200))
+            self.assertNotIn(0x0112, original.getexif())
+
+        renditions = data['book_photo_renditions']
+        self.assertEqual(set(renditions), {'thumbnail', 'detail'})
+        for rendition, size in (('thumbnail', (200, 300)), ('detail', (800, 1200))):
+            for extension in ('webp', 'jpg'):
+                self.assertIn('renditions/', renditions[rendition][extension])
+                name = renditions[rendition][extension].split('/media/', 1)[-1]
+                with default_storage.open(name) as image_file, Image.open(image_file) as image:
+                    self.assertLessEqual(image.size[0], size[0])
+                    self.assertLessEqual(image.size[1], size[1])
+
+    def test_renditions_are_deleted_with_book(self):
+        data = self.create_book_with_photo(make_jpeg())
+        run_pending()
+        photo = Book.objects.get(pk=data['id']).book_photo.name
+        name = data['book_photo_renditions']['thumbnail']['webp'].split('/media/', 1)[-1]
+        self.assertTrue(default_storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('book_delete', kwargs={'book_id': data['id']}))
+        # the request only queues the removal
+        self.assertTrue(default_storage.exists(photo))
+        run_pending()
+        self.assertFalse(default_storage.exists(photo))
+        self.assertFalse(default_storage.exists(name))
+
+    def test_identical_uploads_are_stored_once(self):
+        first = self.create_book_with_photo(make_jpeg())
+        second = self.create_book_with_photo(make_jpeg())
+        run_pending()
+        name = Book.objects.get(pk=first['id']).book_photo.name
+        self.assertRegex(name, r'^book_photos/[0-9a-f]{64}\.jpg$')
+        self.assertEqual(Book.objects.get(pk=second['id']).book_photo.name, name)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'book_photos'))), 2)  # the file, renditions/
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('book_delete', kwargs={'book_id': first['id']}))
+        run_pending()
+        self.assertTrue(default_storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('book_delete', kwargs={'book_id': second['id']}))
+        run_pending()
+        self.assertFalse(default_storage.exists(name))
+
+    @override_settings(MEDIA_DELETE_GRACE=60)
+    def test_recent_upload_is_not_deleted(self):
+        data = self.create_book_with_photo(make_jpeg())
+        name = Book.objects.get(pk=data['id']).book_photo.name
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('book_delete', kwargs={'book_id': data['id']}))
+        run_pending()
+
+        # the same image may be uploaded again by a request that has not committed yet
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(Task.objects.get().args, [[name]])
+
+    def test_regenerate_command(self):
+        data = self.create_book_with_photo(make_jpeg())
+        name = data['book_photo_renditions']['detail']['jpg'].split('/media/', 1)[-1]
+        run_pending()
+        default_storage.delete_now(name)
+
+        call_command('regenerate_renditions', only='books', stdout=StringIO())
+        self.assertTrue(default_storage.exists(name))
+
+
+class ReadingSessionSyncTests(BookApiTestCase):
+    def sync(self, sessions):
+        return self.client.post(reverse('sync_sessions'), {'sessions': sessions}, format='json')
+
+    def session_payload(self, book, key, current_page, notes=()):
+        return {
+            'book_id': str(book.id),
+            'idempotency_key': key,
+            'session_duration': 15,
+            'from_page_to_page': '1-10',
+            'from_time_to_time': '08:00-08:15',
+            'notes': list(notes),
+            'current_page': current_page,
+        }
+
+    def test_sync_creates_sessions_across_books(self):
+        first, second = make_book(self.user, pages_amount=100), make_book(self.user, pages_amount=50)
+        payload = [
+            self.session_payload(first, 'a-1', 10, ['x']),
+            self.session_payload(second, 'b-1', 50),
+            self.session_payload(first, 'a-2', 40, ['y', 'z']),
+        ]
+        response = self.sync(payload)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['status'] for r in response.data['results']], ['created'] * 3)
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.current_page, first.reading_status), (40, 'now_reading'))
+        self.assertEqual((first.notes_count, first.sessions_count), (3, 2))
+        self.assertEqual((second.current_page, second.reading_status), (50, 'finished_reading'))
+
+    def test_retry_does_not_duplicate_sessions(self):
+        book = make_book(self.user)
+        payload = [self.session_payload(book, 'k-1', 10), self.session_payload(book, 'k-1', 10)]
+        self.assertEqual(
+            [r['status'] for r in self.sync(payload).data['results']], ['created', 'duplicate']
+        )
+        self.assertEqual(
+            [r['status'] for r in self.sync(payload[:1]).data['results']], ['duplicate']
+        )
+        book.refresh_from_db()
+        self.assertEqual(book.sessions.count(), 1)
+        self.assertEqual(book.sessions_count, 1)
+
+    def test_invalid_item_rejects_whole_batch(self):
+        book = make_book(self.user, pages_amount=100)
+        foreign = make_book(User.objects.create_user(username='other', email='other@example.com', password='x'))
+        response = self.sync([
+            self.session_payload(book, 'ok', 10),
+            self.session_payload(book, 'too-far', 500),
+            self.session_payload(foreign, 'foreign', 1),
+        ])
+        self.assertEqual(response.status_code, 400)
+        errors = response.data['details']['sessions']
+        self.assertEqual(errors[0], {})
+        self.assertIn('current_page', errors[1])
+        self.assertIn('book_id', errors[2])
+        self.assertFalse(ReadingSession.objects.exists())
+
+    def test_sync_query_count_does_not_grow_with_batch(self):
+        books = [make_book(self.user) for _ in range(5)]
+        payload = [self.session_payload(book, f'{i}-{n}', n) for i, book in enumerate(books) for n in (1, 2)]
+        with self.assertNumQueries(13):
+            self.assertEqual(self.sync(payload).status_code, 200)
+
+
+class ConditionalGetTests(BookApiTestCase):
+    def get(self, url, etag=None):
+        self.user.refresh_from_db()
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(url, **headers)
+
+    def test_book_list_etag_changes_on_writes(self):
+        url = reverse('book_list')
+        book = make_book(self.user)
+        etag = self.get(url)['ETag']
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.create_session(book)
+        response = self.get(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        etag = response['ETag']
+        self.client.delete(reverse('book_delete', kwargs={'book_id': book.id}))
+        self.assertEqual(self.get(url, etag).status_code, 200)
+
+    def test_etag_depends_on_query_string(self):
+        make_book(self.user)
+        url = reverse('book_list')
+        self.assertNotEqual(self.get(url)['ETag'], self.get(url + '?page_size=1')['ETag'])
+
+    def test_book_details_etag(self):
+        book = make_book(self.user)
+        url = reverse('book_details', kwargs={'book_id': book.id})
+        etag = self.get(url)['ETag']
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.create_session(book)
+        self.assertEqual(self.get(url, etag).status_code, 200)
+
+    def test_missing_book_has_no_etag(self):
+        response = self.get(reverse('book_details', kwargs={'book_id': '00000000-0000-0000-0000-000000000000'}))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class ResponseCacheTests(BookApiTestCase):
+    def setUp(self):
+        super().setUp()
+        response_cache.reset_stats()
+
+    def get(self, url):
+        self.user.refresh_from_db()
+        return self.client.get(url)
+
+    def test_list_is_served_from_cache_until_a_write(self):
+        url = reverse('book_list')
+        book = make_book(self.user)
+        first = self.get(url).data
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).data, first)
+        self.assertEqual(response_cache.stats(), {'hits': 1, 'misses': 1})
+
+        self.create_session(book)
+        self.assertEqual(self.get(url).data[0]['notes_amount'], 2)
+
+        self.client.post(reverse('book_create'), {
+            'name': 'Анна Каренина', 'author': 'Толстой', 'pages_amount': 800,
+            'description': 'Роман', 'reading_status': 'will_read',
+        }, format='json')
+        self.assertEqual(len(self.get(url).data), 2)
+
+    def test_write_in_another_process_is_seen_despite_a_cached_user(self):
+        url = reverse('book_list')
+        make_book(self.user)
+        response = self.get(url)
+        self.assertEqual(len(response.data), 1)
+
+        # Another worker adds a book: this process's cached user (self.user here) keeps the old version
+        make_book(self.user, name='Анна Каренина')
+        User.objects.filter(pk=self.user.pk).update(data_version=F('data_version') + 1)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        self.assertEqual(len(self.client.get(url).data), 2)
+
+    def test_details_cache_follows_session_writes_and_delete(self):
+        book = make_book(self.user)
+        url = reverse('book_details', kwargs={'book_id': book.id})
+        self.assertEqual(self.get(url).data, [])
+
+        self.create_session(book)
+        self.assertEqual(len(self.get(url).data), 1)
+
+        self.client.delete(reverse('book_delete', kwargs={'book_id': book.id}))
+        self.assertEqual(self.get(url).status_code, 404)
+
+    @override_settings(BOOKS_CACHE_ENABLED=False)
+    def test_cache_can_be_disabled(self):
+        make_book(self.user)
+        url = reverse('book_list')
+        self.get(url)
+        with self.assertNumQueries(2):
+            self.client.get(url)
+        self.assertEqual(response_cache.stats(), {'hits': 0, 'misses': 0})
+
+
+class ReadingStatsTests(BookApiTestCase):
+    def stats(self, **params):
+        response = self.client.get(reverse('reading_stats'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_rollups_follow_session_writes(self):
+        book = make_book(self.user)
+        self.create_session(book, from_page_to_page='1-11', session_duration=20)
+        self.create_session(book, from_page_to_page='11-31', session_duration=40, notes=[])
+
+        data = self.stats()
+        self.assertEqual(data['totals'], {'sessions': 2, 'duration': 60, 'pages': 30, 'notes': 2})
+        self.assertEqual(data['days'][-1]['date'], timezone.localdate().isoformat())
+        self.assertEqual(len(data['days']), 7)
+        self.assertEqual(data['streak'], 1)
+
+        book.sessions.filter(notes=[]).delete()
+        self.assertEqual(self.stats()['totals'], {'sessions': 1, 'duration': 20, 'pages': 10, 'notes': 2})
+
+    def test_rebuild_matches_incremental_rollups_and_counts_streak(self):
+        book = make_book(self.user)
+        for days_ago in (0, 1, 2, 4):
+            self.create_session(book)
+            ReadingSession.objects.filter(pk=book.sessions.latest('id').pk).update(
+                created_at=timezone.now() - timedelta(days=days_ago)
+            )
+
+        call_command('rebuild_reading_stats', stdout=StringIO())
+        data = self.stats()
+        self.assertEqual(data['totals']['sessions'], 4)
+        self.assertEqual(data['streak'], 3)
+        self.assertEqual([day['sessions'] for day in data['days']], [0, 0, 1, 0, 1, 1, 1])
+
+    def test_stats_query_count_is_constant(self):
+        book = make_book(self.user)
+        self.create_session(book)
+        with self.assertNumQueries(2):
+            self.stats(date_from='2020-01-01', date_to='2020-12-31')
+
+    def test_invalid_range(self):
+        response = self.client.get(reverse('reading_stats'), {'date_from': '2024-02-01', 'date_to': '2024-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+
+class SessionRangesTests(BookApiTestCase):
+    def test_ranges_are_stored_as_integers(self):
+        book = make_book(self.user)
+        response = self.create_session(book, from_page_to_page='12 - 40', from_time_to_time='23:30-00:15')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['from_page_to_page'], '12-40')
+        self.assertEqual(response.data['from_time_to_time'], '23:30-00:15')
+
+        session = book.sessions.get()
+        self.assertEqual((session.start_page, session.end_page), (12, 40))
+        self.assertEqual((session.start_minute, session.end_minute), (23 * 60 + 30, 15))
+
+    def test_legacy_text_is_returned(self):
+        book = make_book(self.user)
+        ReadingSession.objects.create(
+            book=book, user=self.user, current_page=5, session_duration=10,
+            start_page=5, end_page=7, legacy_page_range='стр. 5-7', legacy_time_range='25:00-26:00',
+        )
+        url = reverse('book_details', kwargs={'book_id': book.id})
+        for fast in (False, True):
+            with self.subTest(fast=fast), override_settings(BOOKS_FAST_SERIALIZATION=fast, BOOKS_CACHE_ENABLED=False):
+                session = self.client.get(url).data[0]
+                self.assertEqual(session['from_page_to_page'], 'стр. 5-7')
+                self.assertEqual(session['from_time_to_time'], '25:00-26:00')
+
+    def test_invalid_ranges(self):
+        book = make_book(self.user)
+        for data in (
+            {'from_time_to_time': '24:00-01:00'},
+            {'from_time_to_time': '10:00'},
+            {'from_page_to_page': 'с десятой'},
+            {'from_page_to_page': '40-12'},
+        ):
+            with self.subTest(data=data):
+                self.assertEqual(self.create_session(book, **data).status_code, 400)
+
+
+class MigrationTestCase(TransactionTestCase):
+    """Migrates the test database to ``before``/``after`` and back to the latest state afterwards."""
+    before = after = None
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+
+class StructuredRangesMigrationTests(MigrationTestCase):
+    before = [('books', '0010_book_list_filters')]
+    after = [('books', '0011_session_structured_ranges')]
+
+    def test_text_that_does_not_parse_is_kept(self):
+        user = User.objects.create_user(username='reader', email='reader@example.com', password='secret-pass-123')
+        apps = self.migrate(self.before)
+        book = apps.get_model('books', 'Book').objects.create(
+            user_id=user.pk, name='Идиот', author='Достоевский', pages_amount=600, reading_status='now_reading',
+        )
+        values = {
+            '10-20': ('10:00-10:30', (10, 20, None), (600, 630, None)),
+            '15': ('25:00-26:00', (None, None, '15'), (None, None, '25:00-26:00')),
+            '10–20': ('', (None, None, '10–20'), (None, None, None)),
+            'стр. 5-7': (None, (5, 7, 'стр. 5-7'), (None, None, None)),
+        }
+        ReadingSession = apps.get_model('books', 'ReadingSession')
+        for pages, (minutes, _, _) in values.items():
+            ReadingSession.objects.create(
+                book=book, user_id=user.pk, current_page=1, session_duration=10,
+                from_page_to_page=pages, from_time_to_time=minutes,
+            )
+
+        apps = self.migrate(self.after)
+        sessions = apps.get_model('books', 'ReadingSession').objects.order_by('id')
+        for session, (pages, (_, expected_pages, expected_minutes)) in zip(sessions, values.items()):
+            with self.subTest(pages=pages):
+                self.assertEqual((session.start_page, session.end_page, session.legacy_page_range), expected_pages)
+                self.assertEqual(
+                    (session.start_minute, session.end_minute, session.legacy_time_range), expected_minutes
+                )
+
+        apps = self.migrate(self.before)
+        sessions = apps.get_model('books', 'ReadingSession').objects.order_by('id')
+        self.assertEqual([session.from_page_to_page for session in sessions], list(values))
+        self.assertEqual(
+            [session.from_time_to_time for session in sessions], ['10:00-10:30', '25:00-26:00', None, None]
+        )
+
+
+class ReadingStatsMigrationTests(MigrationTestCase):
+    before = [('books', '0006_book_version')]
+    after = [('books', '0007_dailyreadingstat')]
+
+    def test_existing_sessions_are_rolled_up(self):
+        user = User.objects.create_user(username='reader', email='reader@example.com', password='secret-pass-123')
+        apps = self.migrate(self.before)
+        book = apps.get_model('books', 'Book').objects.create(
+            user_id=user.pk, name='Идиот', author='Достоевский', pages_amount=600, reading_status='now_reading',
+        )
+        ReadingSession = apps.get_model('books', 'ReadingSession')
+        for pages, notes in (('10-20', ['первая']), ('20-50', ['вторая', 'третья']), ('стр. 5', [])):
+            ReadingSession.objects.create(
+                book=book, user_id=user.pk, current_page=1, session_duration=10,
+                from_page_to_page=pages, from_time_to_time='10:00-10:10', notes=notes,
+            )
+        yesterday = timezone.now() - timedelta(days=1)
+        ReadingSession.objects.filter(from_page_to_page='стр. 5').update(created_at=yesterday)
+
+        apps = self.migrate(self.after)
+        rollups = apps.get_model('books', 'DailyReadingStat').objects.order_by('date')
+        self.assertEqual(
+            [(row.date, row.sessions, row.duration, row.pages, row.notes) for row in rollups],
+            [(timezone.localdate(yesterday), 1, 10, 0, 0), (timezone.localdate(), 2, 20, 40, 3)],
+        )
+
+
+class ReadingHistogramTests(BookApiTestCase):
+    def histogram(self, **params):
+        response = self.client.get(reverse('reading_histogram'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_hours_and_speed(self):
+        book = make_book(self.user)
+        self.create_session(book, from_time_to_time='08:10-08:40', from_page_to_page='1-31', session_duration=30)
+        self.create_session(book, from_time_to_time='08:50-09:10', from_page_to_page='31-41', session_duration=20)
+        self.create_session(book, from_time_to_time='21:00-23:00', from_page_to_page='41-341', session_duration=120)
+
+        data = self.histogram()
+        self.assertEqual(len(data['hours']), 24)
+        self.assertEqual(
+            data['hours'][8], {'hour': 8, 'sessions': 2, 'minutes': 50, 'pages': 40, 'pages_per_minute': 0.8}
+        )
+        self.assertEqual(data['hours'][21]['pages_per_minute'], 2.5)
+        self.assertEqual(data['hours'][9]['sessions'], 0)
+
+        # 1.0, 0.5 and 2.5 pages per minute
+        self.assertEqual([bucket['sessions'] for bucket in data['speed'][:6]], [0, 1, 1, 0, 0, 1])
+        self.assertEqual(data['speed'][1], {'from': 0.5, 'to': 1.0, 'sessions': 1})
+        self.assertIsNone(data['speed'][-1]['to'])
+
+        data = self.histogram(speed_step=1)
+        self.assertEqual([bucket['sessions'] for bucket in data['speed'][:3]], [1, 1, 1])
+
+    def test_histogram_query_count_is_constant(self):
+        book = make_book(self.user)
+        for _ in range(5):
+            self.create_session(book)
+        with self.assertNumQueries(2):
+            self.histogram(book_id=book.id)
+
+
+class NotesSearchTests(BookApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.book = make_book(self.user)
+        self.other_book = make_book(self.user, name='Идиот', author='Достоевский')
+        self.create_session(self.book, notes=['Воланд появляется на Патриарших прудах', 'кот Бегемот'])
+        self.create_session(self.other_book, notes=['Князь Мышкин возвращается в Петербург'], current_page=20)
+
+    def search(self, **params):
+        return self.client.get(reverse('search_notes'), params)
+
+    def test_finds_ranked_snippets_with_references(self):
+        response = self.search(q='бегемот')
+        self.assertEqual(response.status_code, 200)
+        [hit] = response.data['results']
+        self.assertEqual(hit['book_id'], self.book.id)
+        self.assertEqual(hit['book_name'], 'Мастер и Маргарита')
+        self.assertEqual(hit['note_index'], 1)
+        self.assertEqual(hit['snippet'], 'кот <b>Бегемот</b>')
+        self.assertEqual(hit['session_id'], ReadingSession.objects.get(book=self.book).id)
+
+        # prefix match covers other word forms
+        self.assertEqual(len(self.search(q='Патриарш').data['results']), 1)
+        self.assertEqual(len(self.search(q='князь петерб').data['results']), 1)
+        self.assertEqual(self.search(q='князь', book_id=self.book.id).data['results'], [])
+
+    def test_snippet_escapes_the_note_text(self):
+        self.create_session(self.book, notes=['<script>alert(1)</script> & <b>жирный</b> кот'])
+        [hit] = self.search(q='жирный').data['results']
+        self.assertEqual(
+            hit['snippet'], '&lt;script&gt;alert(1)&lt;/script&gt; &amp; &lt;b&gt;<b>жирный</b>&lt;/b&gt; кот'
+        )
+
+    def test_results_are_scoped_to_user_and_paginated(self):
+        other = User.objects.create_user(username='other@example.com', email='other@example.com', password='x')
+        ReadingSession.objects.create(
+            book=make_book(other), user=other, current_page=1, session_duration=1,
+            start_page=0, end_page=1, notes=['кот'],
+        )
+        search.rebuild()
+        for _ in range(2):
+            self.create_session(self.book, notes=['ещё один кот'], current_page=30)
+
+        response = self.search(q='кот', limit=2)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+
+    def test_index_follows_deletes(self):
+        ReadingSession.objects.filter(book=self.book).delete()
+        self.assertEqual(self.search(q='бегемот').data['results'], [])
+
+        self.client.delete(reverse('book_delete', kwargs={'book_id': self.other_book.id}))
+        self.assertEqual(self.search(q='мышкин').data['results'], [])
+
+    def test_sync_and_rebuild_index_notes(self):
+        self.client.post(reverse('sync_sessions'), {'sessions': [{
+            'book_id': str(self.book.id), 'idempotency_key': 'k1', 'session_duration': 5,
+            'from_page_to_page': '10-12', 'from_time_to_time': '10:00-10:05', 'notes': ['Маргарита'],
+            'current_page': 12,
+        }]}, format='json')
+        self.assertEqual(len(self.search(q='маргарита').data['results']), 1)
+
+        out = StringIO()
+        call_command('rebuild_notes_index', stdout=out)
+        self.assertIn('Заметок в индексе: 4', out.getvalue())
+        self.assertEqual(len(self.search(q='маргарита').data['results']), 1)
+
+    def test_query_without_words_is_rejected(self):
+        self.assertEqual(self.search(q='"*"').status_code, 400)
+
+
+class LibrarySearchTests(BookApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.master = make_book(self.user)
+        self.hedgehog = make_book(self.user, name='Ёжик в тумане', author='Козлов')
+        self.bulgakov_bio = make_book(self.user, name='Жизнеописание', author='Мастер Булгаков')
+
+    def names(self, q, **params):
+        response = self.client.get(reverse('search_books'), {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [book['name'] for book in response.data]
+
+    def test_prefix_substring_and_case(self):
+        self.assertEqual(self.names('мас'), ['Мастер и Маргарита', 'Жизнеописание'])
+        self.assertEqual(self.names('МАРГ'), ['Мастер и Маргарита'])
+        self.assertEqual(self.names('гарит'), ['Мастер и Маргарита'])
+        self.assertEqual(self.names('булгаков мастер'), ['Мастер и Маргарита', 'Жизнеописание'])
+        self.assertEqual(self.names('ежик'), ['Ёжик в тумане'])
+        self.assertEqual(self.names('ёЖ'), ['Ёжик в тумане'])
+        self.assertEqual(self.names('мас', limit=1), ['Мастер и Маргарита'])
+        self.assertEqual(self.names('толстой'), [])
+
+    def test_index_follows_writes(self):
+        other = User.objects.create_user(username='other@example.com', email='other@example.com', password='x')
+        make_book(other, name='Мастер на все руки')
+        self.assertEqual(len(self.names('мастер')), 2)
+
+        self.hedgehog.name = 'Ёжик в тумане и другие сказки'
+        self.hedgehog.save()
+        self.assertEqual(self.names('сказ'), ['Ёжик в тумане и другие сказки'])
+        self.assertEqual(self.names('ёжик'), ['Ёжик в тумане и другие сказки'])
+
+        self.client.delete(reverse('book_delete', kwargs={'book_id': self.master.id}))
+        self.assertEqual(self.names('марг'), [])
+
+    def test_rebuild_command(self):
+        search.rebuild_books(user_id=self.user.pk)
+        out = StringIO()
+        call_command('rebuild_library_index', stdout=out)
+        self.assertIn('Книг в индексе: 3', out.getvalue())
+        self.assertEqual(self.names('тума'), ['Ёжик в тумане'])
+
+
+@override_settings(BOOKS_EXPORT_CHUNK_SIZE=2)
+class LibraryExportTests(BookApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.books = [make_book(self.user, name=f'Книга {i}') for i in range(5)]
+        self.create_session(self.books[0], notes=['первая', 'вторая'])
+        self.create_session(self.books[0], notes=[], current_page=20, from_page_to_page='10-20')
+        self.create_session(self.books[3], notes=['«цитата», с запятой'])
+
+    def export(self, export_format='jsonl', **params):
+        response = self.client.get(reverse('export_library', kwargs={'export_format': export_format}), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_jsonl_streams_every_book_with_sessions(self):
+        records = [json.loads(line) for line in self.export().decode().splitlines()]
+        self.assertEqual([record['id'] for record in records], [str(book.id) for book in self.books])
+        self.assertEqual([len(record['sessions']) for record in records], [2, 0, 0, 1, 0])
+        self.assertEqual(records[0]['sessions'][0]['notes'], ['первая', 'вторая'])
+        self.assertEqual(records[0]['sessions'][1]['from_page_to_page'], '10-20')
+
+    def test_resume_from_cursor(self):
+        records = [json.loads(line) for line in self.export().decode().splitlines()]
+        resumed = [json.loads(line) for line in self.export(cursor=records[2]['cursor']).decode().splitlines()]
+        self.assertEqual(resumed, records[3:])
+        self.assertEqual(self.export(cursor=records[-1]['cursor']), b'')
+        response = self.client.get(reverse('export_library', kwargs={'export_format': 'jsonl'}), {'cursor': 'xyz'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_csv(self):
+        rows = list(csv.DictReader(StringIO(self.export('csv').decode('utf-8-sig'))))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[0]['book_name'], 'Книга 0')
+        self.assertEqual(json.loads(rows[0]['session_notes']), ['первая', 'вторая'])
+        self.assertEqual(rows[2]['session_created_date'], '')
+        self.assertEqual(json.loads(rows[4]['session_notes']), ['«цитата», с запятой'])
+
+        resumed = list(csv.reader(StringIO(self.export('csv', cursor=rows[4]['cursor']).decode())))
+        self.assertEqual([row[2] for row in resumed], ['Книга 4'])
+
+    def test_gzip(self):
+        url = reverse('export_library', kwargs={'export_format': 'jsonl'})
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.export())
+
+        for refused in ('gzip;q=0', 'br, gzip; q=0.0', 'identity'):
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING=refused)
+            self.assertFalse(response.has_header('Content-Encoding'), refused)
+            self.assertEqual(b''.join(response.streaming_content), self.export())
+
+    @override_settings(SERVER_MODE='asgi')
+    def test_asgi_streams_an_async_iterator(self):
+        response = self.client.get(reverse('export_library', kwargs={'export_format': 'jsonl'}))
+        # a sync iterator would be read whole into memory before the first byte is sent
+        self.assertTrue(response.is_async)
+
+        async def read():
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        with override_settings(SERVER_MODE='wsgi'):
+            self.assertEqual(async_to_sync(read)(), self.export())
+
+    def test_queries_grow_per_chunk_not_per_book(self):
+        # two queries (books, their sessions) for each chunk of two books
+        with self.assertNumQueries(6):
+            self.export()
+
+
+class LibraryImportTests(BookApiTestCase):
+    def upload(self, name, content):
+        return self.client.post(
+            reverse('import_library'), {'file': SimpleUploadedFile(name, content.encode())}, format='multipart'
+        )
+
+    def test_csv_import_reports_row_errors(self):
+        content = (
+            'name,author,pages_amount,description,reading_status,star_rate\r\n'
+            'Мастер и Маргарита,Булгаков,400,Роман,will_read,\r\n'
+            'Идиот,Достоевский,много,Роман,will_read,\r\n'
+            'Бесы,Достоевский,700,Роман,finished_reading,4.5\r\n'
+            'Нос,Гоголь,40,,will_read,\r\n'
+        )
+        response = self.upload('library.csv', content)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertEqual(response.data['total'], 4)
+
+        self.assertEqual(run_pending(), 1)
+        status_response = self.client.get(response.data['status_url'])
+        self.assertEqual(status_response.data['status'], 'finished')
+        self.assertEqual(status_response.data['processed'], 4)
+        self.assertEqual(status_response.data['created'], 2)
+        self.assertEqual([error['row'] for error in status_response.data['errors']], [2, 4])
+        self.assertIn('pages_amount', status_response.data['errors'][0]['errors'])
+        self.assertIn('description', status_response.data['errors'][1]['errors'])
+
+        books = Book.objects.filter(user=self.user).order_by('name')
+        self.assertEqual([book.name for book in books], ['Бесы', 'Мастер и Маргарита'])
+        self.assertEqual(books[0].star_rate, 4.5)
+        self.assertEqual(books[0].current_page, 0)
+        self.assertEqual([book.name for book in search.search_books(self.user, 'бес')], ['Бесы'])
+
+    @override_settings(BOOKS_IMPORT={'BATCH_SIZE': 2, 'MAX_ROWS': 10, 'MAX_FILE_SIZE': 2 ** 20})
+    def test_json_import_in_batches(self):
+        rows = [
+            {'name': f'Книга {i}', 'author': 'Автор', 'pages_amount': 100, 'description': 'Роман',
+             'reading_status': 'will_read'}
+            for i in range(5)
+        ]
+        rows[3]['reading_status'] = 'lost'
+        response = self.upload('library.json', json.dumps(rows))
+        self.assertEqual(response.status_code, 202)
+
+        self.client.get(reverse('book_list'))
+        job = imports.run_import(response.data['id'])
+        self.assertEqual((job.processed, job.created), (5, 4))
+        self.assertEqual(job.errors[0]['row'], 4)
+        self.assertEqual(job.rows, [])
+        self.assertIsNotNone(job.finished_at)
+
+        self.user.refresh_from_db()
+        self.assertEqual(len(self.client.get(reverse('book_list')).data), 4)
+        # a repeated run does not import the rows twice
+        self.assertIsNone(imports.run_import(job.pk))
+        self.assertEqual(Book.objects.filter(user=self.user).count(), 4)
+
+    @override_settings(BOOKS_IMPORT={'BATCH_SIZE': 2, 'MAX_ROWS': 10, 'MAX_FILE_SIZE': 2 ** 20})
+    def test_interrupted_job_resumes_after_last_batch(self):
+        rows = [
+            {'name': f'Книга {i}', 'author': 'Автор', 'pages_amount': 100, 'description': 'Роман',
+             'reading_status': 'will_read'}
+            for i in range(5)
+        ]
+        job_id = self.upload('library.json', json.dumps(rows)).data['id']
+        with mock.patch.object(imports, 'import_batch', side_effect=[(2, []), SystemExit]):
+            with self.assertRaises(SystemExit):
+                imports.run_import(job_id)
+        self.assertEqual(ImportJob.objects.get(pk=job_id).status, 'running')
+
+        job = imports.run_import(job_id)
+        self.assertEqual((job.status, job.processed, job.created), ('finished', 5, 5))
+        self.assertEqual(Book.objects.filter(user=self.user).count(), 3)
+
+    @override_settings(BOOKS_IMPORT={'BATCH_SIZE': 2, 'MAX_ROWS': 10, 'MAX_FILE_SIZE': 2 ** 20})
+    def test_committed_batches_are_listed_before_the_job_ends(self):
+        rows = [
+            {'name': f'Книга {i}', 'author': 'Автор', 'pages_amount': 100, 'description': 'Роман',
+             'reading_status': 'will_read'}
+            for i in range(3)
+        ]
+        job_id = self.upload('library.json', json.dumps(rows)).data['id']
+        listed = self.client.get(reverse('book_list'))
+        self.assertEqual(listed.data, [])
+
+        import_batch = imports.import_batch
+        responses = []
+
+        def list_before_second_batch(user, rows, first_row):
+            if first_row > 1:
+                responses.append(self.client.get(reverse('book_list'), HTTP_IF_NONE_MATCH=listed['ETag']))
+            return import_batch(user, rows, first_row=first_row)
+
+        with mock.patch.object(imports, 'import_batch', side_effect=list_before_second_batch):
+            imports.run_import(job_id)
+        [response] = responses
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 2)
+
+    @override_settings(BOOKS_IMPORT={'BATCH_SIZE': 2, 'MAX_ROWS': 10, 'MAX_FILE_SIZE': 2 ** 20})
+    def test_import_task_is_claimed_again_after_its_worker_dies(self):
+        rows = [
+            {'name': f'Книга {i}', 'author': 'Автор', 'pages_amount': 100, 'description': 'Роман',
+             'reading_status': 'will_read'}
+            for i in range(5)
+        ]
+        job_id = self.upload('library.json', json.dumps(rows)).data['id']
+        task_row = claim()
+        with mock.patch.object(imports, 'import_batch', side_effect=[(2, []), SystemExit]):
+            with self.assertRaises(SystemExit):
+                execute(task_row)
+
+        task_row = claim(now=timezone.now() + timedelta(seconds=601))
+        self.assertEqual(task_row.attempts, 2)
+        self.assertTrue(execute(task_row))
+        self.assertEqual(ImportJob.objects.get(pk=job_id).status, 'finished')
+        self.assertFalse(Task.objects.exists())
+
+    def test_jsonl_import(self):
+        content = '\n'.join(json.dumps(row) for row in [
+            {'name': 'Бесы', 'author': 'Достоевский', 'pages_amount': 700, 'description': 'Роман',
+             'reading_status': 'will_read'},
+        ]) + '\n'
+        self.upload('library.jsonl', content)
+        run_pending()
+        self.assertEqual(Book.objects.filter(user=self.user).count(), 1)
+
+    @override_settings(BOOKS_IMPORT={'BATCH_SIZE': 2, 'MAX_ROWS': 2, 'MAX_FILE_SIZE': 2 ** 20})
+    def test_rejects_bad_files(self):
+        for name, content in [
+            ('library.txt', 'name\nБесы\n'),
+            ('library.json', '{"name": "Бесы"}'),
+            ('library.json', '[1, 2'),
+            ('library.json', '[]'),
+            ('library.json', '[{}, {}, {}]'),
+        ]:
+            response = self.upload(name, content)
+            self.assertEqual(response.status_code, 400, content)
+            self.assertIn('file', response.data['details'])
+        self.assertFalse(Task.objects.exists())
+
+    def test_status_of_other_users_job(self):
+        other = User.objects.create_user(username='other@example.com', email='other@example.com', password='x')
+        job = ImportJob.objects.create(user=other, total=1)
+        response = self.client.get(reverse('import_status', kwargs={'job_id': job.id}))
+        self.assertEqual(response.status_code, 404)
+
+
+class SeedAndBenchmarkTests(TestCase):
+    def setUp(self):
+        response_cache.get_cache().clear()
+        call_command('seed_library', users=3, books_per_user=4, sessions=60, stdout=StringIO())
+
+    def bench(self, **options):
+        out = StringIO()
+        call_command('bench_api', requests=3, warmup=1, users=2, stdout=out, **options)
+        return out.getvalue()
+
+    def test_seeded_library_is_consistent(self):
+        self.assertEqual(User.objects.count(), 3)
+        book = Book.objects.filter(sessions_count__gt=0).first()
+        sessions = ReadingSession.objects.filter(book=book).order_by('created_at')
+        self.assertEqual(book.sessions_count, sessions.count())
+        self.assertEqual(book.current_page, sessions.last().current_page)
+        self.assertEqual(book.notes_count, sum(len(session.notes) for session in sessions))
+        self.assertTrue(book.user.check_password('witbook-bench'))
+
+    def test_baseline_and_regression(self):
+        baseline = os.path.join(tempfile.mkdtemp(), 'baseline.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(baseline))
+        sessions = ReadingSession.objects.count()
+
+        out = self.bench(scenario=['book_list', 'create_session'], save_baseline=baseline)
+        self.assertIn('book_list', out)
+        # Writes are rolled back
+        self.assertEqual(ReadingSession.objects.count(), sessions)
+
+        with open(baseline) as baseline_file:
+            saved = json.load(baseline_file)
+        results = saved['results']
+        self.assertEqual(saved['data'], {'users': 3, 'books': Book.objects.count(), 'sessions': sessions})
+        self.assertEqual(saved['options']['seed'], 1)
+        self.assertEqual(results['book_list']['errors'], 0)
+        self.assertEqual(results['create_session']['errors'], 0)
+        self.assertGreater(results['create_session']['queries'], 0)
+
+        results['book_list'].update(p50_ms=1e-6, p95_ms=1e-6, queries=0)
+        with open(baseline, 'w') as baseline_file:
+            json.dump({'results': results}, baseline_file)
+        with self.assertRaisesMessage(CommandError, 'book_list'):
+            self.bench(scenario=['book_list'], baseline=baseline)
+
+    def test_write_scenarios_are_rolled_back(self):
+        counts = Book.objects.count(), ReadingSession.objects.count(), User.objects.count(), ImportJob.objects.count()
+        scenarios = ['book_delete', 'import', 'register', 'profile_update', 'token_refresh', 'export_csv']
+        baseline = os.path.join(tempfile.mkdtemp(), 'baseline.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(baseline))
+
+        self.bench(scenario=scenarios, save_baseline=baseline)
+        with open(baseline) as baseline_file:
+            results = json.load(baseline_file)['results']
+        self.assertEqual({name: result['errors'] for name, result in results.items()}, dict.fromkeys(scenarios, 0))
+        self.assertEqual(
+            (Book.objects.count(), ReadingSession.objects.count(), User.objects.count(), ImportJob.objects.count()),
+            counts,
+        )
+
+    def test_committed_baseline_covers_every_scenario(self):
+        with open(settings.BASE_DIR / 'bench_baseline.json') as baseline_file:
+            saved = json.load(baseline_file)
+        self.assertIn('seed_library --seed', saved['dataset'])
+        self.assertEqual(saved['not_measured'], NOT_MEASURED)
+        self.assertEqual(set(saved['results']), set(SCENARIOS))
+        self.assertTrue(all(result['errors'] == 0 for result in saved['results'].values()))
+
+
+class AsyncViewsTests(BookApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.book = make_book(self.user)
+        self.create_session(self.book)
+        self.factory = AsyncRequestFactory()
+        self.auth = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def get(self, path, data=None, headers=None):
+        return self.factory.get(path, data, headers={**self.auth, **(headers or {})})
+
+    def post(self, data):
+        return self.factory.post('/', data, content_type='application/json', headers=self.auth)
+
+    async def sync_json(self, name, **kwargs):
+        response = await sync_to_async(self.client.get)(reverse(name, kwargs=kwargs))
+        await sync_to_async(response_cache.get_cache().clear)()
+        return response.json()
+
+    async def test_reads_match_sync_views(self):
+        expected = await self.sync_json('book_list')
+        response = await async_views.book_list(self.get('/books/list/'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), expected)
+
+        expected = await self.sync_json('book_details', book_id=self.book.id)
+        response = await async_views.book_details(self.get('/'), book_id=self.book.id)
+        self.assertEqual(json.loads(response.content), expected)
+
+        response = await async_views.book_list(self.get('/books/list/', {'page_size': 1}))
+        self.assertEqual(len(json.loads(response.content)['results']), 1)
+
+        response = await async_views.book_details(self.get('/', {'fields': 'current_page'}), book_id=self.book.id)
+        self.assertEqual(json.loads(response.content), [{'current_page': 10}])
+        response = await async_views.book_details(self.get('/', {'fields': 'book'}), book_id=self.book.id)
+        self.assertEqual(response.status_code, 400)
+
+    async def test_profile_written_by_another_process_is_not_served_stale(self):
+        response = await users_async_views.profile(self.get('/users/profile/'))
+        await User.objects.filter(pk=self.user.pk).aupdate(username='Другой', data_version=F('data_version') + 1)
+
+        request = self.get('/users/profile/', headers={'If-None-Match': response['ETag']})
+        response = await users_async_views.profile(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['username'], 'Другой')
+
+    async def test_etag_and_auth(self):
+        response = await async_views.book_list(self.get('/books/list/'))
+        request = self.get('/books/list/', headers={'If-None-Match': response['ETag']})
+        self.assertEqual((await async_views.book_list(request)).status_code, 304)
+
+        anonymous = AsyncRequestFactory().get('/books/list/')
+        self.assertEqual((await async_views.book_list(anonymous)).status_code, 401)
+        self.assertEqual((await async_views.book_list(self.post({}))).status_code, 405)
+
+    async def test_create_session(self):
+        data = {
+            'session_duration': 15, 'from_page_to_page': '10-25', 'from_time_to_time': '11:00-11:15',
+            'notes': ['заметка'], 'current_page': 25,
+        }
+        request = self.post(data)
+        response = await async_views.create_session(request, book_id=self.book.id)
+        self.assertEqual(response.status_code, 201)
+
+        book = await Book.objects.aget(id=self.book.id)
+        self.assertEqual(book.sessions_count, 2)
+        self.assertEqual(book.current_page, 25)
+
+        request = self.post({**data, 'current_page': 1000})
+        self.assertEqual((await async_views.create_session(request, book_id=self.book.id)).status_code, 400)
+
+
+class FastSerializationTests(BookApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        override = override_settings(MEDIA_ROOT=self.media_root, BOOKS_CACHE_ENABLED=False)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, True)
+
+        self.book = make_book(self.user, star_rate=4.5, average_emotion=3, current_page=120)
+        make_book(self.user, name='Идиот', star_rate=None, average_emotion=None, current_page=None)
+        response = self.client.post(reverse('book_create'), {
+            'name': 'Бесы', 'author': 'Достоевский', 'pages_amount': 700, 'description': 'Роман',
+            'reading_status': 'now_reading', 'book_photo': make_jpeg(),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.create_session(self.book, notes=['строка\u2028разрыв', 'ёж 🦔'])
+        self.create_session(self.book, from_time_to_time='23:30-00:15', current_page=120)
+        ReadingSession.objects.create(book=self.book, user=self.user, current_page=5, session_duration=10)
+
+    def assert_same_content(self, url, params=None):
+        responses = []
+        for enabled in (False, True):
+            with override_settings(BOOKS_FAST_SERIALIZATION=enabled):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 200)
+                responses.append(response.content)
+        self.assertEqual(responses[0], responses[1])
+
+    def test_book_list_matches_serializer(self):
+        self.assert_same_content(reverse('book_list'))
+        self.assert_same_content(reverse('book_list'), {'page_size': 2, 'ordering': '-rating'})
+        self.assert_same_content(reverse('book_list'), {'fields': 'book_photo_renditions,star_rate'})
+
+    def test_book_details_matches_serializer(self):
+        url = reverse('book_details', kwargs={'book_id': self.book.id})
+        self.assert_same_content(url)
+        self.assert_same_content(url, {'page_size': 2})
+        self.assert_same_content(url, {'exclude': 'notes', 'page_size': 2})
+
+    def test_renderer_matches_json_renderer(self):
+        data = {'small': 1e-7, 'big': 1e20, 'rate': 4.5, 'text': 'a\u2028b\u2029c ё', 'none': None, 1: [True]}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+class SparseFieldsTests(BookApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.book = make_book(self.user, description='Очень длинное описание ' * 50)
+        self.create_session(self.book)
+
+    def test_book_list_fields(self):
+        for fast in (False, True):
+            with self.subTest(fast=fast), override_settings(BOOKS_FAST_SERIALIZATION=fast):
+                response_cache.get_cache().clear()
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(reverse('book_list'), {'fields': 'name,author'})
+                self.assertEqual(response.data, [{'name': 'Мастер и Маргарита', 'author': 'Булгаков'}])
+                select = next(query['sql'] for query in queries if 'FROM "books_book"' in query['sql'])
+                self.assertNotIn('description', select)
+
+                response = self.client.get(reverse('book_list'), {'exclude': 'description', 'page_size': 1})
+                self.assertNotIn('description', response.data['results'][0])
+                self.assertIn('book_photo_renditions', response.data['results'][0])
+
+    def test_session_fields(self):
+        url = reverse('book_details', kwargs={'book_id': self.book.id})
+        for fast in (False, True):
+            with self.subTest(fast=fast), override_settings(BOOKS_FAST_SERIALIZATION=fast):
+                response_cache.get_cache().clear()
+                response = self.client.get(url, {'exclude': 'notes,from_time_to_time'})
+                self.assertEqual(response.data, [{
+                    'created_date': timezone.now().strftime('%d.%m.%Y'), 'session_duration': 30,
+                    'from_page_to_page': '1-10', 'current_page': 10,
+                }])
+
+    def test_invalid_fields(self):
+        url = reverse('book_details', kwargs={'book_id': self.book.id})
+        self.assertEqual(self.client.get(url, {'fields': 'password'}).status_code, 400)
+        everything = ','.join(BookSerializer.Meta.fields)
+        self.assertEqual(self.client.get(reverse('book_list'), {'exclude': everything}).status_code, 400)
+
+    @override_settings(COMPRESSION={'MIN_SIZE': 1024, 'GZIP_LEVEL': 6, 'BROTLI_QUALITY': 5})
+    def test_list_is_compressed(self):
+        response = self.client.get(reverse('book_list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content))[0]['id'], str(self.book.id))
+
+        response = self.client.get(reverse('book_list'), {'fields': 'id'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
@@ -1,10 +1,45 @@
-from django.urls import path
-from .views import BookCreateView, BookListView, ReadingSessionCreateView, BookDetailsView, BookDeleteView
+from django.conf import settings
+from django.urls import path, re_path
+
+from . import async_views
+from .views import (
+    BookCreateView,
+    BookListView,
+    BookSearchView,
+    ImportStatusView,
+    LibraryImportView,
+    LibraryExportView,
+    NotesSearchView,
+    ReadingHistogramView,
+    ReadingSessionCreateView,
+    ReadingSessionSyncView,
+    ReadingStatsView,
+    BookDetailsView,
+    BookDeleteView
+)
+
+ASYNC = settings.SERVER_MODE == 'asgi'
 
 urlpatterns = [
-    path('list/', BookListView.as_view(), name='book_list'),
+    path('list/', async_views.book_list if ASYNC else BookListView.as_view(), name='book_list'),
     path('create/', BookCreateView.as_view(), name='book_create'),
-    path('<uuid:book_id>/create_session/', ReadingSessionCreateView.as_view(), name='create_session'),
-    path('<uuid:book_id>/details/', BookDetailsView.as_view(), name='book_details'),
+    path('stats/', ReadingStatsView.as_view(), name='reading_stats'),
+    path('stats/histogram/', ReadingHistogramView.as_view(), name='reading_histogram'),
+    path('search/', BookSearchView.as_view(), name='search_books'),
+    re_path(r'^export/(?P<export_format>jsonl|csv)/$', LibraryExportView.as_view(), name='export_library'),
+    path('import/', LibraryImportView.as_view(), name='import_library'),
+    path('import/<uuid:job_id>/', ImportStatusView.as_view(), name='import_status'),
+    path('notes/search/', NotesSearchView.as_view(), name='search_notes'),
+    path('sessions/sync/', ReadingSessionSyncView.as_view(), name='sync_sessions'),
+    path(
+        '<uuid:book_id>/create_session/',
+        async_views.create_session if ASYNC else ReadingSessionCreateView.as_view(),
+        name='create_session'
+    ),
+    path(
+        '<uuid:book_id>/details/',
+        async_views.book_details if ASYNC else BookDetailsView.as_view(),
+        name='book_details'
+    ),
     path('<uuid:book_id>/delete/', BookDeleteView.as_view(), name='book_delete'),
 ]
\ No newline at end of file
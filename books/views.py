@@ -1,10 +1,45 @@
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.utils.urls import replace_query_param
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
-from .models import Book, ReadingSession
-from .serializers import BookSerializer, ReadingSessionSerializer
+from witbook.conditional import conditional_get, make_etag
+from . import cache as response_cache
+from . import export, imports, representations, search, stats
+from .filters import filter_books
+from .models import Book, ImportJob, ReadingSession
+from .pagination import BookCursorPagination, ReadingSessionCursorPagination
+from .serializers import (
+    BookListQuerySerializer,
+    BookSearchQuerySerializer,
+    BookSerializer,
+    BookSuggestionSerializer,
+    ImportJobSerializer,
+    ImportUploadSerializer,
+    NotesSearchQuerySerializer,
+    ReadingSessionFieldsQuerySerializer,
+    ReadingSessionSerializer,
+    ReadingHistogramQuerySerializer,
+    ReadingSessionSyncSerializer,
+    ReadingStatsQuerySerializer,
+)
+
+User = get_user_model()
+
+pagination_parameters = [
+    openapi.Parameter('cursor', openapi.IN_QUERY, description="Курсор следующей/предыдущей страницы",
+                      type=openapi.TYPE_STRING),
+    openapi.Parameter('page_size', openapi.IN_QUERY, description="Размер страницы", type=openapi.TYPE_INTEGER),
+]
 
 class BookCreateView(APIView):
     permission_classes = [IsAuthenticated]
@@ -13,23 +48,59 @@ class BookCreateView(APIView):
         request_body=BookSerializer,
         responses={201: BookSerializer, 400: "Неверные данные"}
     )
+    @transaction.atomic
     def post(self, request):
         serializer = BookSerializer(data=request.data)
         if serializer.is_valid():
             serializer.save(user=request.user)
+            response_cache.invalidate_user(request.user)
             return Response({'status': 'success', 'data': serializer.data}, status=status.HTTP_201_CREATED)
         return Response({'error': 'Неверные данные', 'details': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
+def book_list_etag(request):
+    return make_etag(request, 'books', request.user.pk, response_cache.data_version(request))
+
+def book_details_etag(request, book_id):
+    version = Book.objects.filter(id=book_id, user=request.user).values_list('version', flat=True).first()
+    if version is None:
+        return None
+    return make_etag(request, 'book', book_id, version)
+
 class BookListView(APIView):
     permission_classes = [IsAuthenticated]
 
     @swagger_auto_schema(
-        responses={200: BookSerializer(many=True), 401: "Не авторизован"}
+        query_serializer=BookListQuerySerializer,
+        manual_parameters=pagination_parameters,
+        responses={
+            200: BookSerializer(many=True), 304: "Не изменилось", 400: "Неверные данные", 401: "Не авторизован"
+        }
     )
+    @conditional_get(book_list_etag)
     def get(self, request):
-        books = Book.objects.filter(user=request.user)
-        serializer = BookSerializer(books, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        params = BookListQuerySerializer(data=request.query_params)
+        if not params.is_valid():
+            return Response({'error': 'Неверные данные', 'details': params.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        key = response_cache.make_key(
+            'list', request.user.pk, response_cache.data_version(request), query=request.META.get('QUERY_STRING', '')
+        )
+        data = response_cache.lookup(key)
+        if data is None:
+            data = self.serialize(request, params.validated_data)
+            response_cache.store(key, data)
+        return Response(data, status=status.HTTP_200_OK)
+
+    def serialize(self, request, params):
+        books, ordering = filter_books(Book.objects.filter(user=request.user), params)
+        books, represent = representations.book_rows(books, ordering, params['fields'])
+        paginator = BookCursorPagination()
+        if paginator.is_requested(request):
+            paginator.ordering = ordering
+            page = paginator.paginate_queryset(books, request, view=self)
+            return paginator.get_paginated_response(represent(page)).data
+
+        return represent(books.order_by(*ordering))
 
 class ReadingSessionCreateView(APIView):
     permission_classes = [IsAuthenticated]
@@ -38,6 +109,7 @@ class ReadingSessionCreateView(APIView):
         request_body=ReadingSessionSerializer,
         responses={201: ReadingSessionSerializer, 400: "Неверные данные", 404: "Книга не найдена"}
     )
+    @transaction.atomic
     def post(self, request, book_id):
         try:
             book = Book.objects.get(id=book_id, user=request.user)
@@ -47,28 +119,76 @@ class ReadingSessionCreateView(APIView):
         serializer = ReadingSessionSerializer(data=request.data, context={'book': book, 'request': request})
         if serializer.is_valid():
             serializer.save(book=book, user=request.user)
+            response_cache.invalidate_user(request.user, book.id)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response({'error': 'Неверные данные', 'details': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
+class ReadingSessionSyncView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        request_body=ReadingSessionSyncSerializer,
+        responses={
+            200: '[{"idempotency_key": "string", "status": "created | duplicate"}]',
+            400: "Неверные данные"
+        },
+        operation_description="Пакетная загрузка сессий чтения, записанных офлайн"
+    )
+    @transaction.atomic
+    def post(self, request):
+        serializer = ReadingSessionSyncSerializer(data=request.data, context={'request': request})
+        if serializer.is_valid():
+            results = serializer.save()
+            book_ids = {item['book_id'] for item in serializer.validated_data['sessions']}
+            response_cache.invalidate_user(request.user, *book_ids)
+            return Response({'results': results}, status=status.HTTP_200_OK)
+        return Response({'error': 'Неверные данные', 'details': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
 class BookDetailsView(APIView):
     permission_classes = [IsAuthenticated]
 
     @swagger_auto_schema(
-        responses={200: ReadingSessionSerializer(many=True), 404: "Книга не найдена"}
+        query_serializer=ReadingSessionFieldsQuerySerializer,
+        manual_parameters=pagination_parameters,
+        responses={
+            200: ReadingSessionSerializer(many=True), 304: "Не изменилось", 400: "Неверные данные",
+            404: "Книга не найдена"
+        }
     )
+    @conditional_get(book_details_etag)
     def get(self, request, book_id):
-        try:
-            book = Book.objects.get(id=book_id, user=request.user)
-        except Book.DoesNotExist:
-            return Response({"error": "Книга не найдена"}, status=status.HTTP_404_NOT_FOUND)
+        params = ReadingSessionFieldsQuerySerializer(data=request.query_params)
+        if not params.is_valid():
+            return Response({'error': 'Неверные данные', 'details': params.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        key = response_cache.make_key(
+            'details', request.user.pk, response_cache.data_version(request), book_id,
+            query=request.META.get('QUERY_STRING', ''),
+        )
+        data = response_cache.lookup(key)
+        if data is None:
+            try:
+                book = Book.objects.get(id=book_id, user=request.user)
+            except Book.DoesNotExist:
+                return Response({"error": "Книга не найдена"}, status=status.HTTP_404_NOT_FOUND)
+
+            data = self.serialize(request, book, params.validated_data)
+            response_cache.store(key, data)
+        return Response(data, status=status.HTTP_200_OK)
 
-        sessions = book.sessions.all()
-        serializer = ReadingSessionSerializer(sessions, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+    def serialize(self, request, book, params):
+        paginator = ReadingSessionCursorPagination()
+        sessions, represent = representations.session_rows(book.sessions.all(), paginator.ordering, params['fields'])
+        if paginator.is_requested(request):
+            page = paginator.paginate_queryset(sessions, request, view=self)
+            return paginator.get_paginated_response(represent(page)).data
+
+        return represent(sessions.order_by(*paginator.ordering))
 
 class BookDeleteView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @transaction.atomic
     def delete(self, request, book_id):
         try:
             book = Book.objects.get(id=book_id, user=request.user)
@@ -76,4 +196,158 @@ class BookDeleteView(APIView):
             return Response({"error": "Книга не найдена"}, status=status.HTTP_404_NOT_FOUND)
 
         book.delete()
-        return Response({"message": "Книга удалена"}, status=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+        User.bump_data_version(request.user.pk)
+        response_cache.invalidate_user(request.user, book_id)
+        return Response({"message": "Книга удалена"}, status=status.HTTP_204_NO_CONTENT)
+
+class ReadingStatsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        query_serializer=ReadingStatsQuerySerializer,
+        responses={200: '{"totals": {}, "pages_per_day": 0, "streak": 0, "days": []}', 400: "Неверные данные"},
+        operation_description="Статистика чтения по дням: страницы, время, сессии и серия дней подряд"
+    )
+    def get(self, request):
+        serializer = ReadingStatsQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response({'error': 'Неверные данные', 'details': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        params = serializer.validated_data
+        data = stats.summary(request.user, params['date_from'], params['date_to'], params.get('book_id'))
+        return Response(data, status=status.HTTP_200_OK)
+
+class ReadingHistogramView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        query_serializer=ReadingHistogramQuerySerializer,
+        responses={
+            200: '{"hours": [{"hour": 0, "sessions": 0, "minutes": 0, "pages": 0, "pages_per_minute": 0}], '
+                 '"speed": [{"from": 0.0, "to": 0.5, "sessions": 0}]}',
+            400: "Неверные данные"
+        },
+        operation_description="Время чтения по часам суток и распределение сессий по скорости (страниц в минуту)"
+    )
+    def get(self, request):
+        serializer = ReadingHistogramQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response({'error': 'Неверные данные', 'details': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        params = serializer.validated_data
+        data = stats.histograms(
+            request.user, params['date_from'], params['date_to'], params.get('book_id'), params['speed_step']
+        )
+        return Response(data, status=status.HTTP_200_OK)
+
+class NotesSearchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        query_serializer=NotesSearchQuerySerializer,
+        responses={
+            200: '{"results": [{"session_id": 1, "note_index": 0, "book_id": "", "book_name": "", '
+                 '"created_at": "", "snippet": "", "score": 0.0}], "next": null}',
+            400: "Неверные данные"
+        },
+        operation_description="Полнотекстовый поиск по заметкам сессий чтения пользователя"
+    )
+    def get(self, request):
+        serializer = NotesSearchQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response({'error': 'Неверные данные', 'details': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        params = serializer.validated_data
+        limit = params.get('limit', settings.BOOKS_PAGE_SIZE)
+        hits, has_more = search.search(
+            request.user, params['q'], book_id=params.get('book_id'), limit=limit, offset=params['offset']
+        )
+        next_url = None
+        if has_more:
+            next_url = replace_query_param(request.build_absolute_uri(), 'offset', params['offset'] + limit)
+        return Response({'results': hits, 'next': next_url}, status=status.HTTP_200_OK)
+
+class BookSearchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        query_serializer=BookSearchQuerySerializer,
+        responses={200: BookSuggestionSerializer(many=True), 400: "Неверные данные"},
+        operation_description="Поиск и автодополнение по названию и автору книг пользователя"
+    )
+    def get(self, request):
+        serializer = BookSearchQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response({'error': 'Неверные данные', 'details': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        params = serializer.validated_data
+        books = search.search_books(request.user, params['q'], limit=params.get('limit', settings.BOOKS_SEARCH_LIMIT))
+        return Response(BookSuggestionSerializer(books, many=True).data, status=status.HTTP_200_OK)
+
+class LibraryExportView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter('cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                              description="Курсор последней полученной книги, чтобы продолжить прерванную выгрузку"),
+        ],
+        responses={200: "Поток JSONL (книга на строку) или CSV (сессия на строку)", 400: "Неверный курсор"},
+        operation_description="Потоковая выгрузка всех книг пользователя с сессиями и заметками; "
+                              "при Accept-Encoding: gzip сжимается на лету"
+    )
+    def get(self, request, export_format):
+        cursor = request.query_params.get('cursor') or None
+        if cursor is not None:
+            try:
+                export.decode_cursor(cursor)
+            except export.InvalidCursor:
+                return Response({'error': 'Неверный курсор'}, status=status.HTTP_400_BAD_REQUEST)
+
+        chunks = export.export_chunks(export_format, request.user, request, cursor)
+        gzipped = export.accepts_gzip(request)
+        if gzipped:
+            chunks = export.gzip_chunks(chunks)
+        if settings.SERVER_MODE == 'asgi':
+            chunks = export.async_chunks(chunks)
+        response = StreamingHttpResponse(chunks, content_type=export.FORMATS[export_format])
+        if gzipped:
+            response['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ['Accept-Encoding'])
+        response['Content-Disposition'] = f'attachment; filename="witbook-library.{export_format}"'
+        return response
+
+class LibraryImportView(APIView):
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser]
+
+    @swagger_auto_schema(
+        request_body=ImportUploadSerializer,
+        responses={202: ImportJobSerializer, 400: "Неверные данные"},
+        operation_description="Импорт книг из файла .csv, .json или .jsonl; строки проверяются и добавляются "
+                              "в фоне, ход импорта доступен по status_url"
+    )
+    @transaction.atomic
+    def post(self, request):
+        serializer = ImportUploadSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({'error': 'Неверные данные', 'details': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        job = imports.start(request.user, serializer.rows)
+        data = ImportJobSerializer(job).data
+        data['status_url'] = request.build_absolute_uri(reverse('import_status', kwargs={'job_id': job.id}))
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+
+class ImportStatusView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        responses={200: ImportJobSerializer, 404: "Импорт не найден"},
+        operation_description="Состояние импорта: обработано строк, добавлено книг и ошибки по номерам строк"
+    )
+    def get(self, request, job_id):
+        try:
+            job = ImportJob.objects.defer('rows').get(id=job_id, user=request.user)
+        except ImportJob.DoesNotExist:
+            return Response({"error": "Импорт не найден"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(ImportJobSerializer(job).data, status=status.HTTP_200_OK)
@@ -0,0 +1,25 @@
+"""
+gunicorn settings; gunicorn reads this file from the working directory.
+
+The application is preloaded in the master and the workers are forked from it (see
+witbook.startup). Set WITBOOK_PRELOAD=0 to have every worker load it itself, e.g. with --reload.
+
+Workers are threaded (gthread): a login waiting for the password hashing pool holds one thread, not
+the whole process. The pool's WORKERS + MAX_QUEUE must stay below ``threads``, so that logins beyond
+it get 429 while the other threads keep serving (users.hashing).
+"""
+import os
+
+bind = os.environ.get('WITBOOK_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WITBOOK_WORKERS', 3))
+worker_class = 'gthread'
+threads = int(os.environ.get('WITBOOK_THREADS', 8))
+preload_app = os.environ.get('WITBOOK_PRELOAD', '1') == '1'
+
+
+def when_ready(server):
+    # Runs in the master after the preloaded application is loaded and before any worker is forked
+    if server.cfg.preload_app:
+        from witbook.startup import warm_up
+
+        warm_up()
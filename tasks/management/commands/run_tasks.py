@@ -0,0 +1,42 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from tasks import runner
+
+
+class Command(BaseCommand):
+    help = (
+        'Обработчик фоновых задач: выполняет задачи из очереди в базе данных по приоритету. '
+        'Запускайте один или несколько процессов рядом с веб-сервером.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Выполнить накопившиеся задачи и завершиться')
+        parser.add_argument('--sleep', type=float, default=1.0, help='Пауза между опросами пустой очереди, секунды')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        total = 0
+        while not self.stopping:
+            close_old_connections()
+            task_row = runner.claim()
+            if task_row is None:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+                continue
+            # A stop signal lets the current task finish; the next one stays queued
+            succeeded = runner.execute(task_row)
+            total += 1
+            if options['verbosity'] > 1 or not succeeded:
+                self.stdout.write(f"{task_row.name}: {'выполнена' if succeeded else 'ошибка'}")
+        self.stdout.write(self.style.SUCCESS(f'Выполнено задач: {total}'))
+
+    def stop(self, signum, frame):
+        self.stopping = True
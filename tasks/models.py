@@ -0,0 +1,36 @@
+from django.db import models
+from django.db.models import Q
+
+
+class Task(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('failed', 'Ошибка'),
+    ]
+
+    name = models.CharField(max_length=255)
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    # Queued: when the task may run. Running: when the lease of the worker runs out and the
+    # task becomes visible to other workers again
+    available_at = models.DateTimeField()
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    lease = models.CharField(max_length=32, blank=True, default='')
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['-priority', 'available_at', 'id'],
+                name='task_pending_idx',
+                condition=Q(status__in=['queued', 'running']),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
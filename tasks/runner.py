@@ -0,0 +1,137 @@
+"""
+Background tasks stored in the application database and run by ``manage.py run_tasks``.
+
+A view defers work with ``some_task.defer(...)``. The row is written in the view's transaction,
+so a task is queued if and only if the change that asked for it is committed. Workers claim the
+most urgent due task with a conditional UPDATE, which works the same on SQLite that has no
+SELECT ... FOR UPDATE. A claim is a lease: a worker that dies leaves the task running until the
+lease expires, and then it is claimed again, unless that was its last attempt: a task that keeps
+killing its worker (out of memory, a crash in a C extension) is marked failed instead of being
+retried forever. Tasks therefore run at least once, must be idempotent and manage their own
+transactions. A failing task is retried with exponential backoff up to ``max_attempts`` times
+and then kept as failed for inspection; finished tasks are deleted.
+"""
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Task
+
+PRIORITY_LOW = -10
+PRIORITY_NORMAL = 0
+PRIORITY_HIGH = 10
+
+registry = {}
+
+
+class TaskFunction:
+    def __init__(self, func, name, priority, max_attempts, timeout):
+        self.func = func
+        self.name = name
+        self.priority = priority
+        # None means the TASKS setting, read when it is needed
+        self._max_attempts = max_attempts
+        self._timeout = timeout
+
+    @property
+    def max_attempts(self):
+        return self._max_attempts or settings.TASKS['MAX_ATTEMPTS']
+
+    @property
+    def timeout(self):
+        return self._timeout or settings.TASKS['VISIBILITY_TIMEOUT']
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def __repr__(self):
+        return f'<task {self.name}>'
+
+    def defer(self, *args, run_after=None, priority=None, **kwargs):
+        """Queue a call; args and kwargs must be JSON serializable."""
+        return Task.objects.create(
+            name=self.name,
+            args=list(args),
+            kwargs=kwargs,
+            priority=self.priority if priority is None else priority,
+            max_attempts=self.max_attempts,
+            available_at=run_after or timezone.now(),
+        )
+
+
+def task(name=None, priority=PRIORITY_NORMAL, max_attempts=None, timeout=None):
+    """Register a function as a task. ``timeout`` is the lease of one run, in seconds."""
+
+    def decorator(func):
+        task_function = TaskFunction(
+            func, name or f'{func.__module__}.{func.__qualname__}', priority, max_attempts, timeout
+        )
+        registry[task_function.name] = task_function
+        return task_function
+
+    return decorator
+
+
+def claim(now=None):
+    """Lease the most urgent due task; returns it or None."""
+    now = now or timezone.now()
+    # A lease that expired after the last attempt is not retried: its worker died running it
+    Task.objects.filter(status='running', available_at__lte=now, attempts__gte=F('max_attempts')).update(
+        status='failed', lease='', last_error='The lease of the last attempt expired; its worker probably died',
+    )
+    due = Task.objects.filter(status__in=['queued', 'running'], available_at__lte=now)
+    for candidate in due.order_by('-priority', 'available_at', 'id').values('id', 'name')[:10]:
+        task_function = registry.get(candidate['name'])
+        timeout = task_function.timeout if task_function else settings.TASKS['VISIBILITY_TIMEOUT']
+        lease = uuid.uuid4().hex
+        claimed = due.filter(pk=candidate['id']).update(
+            status='running',
+            lease=lease,
+            available_at=now + timedelta(seconds=timeout),
+            attempts=F('attempts') + 1,
+        )
+        # Zero rows means another worker took it between the select and the update
+        if claimed:
+            return Task.objects.get(pk=candidate['id'])
+    return None
+
+
+def execute(task_row):
+    """Run a claimed task and record the outcome; returns True if it succeeded."""
+    task_function = registry.get(task_row.name)
+    try:
+        if task_function is None:
+            raise LookupError(f'Unknown task {task_row.name}')
+        task_function(*task_row.args, **task_row.kwargs)
+    except Exception:
+        fail(task_row, traceback.format_exc(), retry=task_function is not None)
+        return False
+
+    # A run that outlived its lease may have been claimed again; the newer lease owns the row then
+    Task.objects.filter(pk=task_row.pk, lease=task_row.lease).delete()
+    return True
+
+
+def fail(task_row, error, retry=True):
+    owned = Task.objects.filter(pk=task_row.pk, lease=task_row.lease)
+    if retry and task_row.attempts < task_row.max_attempts:
+        delay = settings.TASKS['RETRY_DELAY'] * 2 ** (task_row.attempts - 1)
+        owned.update(status='queued', available_at=timezone.now() + timedelta(seconds=delay), last_error=error)
+    else:
+        owned.update(status='failed', last_error=error)
+
+
+def run_pending(limit=None):
+    """Run due tasks until there are none left (or ``limit`` ran); returns how many ran."""
+    ran = 0
+    while limit is None or ran < limit:
+        task_row = claim()
+        if task_row is None:
+            break
+        execute(task_row)
+        ran += 1
+    return ran
@@ -0,0 +1,97 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .models import Task
+from .runner import PRIORITY_HIGH, PRIORITY_LOW, claim, execute, run_pending, task
+
+calls = []
+
+
+@task(name='tests.record')
+def record(value):
+    calls.append(value)
+
+
+@task(name='tests.flaky', max_attempts=2)
+def flaky():
+    calls.append('flaky')
+    raise RuntimeError('temporary failure')
+
+
+@override_settings(TASKS={'MAX_ATTEMPTS': 3, 'VISIBILITY_TIMEOUT': 60, 'RETRY_DELAY': 10})
+class TaskRunnerTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_runs_by_priority_then_age(self):
+        record.defer('normal')
+        record.defer('low', priority=PRIORITY_LOW)
+        record.defer('urgent', priority=PRIORITY_HIGH)
+        record.defer('later', run_after=timezone.now() + timedelta(hours=1))
+
+        self.assertEqual(run_pending(), 3)
+        self.assertEqual(calls, ['urgent', 'normal', 'low'])
+        self.assertEqual(list(Task.objects.values_list('args', flat=True)), [['later']])
+
+    def test_failure_is_retried_with_backoff_then_kept(self):
+        flaky.defer()
+        started = timezone.now()
+        self.assertEqual(run_pending(), 1)
+
+        task_row = Task.objects.get()
+        self.assertEqual((task_row.status, task_row.attempts), ('queued', 1))
+        self.assertIn('temporary failure', task_row.last_error)
+        self.assertGreaterEqual(task_row.available_at, started + timedelta(seconds=10))
+        self.assertIsNone(claim())
+
+        self.assertFalse(execute(claim(now=task_row.available_at)))
+        task_row.refresh_from_db()
+        self.assertEqual((task_row.status, task_row.attempts), ('failed', 2))
+        self.assertEqual(calls, ['flaky', 'flaky'])
+        self.assertIsNone(claim(now=timezone.now() + timedelta(days=1)))
+
+    def test_expired_lease_is_claimed_again(self):
+        record.defer('once')
+        first = claim()
+        self.assertIsNone(claim())
+
+        # the first worker died; after the visibility timeout another one takes the task
+        second = claim(now=timezone.now() + timedelta(seconds=61))
+        self.assertEqual((second.pk, second.attempts), (first.pk, 2))
+
+        # the late first worker finishes, but the row belongs to the second lease
+        self.assertTrue(execute(first))
+        self.assertTrue(Task.objects.filter(pk=first.pk).exists())
+        self.assertTrue(execute(second))
+        self.assertFalse(Task.objects.exists())
+
+    def test_expired_lease_of_the_last_attempt_fails_the_task(self):
+        flaky.defer()
+        started = timezone.now()
+        for attempt in range(1, 3):
+            # the worker dies every time, so execute() never records the outcome
+            task_row = claim(now=started + timedelta(seconds=61 * attempt))
+            self.assertEqual(task_row.attempts, attempt)
+
+        self.assertIsNone(claim(now=started + timedelta(seconds=61 * 3)))
+        task_row.refresh_from_db()
+        self.assertEqual((task_row.status, task_row.attempts), ('failed', 2))
+        self.assertIn('lease', task_row.last_error)
+
+    def test_unknown_task_fails_without_retry(self):
+        Task.objects.create(name='tests.missing', available_at=timezone.now())
+        run_pending()
+        task_row = Task.objects.get()
+        self.assertEqual(task_row.status, 'failed')
+        self.assertIn('Unknown task', task_row.last_error)
+
+    def test_worker_command_once(self):
+        record.defer('from command')
+        out = StringIO()
+        call_command('run_tasks', once=True, stdout=out)
+        self.assertEqual(calls, ['from command'])
+        self.assertIn('1', out.getvalue())
@@ -0,0 +1,23 @@
+"""Async counterpart of UserProfileView, routed instead of it when WITBOOK_SERVER=asgi."""
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+
+from witbook.async_api import async_api_view, not_modified, render
+from witbook.conditional import make_etag
+from .serializers import UserProfileSerializer
+
+User = get_user_model()
+
+
+@async_api_view('GET')
+async def profile(request):
+    version = await User.acurrent_data_version(request.user.pk)
+    etag = make_etag(request, 'profile', request.user.pk, version)
+    response = not_modified(request, etag)
+    if response is None:
+        # The body has to match the ETag, and request.user may be a stale cached copy
+        if request.user.data_version != version:
+            await sync_to_async(request.user.refresh_from_db)()
+        response = render(UserProfileSerializer(request.user).data)
+    response['ETag'] = etag
+    return response
@@ -0,0 +1,125 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, identify_hasher, make_password
+from rest_framework import status
+from rest_framework.exceptions import APIException, Throttled
+
+
+class PasswordHashingTimeout(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Сервер перегружен, повторите попытку позже'
+    default_code = 'password_hashing_timeout'
+
+
+class PasswordHashingPool:
+    """Runs password hashing on a small thread pool with a bounded backlog.
+
+    A call that finds ``workers + max_queue`` jobs already in flight is rejected at once with
+    429 instead of waiting; a job that does not finish within ``timeout`` seconds gives 503.
+    The pool is per process and shared by the threads of a gthread worker (gunicorn.conf.py).
+    """
+
+    def __init__(self, workers, max_queue, timeout):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'submitted': 0,
+            'completed': 0,
+            'rejected': 0,
+            'timeouts': 0,
+            'in_flight': 0,
+            'queue_wait_seconds_total': 0.0,
+            'queue_wait_seconds_max': 0.0,
+            'hash_seconds_total': 0.0,
+            'hash_seconds_max': 0.0,
+        }
+
+    def _get_executor(self):
+        # Created on first use so that forked gunicorn workers never inherit pool threads
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hashing')
+            return self._executor
+
+    def _update(self, **changes):
+        with self._stats_lock:
+            for name, value in changes.items():
+                if name.endswith('_max'):
+                    self._stats[name] = max(self._stats[name], value)
+                else:
+                    self._stats[name] += value
+
+    def run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            self._update(rejected=1)
+            raise Throttled(wait=1, detail='Слишком много одновременных входов, повторите попытку позже')
+
+        submitted_at = time.monotonic()
+        self._update(submitted=1, in_flight=1)
+
+        def job():
+            started_at = time.monotonic()
+            try:
+                return func(*args)
+            finally:
+                hash_time = time.monotonic() - started_at
+                wait_time = started_at - submitted_at
+                self._update(
+                    completed=1, in_flight=-1,
+                    queue_wait_seconds_total=wait_time, queue_wait_seconds_max=wait_time,
+                    hash_seconds_total=hash_time, hash_seconds_max=hash_time,
+                )
+                self._slots.release()
+
+        try:
+            future = self._get_executor().submit(job)
+        except Exception:
+            self._update(in_flight=-1)
+            self._slots.release()
+            raise
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            self._update(timeouts=1)
+            raise PasswordHashingTimeout()
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+
+password_pool = PasswordHashingPool(
+    workers=settings.PASSWORD_HASHING_POOL['WORKERS'],
+    max_queue=settings.PASSWORD_HASHING_POOL['MAX_QUEUE'],
+    timeout=settings.PASSWORD_HASHING_POOL['TIMEOUT'],
+)
+
+
+def hash_password(raw_password):
+    return password_pool.run(make_password, raw_password)
+
+
+def verify_password(user, raw_password):
+    """
+    check_password() on the pool. For an unknown user the password is hashed instead, which takes
+    as long as checking it (like Django's ModelBackend), so the timing does not tell them apart.
+    """
+    if user is None:
+        password_pool.run(make_password, raw_password)
+        return False
+
+    if not password_pool.run(check_password, raw_password, user.password):
+        return False
+
+    if identify_hasher(user.password).must_update(user.password):
+        user.password = hash_password(raw_password)
+        user.save(update_fields=['password'])
+    return True
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='data_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -1,12 +1,39 @@
 from django.db import models
+from django.db.models import F
 from django.contrib.auth.models import AbstractUser
-from PIL import Image
-import io
+
+from witbook.images import prepare_image_upload, render_image
 
 class CustomUser(AbstractUser):
     email = models.EmailField(unique=True)
     avatar = models.ImageField(upload_to='avatars/', null=True, blank=True)
     username = models.CharField(max_length=150, unique=False, null=True, blank=True)
+    data_version = models.PositiveIntegerField(default=0, editable=False)
 
     USERNAME_FIELD = 'email'
-    REQUIRED_FIELDS = []
\ No newline at end of file
+    REQUIRED_FIELDS = []
+
+    def save(self, *args, **kwargs):
+        new_avatar = prepare_image_upload(self, 'avatar')
+        super().save(*args, **kwargs)
+        if new_avatar:
+            render_image.defer(self.avatar.name)
+
+    @classmethod
+    def bump_data_version(cls, user_id):
+        from .authentication import invalidate_user
+
+        cls.objects.filter(pk=user_id).update(data_version=F('data_version') + 1)
+        invalidate_user(user_id)
+
+    @classmethod
+    def current_data_version(cls, user_id):
+        """
+        data_version as committed. request.user can be a cached copy, and the cache of another
+        process is not cleared by a write, so ETags and cache keys must not use its data_version.
+        """
+        return cls.objects.filter(pk=user_id).values_list('data_version', flat=True).first()
+
+    @classmethod
+    async def acurrent_data_version(cls, user_id):
+        return await cls.objects.filter(pk=user_id).values_list('data_version', flat=True).afirst()
@@ -1,6 +1,9 @@
+from django.db.models import F
 from rest_framework import serializers
 
 from witbook import settings
+from witbook.images import rendition_urls
+from .hashing import hash_password, verify_password
 from .models import CustomUser
 from rest_framework_simplejwt.tokens import RefreshToken
 
@@ -14,11 +17,12 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         username = validated_data.get('username', validated_data['email'])
-        user = CustomUser.objects.create_user(
-            email=validated_data['email'],
-            password=validated_data['password'],
-            username=username
+        user = CustomUser(
+            email=CustomUser.objects.normalize_email(validated_data['email']),
+            username=CustomUser.normalize_username(username),
+            password=hash_password(validated_data['password']),
         )
+        user.save()
         return user
 
 class UserLoginSerializer(serializers.Serializer):
@@ -27,7 +31,7 @@ class UserLoginSerializer(serializers.Serializer):
 
     def validate(self, data):
         user = CustomUser.objects.filter(email=data['email']).first()
-        if user and user.check_password(data['password']):
+        if verify_password(user, data['password']):
             refresh = RefreshToken.for_user(user)
             access_lifetime = settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME']
             refresh_lifetime = settings.SIMPLE_JWT['REFRESH_TOKEN_LIFETIME']
@@ -41,9 +45,21 @@ class UserLoginSerializer(serializers.Serializer):
         raise serializers.ValidationError("Неверный email или пароль")
 
 class UserProfileSerializer(serializers.ModelSerializer):
+    avatar_renditions = serializers.SerializerMethodField()
+
     class Meta:
         model = CustomUser
-        fields = ['username', 'avatar']
+        fields = ['username', 'avatar', 'avatar_renditions']
+
+    def get_avatar_renditions(self, obj):
+        return rendition_urls(obj.avatar, self.context.get('request'))
+
+    def update(self, instance, validated_data):
+        # Bump in the same UPDATE so a stale in-memory version is never written back
+        instance.data_version = F('data_version') + 1
+        instance = super().update(instance, validated_data)
+        instance.refresh_from_db(fields=['data_version'])
+        return instance
 
 class UserRefreshTokenSerializer(serializers.Serializer):
     refresh_token = serializers.CharField()
@@ -0,0 +1,13 @@
+from django.db import transaction
+
+from tasks.runner import PRIORITY_LOW, task
+from .models import CustomUser
+
+
+@task(priority=PRIORITY_LOW, timeout=900)
+def delete_account(user_id):
+    """Delete a deactivated account with its books, sessions and stats; the files go to delete_media."""
+    with transaction.atomic():
+        user = CustomUser.objects.filter(pk=user_id, is_active=False).first()
+        if user is not None:
+            user.delete()
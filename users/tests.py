@@ -1,3 +1,228 @@
-from django.test import TestCase
+import shutil
+import tempfile
+import runpy
+import threading
+import time
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.db.models import F
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+from rest_framework.exceptions import Throttled
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from books.models import Book
+from tasks.runner import run_pending
+
+from .authentication import UserCache, user_cache
+from .hashing import PasswordHashingPool, password_pool
+from .models import CustomUser
+
+
+class UserApiTestCase(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username='reader@example.com', email='reader@example.com', password='secret-pass-123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class AvatarRenditionTests(UserApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, True)
+
+    def test_profile_exposes_avatar_renditions(self):
+        buffer = BytesIO()
+        Image.new('RGBA', (1000, 1000), (0, 0, 0, 0)).save(buffer, 'PNG')
+        avatar = SimpleUploadedFile('avatar.png', buffer.getvalue(), content_type='image/png')
+
+        response = self.client.post(reverse('update_profile'), {'avatar': avatar}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        run_pending()
+
+        profile = self.client.get(reverse('profile')).data
+        self.assertRegex(profile['avatar'], r'/media/avatars/[0-9a-f]{64}\.png$')
+        self.assertRegex(profile['avatar_renditions']['thumbnail']['webp'], r'/renditions/[0-9a-f]{64}_thumbnail\.webp$')
+        self.assertRegex(profile['avatar_renditions']['detail']['jpg'], r'/renditions/[0-9a-f]{64}_detail\.jpg$')
+
+    def test_profile_without_avatar(self):
+        self.assertIsNone(self.client.get(reverse('profile')).data['avatar_renditions'])
+
+
+class ProfileConditionalGetTests(UserApiTestCase):
+    def test_profile_etag_changes_after_update(self):
+        url = reverse('profile')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.post(reverse('update_profile'), {'username': 'Новый читатель'}, format='json')
+        self.user.refresh_from_db()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['username'], 'Новый читатель')
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = CustomUser.objects.create_user(
+            username='reader@example.com', email='reader@example.com', password='secret-pass-123'
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+    def test_second_request_skips_user_lookup(self):
+        url = reverse('profile')
+        # the user, then only the committed data_version for the ETag
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_profile_written_by_another_process_is_not_served_stale(self):
+        url = reverse('profile')
+        etag = self.client.get(url)['ETag']
+        # Another worker renames the user: this process's cache still holds the old user
+        CustomUser.objects.filter(pk=self.user.pk).update(username='Другой', data_version=F('data_version') + 1)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['username'], 'Другой')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_profile_update_invalidates_cached_user(self):
+        self.client.get(reverse('profile'))
+        self.client.post(reverse('update_profile'), {'username': 'Читатель'}, format='json')
+        self.assertEqual(self.client.get(reverse('profile')).data['username'], 'Читатель')
+
+    def test_bump_clears_the_cache_again_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            CustomUser.bump_data_version(self.user.pk)
+            # A request before the commit caches the row as it was
+            user_cache.set(self.user.pk, self.user)
+        self.assertIsNone(user_cache.get(self.user.pk))
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get(reverse('profile'))
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 401)
+
+    def test_deleted_user_is_rejected(self):
+        self.client.get(reverse('profile'))
+        self.assertEqual(self.client.delete(reverse('delete')).status_code, 204)
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 401)
+
+    def test_account_data_is_deleted_by_the_task_worker(self):
+        Book.objects.create(
+            user=self.user, name='Бесы', author='Достоевский', pages_amount=700, description='Роман',
+            reading_status='will_read',
+        )
+        self.assertEqual(self.client.delete(reverse('delete')).status_code, 204)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertTrue(Book.objects.filter(user=self.user).exists())
+
+        self.assertEqual(run_pending(), 1)
+        self.assertFalse(CustomUser.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Book.objects.exists())
+
+    def test_cache_is_bounded_and_expires(self):
+        cache = UserCache(max_size=2, ttl=60)
+        for user_id in (1, 2, 3):
+            cache.set(user_id, self.user)
+        self.assertIsNone(cache.get(1))
+        self.assertIsNotNone(cache.get(3))
+
+        cache.ttl = -1
+        cache.set(4, self.user)
+        self.assertIsNone(cache.get(4))
+
+
+class PasswordHashingPoolTests(TestCase):
+    def setUp(self):
+        CustomUser.objects.create_user(username='reader@example.com', email='reader@example.com', password='secret-pass-123')
+
+    def login(self, email, password='secret-pass-123'):
+        return APIClient().post(reverse('login'), {'email': email, 'password': password}, format='json')
+
+    def test_register_and_login_hash_on_pool(self):
+        before = password_pool.stats()['completed']
+        response = APIClient().post(
+            reverse('register'), {'email': 'new@example.com', 'password': 'another-pass-1'}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('access_token', self.login('new@example.com', 'another-pass-1').data)
+        self.assertEqual(password_pool.stats()['completed'] - before, 2)
+
+    def test_unknown_email_still_pays_for_a_hash(self):
+        for _ in range(2):
+            before = password_pool.stats()['completed']
+            self.assertEqual(self.login('nobody@example.com').status_code, 400)
+            self.assertEqual(password_pool.stats()['completed'] - before, 1)
+
+    def test_logins_beyond_the_bound_get_429_while_other_threads_serve(self):
+        # One gthread worker as deployed: `threads` request threads share the process's pool
+        config = runpy.run_path(str(settings.BASE_DIR / 'gunicorn.conf.py'))
+        self.assertEqual(config['worker_class'], 'gthread')
+        limits = settings.PASSWORD_HASHING_POOL
+        self.assertLess(limits['WORKERS'] + limits['MAX_QUEUE'], config['threads'])
+
+        pool = PasswordHashingPool(workers=limits['WORKERS'], max_queue=limits['MAX_QUEUE'], timeout=5)
+        release = threading.Event()
+        logins = limits['WORKERS'] + limits['MAX_QUEUE'] + 2
+
+        def login():
+            try:
+                return pool.run(release.wait)
+            except Throttled:
+                return 429
+
+        with ThreadPoolExecutor(max_workers=config['threads']) as request_threads:
+            results = [request_threads.submit(login) for _ in range(logins)]
+            while pool.stats()['in_flight'] + pool.stats()['rejected'] < logins:
+                time.sleep(0.001)
+            # Logins are blocked on the pool, yet another request still gets a thread
+            self.assertEqual(request_threads.submit(lambda: 'served').result(timeout=1), 'served')
+            release.set()
+            results = [result.result() for result in results]
+        self.assertEqual(results.count(429), 2)
+        self.assertEqual(results.count(True), logins - 2)
+
+    def test_saturated_pool_rejects_fast(self):
+        pool = PasswordHashingPool(workers=1, max_queue=0, timeout=5)
+        release = threading.Event()
+        blocker = threading.Thread(target=pool.run, args=(release.wait,))
+        blocker.start()
+        try:
+            while pool.stats()['in_flight'] == 0:
+                time.sleep(0.001)
+            with mock.patch('users.hashing.password_pool', pool):
+                response = self.login('reader@example.com')
+            self.assertEqual(response.status_code, 429)
+            self.assertIn('Retry-After', response)
+            self.assertEqual(pool.stats()['rejected'], 1)
+        finally:
+            release.set()
+            blocker.join()
+
+    def test_slow_hash_times_out_with_503(self):
+        pool = PasswordHashingPool(workers=1, max_queue=0, timeout=0.01)
+        release = threading.Event()
+        with mock.patch('users.hashing.password_pool', pool), \
+                mock.patch('users.hashing.check_password', lambda *args: release.wait()):
+            response = self.login('reader@example.com')
+        release.set()
+        self.assertEqual(response.status_code, 503)
@@ -1,11 +1,15 @@
+from django.conf import settings
 from django.urls import path
+
+from . import async_views
 from .views import (
     UserRegistrationView,
     UserLoginView,
     UserProfileUpdateView,
     UserRefreshTokenView,
     UserDeleteView,
-    UserProfileView
+    UserProfileView,
+    PasswordHashingStatsView
 )
 
 urlpatterns = [
@@ -13,6 +17,7 @@ urlpatterns = [
     path('login/', UserLoginView.as_view(), name='login'),
     path('update_profile/', UserProfileUpdateView.as_view(), name='update_profile'),
     path('refresh_token/', UserRefreshTokenView.as_view(), name='refresh_token'),
-    path('profile/', UserProfileView.as_view(), name='profile'),
+    path('profile/', async_views.profile if settings.SERVER_MODE == 'asgi' else UserProfileView.as_view(), name='profile'),
     path('delete/', UserDeleteView.as_view(), name='delete'),
+    path('password_hashing_stats/', PasswordHashingStatsView.as_view(), name='password_hashing_stats'),
 ]
\ No newline at end of file
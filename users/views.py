@@ -1,17 +1,22 @@
+from django.db import transaction
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import Throttled, ValidationError
 from drf_yasg.utils import swagger_auto_schema
+from books import cache as books_cache
+from witbook.conditional import conditional_get, make_etag
 from .serializers import (
     UserRegistrationSerializer,
     UserLoginSerializer,
     UserProfileSerializer,
     UserRefreshTokenSerializer,
 )
+from .hashing import PasswordHashingTimeout, password_pool
 from .models import CustomUser
+from .tasks import delete_account
 
 class UserRegistrationView(APIView):
     @swagger_auto_schema(
@@ -32,6 +37,8 @@ class UserRegistrationView(APIView):
                     'access_token': str(refresh.access_token),
                     'refresh_token': str(refresh)
                 }, status=status.HTTP_201_CREATED)
+            except (Throttled, PasswordHashingTimeout):
+                raise
             except ValidationError as e:
                 return Response({'error': f'Ошибка валидации: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
             except Exception as e:
@@ -96,14 +103,22 @@ class UserRefreshTokenView(APIView):
         return Response({'error': 'Ошибка валидации данных'}, status=status.HTTP_400_BAD_REQUEST)
 
 
+def profile_etag(request):
+    return make_etag(request, 'profile', request.user.pk, books_cache.data_version(request))
+
+
 class UserProfileView(APIView):
     permission_classes = [IsAuthenticated]
 
     @swagger_auto_schema(
-        responses={200: UserProfileSerializer},
+        responses={200: UserProfileSerializer, 304: 'Not Modified'},
         operation_description="Получение профиля пользователя"
     )
+    @conditional_get(profile_etag)
     def get(self, request):
+        # The body has to match the ETag, and request.user may be a stale cached copy
+        if request.user.data_version != books_cache.data_version(request):
+            request.user.refresh_from_db()
         try:
             serializer = UserProfileSerializer(request.user)
             return Response(serializer.data, status=status.HTTP_200_OK)
@@ -116,11 +131,26 @@ class UserDeleteView(APIView):
 
     @swagger_auto_schema(
         responses={204: 'No Content'},
-        operation_description="Удаление пользователя"
+        operation_description="Удаление пользователя: аккаунт сразу отключается, данные удаляются в фоне"
     )
+    @transaction.atomic
     def delete(self, request):
         try:
-            request.user.delete()
+            books_cache.invalidate_user(request.user, *request.user.book_set.values_list('id', flat=True))
+            request.user.is_active = False
+            request.user.save(update_fields=['is_active'])
+            delete_account.defer(request.user.pk)
             return Response(status=status.HTTP_204_NO_CONTENT)
         except Exception as e:
-            return Response({'error': f'Ошибка удаления пользователя: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+            return Response({'error': f'Ошибка удаления пользователя: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class PasswordHashingStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        responses={200: '{"submitted": 0, "rejected": 0, "queue_wait_seconds_total": 0.0, "hash_seconds_total": 0.0}'},
+        operation_description="Метрики пула хеширования паролей: очередь, время ожидания и хеширования"
+    )
+    def get(self, request):
+        return Response(password_pool.stats(), status=status.HTTP_200_OK)
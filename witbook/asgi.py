@@ -12,5 +12,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'witbook.settings')
+os.environ.setdefault('WITBOOK_SERVER', 'asgi')
 
 application = get_asgi_application()
@@ -0,0 +1,69 @@
+"""
+Helpers for the async views used in the ASGI serving mode (WITBOOK_SERVER=asgi).
+
+DRF 3.15 APIViews are sync-only, so the async views are plain Django coroutines. They
+authenticate with the same JWT rules and render with the same JSON renderer, so response
+bodies are the same as those of the sync views.
+"""
+import functools
+
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from users.authentication import CachedJWTAuthentication
+from .renderers import FastJSONRenderer
+
+renderer = FastJSONRenderer()
+
+
+def render(data, status_code=status.HTTP_200_OK, headers=None):
+    return HttpResponse(renderer.render(data), status=status_code, content_type=renderer.media_type, headers=headers)
+
+
+def render_exception(exc):
+    headers = {}
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        headers['WWW-Authenticate'] = CachedJWTAuthentication().authenticate_header(None)
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return render(data, exc.status_code, headers)
+
+
+def async_api_view(*methods):
+    """Require an authenticated user and one of ``methods``; APIExceptions become JSON errors."""
+
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            try:
+                if request.method not in methods:
+                    raise exceptions.MethodNotAllowed(request.method)
+                result = await CachedJWTAuthentication().aauthenticate(request)
+                if result is None:
+                    raise exceptions.NotAuthenticated()
+                request.user, request.auth = result
+                return await view(request, *args, **kwargs)
+            except exceptions.APIException as exc:
+                return render_exception(exc)
+
+        wrapper.csrf_exempt = True
+        return wrapper
+
+    return decorator
+
+
+def not_modified(request, etag):
+    """Returns a 304 response when If-None-Match matches ``etag``, otherwise None."""
+    return get_conditional_response(request, etag=etag)
+
+
+def drf_request(request):
+    """Wraps an authenticated HttpRequest for code that expects a DRF Request (parsers, paginators)."""
+    api_request = Request(
+        request, parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES], authenticators=()
+    )
+    api_request.user = request.user
+    api_request.auth = request.auth
+    return api_request
@@ -0,0 +1,118 @@
+"""
+Negotiated compression of API responses.
+
+Django's GZipMiddleware only knows gzip and compresses anything over 200 bytes. This middleware
+picks brotli (when the Brotli package is installed) or gzip by the client's Accept-Encoding
+q-values, and leaves alone:
+
+- bodies shorter than COMPRESSION['MIN_SIZE'], which a packet carries as well uncompressed;
+- content types outside COMPRESSIBLE_TYPES: images are already compressed, and HTML (the admin,
+  the browsable API) carries CSRF tokens that must not be compressed next to request data (BREACH);
+- responses that set Content-Encoding themselves (the OpenAPI document, the library export) and
+  other streaming responses.
+
+Like GZipMiddleware it makes a strong ETag weak, so If-None-Match keeps matching.
+"""
+import gzip
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    'application/json', 'application/openapi+json', 'application/yaml', 'application/javascript',
+    'text/plain', 'text/csv', 'text/css', 'text/javascript',
+)
+
+
+def gzip_compress(content):
+    return gzip.compress(content, compresslevel=settings.COMPRESSION['GZIP_LEVEL'], mtime=0)
+
+
+def brotli_compress(content):
+    return brotli.compress(content, quality=settings.COMPRESSION['BROTLI_QUALITY'])
+
+
+def encodings():
+    """Content-Encoding -> compress function, the preferred one first."""
+    available = {'br': brotli_compress} if brotli is not None else {}
+    available['gzip'] = gzip_compress
+    return available
+
+
+def accepted_encoding(accept_encoding, available):
+    """The one of ``available`` the Accept-Encoding header ranks highest, or None."""
+    weights = {}
+    for item in accept_encoding.split(','):
+        coding, *params = item.split(';')
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding.strip().lower()] = weight
+
+    best, best_weight = None, 0.0
+    for coding in available:
+        weight = weights.get(coding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+def is_compressible(response):
+    if response.streaming or response.status_code == 206 or response.has_header('Content-Encoding'):
+        return False
+    if 'no-transform' in response.get('Cache-Control', ''):
+        return False
+    content_type = response.get('Content-Type', '').partition(';')[0].strip().lower()
+    return content_type in COMPRESSIBLE_TYPES and len(response.content) >= settings.COMPRESSION['MIN_SIZE']
+
+
+def compress_response(request, response):
+    if not is_compressible(response):
+        return response
+    patch_vary_headers(response, ('Accept-Encoding',))
+
+    available = encodings()
+    coding = accepted_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), available)
+    if coding is None:
+        return response
+    compressed = available[coding](response.content)
+    if len(compressed) >= len(response.content):
+        return response
+
+    response.content = compressed
+    response['Content-Length'] = str(len(compressed))
+    response['Content-Encoding'] = coding
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = 'W/' + etag
+    return response
+
+
+class CompressionMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return compress_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return compress_response(request, await self.get_response(request))
@@ -0,0 +1,16 @@
+import hashlib
+
+from django.conf import settings
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+
+
+def make_etag(request, *parts):
+    """Strong ETag from version parts, the API format salt and the query string."""
+    query = hashlib.sha1(request.META.get('QUERY_STRING', '').encode()).hexdigest()[:12]
+    return '"%s"' % '-'.join([settings.API_ETAG_SALT, *map(str, parts), query])
+
+
+def conditional_get(etag_func):
+    """Answers If-None-Match with 304 before the APIView handler runs."""
+    return method_decorator(condition(etag_func=etag_func))
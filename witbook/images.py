@@ -0,0 +1,167 @@
+import hashlib
+import io
+import posixpath
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from tasks.runner import PRIORITY_HIGH, PRIORITY_LOW, task
+from .storage import is_content_addressed, reference_count
+
+RENDITIONS_DIR = 'renditions'
+RENDITION_FORMATS = (('webp', 'WEBP'), ('jpg', 'JPEG'))
+EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg', 'PNG': 'png'}
+SAVE_OPTIONS = {
+    'WEBP': {'quality': 80, 'method': 4},
+    'JPEG': {'quality': 82, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+}
+
+
+def get_rendition_sizes():
+    return settings.IMAGE_RENDITIONS
+
+
+def rendition_name(name, rendition, extension):
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, RENDITIONS_DIR, f'{stem}_{rendition}.{extension}')
+
+
+def strip_metadata(image):
+    image.info = {key: value for key, value in image.info.items() if key == 'transparency'}
+    return image
+
+
+def flatten(image):
+    from PIL import Image
+
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def encode(image, image_format):
+    if image_format == 'JPEG':
+        image = flatten(image)
+    elif image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **SAVE_OPTIONS.get(image_format, {}))
+    return buffer.getvalue()
+
+
+def normalize_upload(field_file):
+    """Apply the EXIF orientation and re-encode the upload without metadata."""
+    # Pillow is imported by the code that uses it: only uploads and the task worker need it
+    from PIL import Image, ImageOps
+
+    field_file.seek(0)
+    with Image.open(field_file) as source:
+        image_format = source.format if source.format in SAVE_OPTIONS else 'PNG'
+        image = strip_metadata(ImageOps.exif_transpose(source))
+        content = encode(image, image_format)
+
+    # Named by content: MediaStorage stores identical images once
+    return ContentFile(content, name=f'{hashlib.sha256(content).hexdigest()}.{EXTENSIONS[image_format]}')
+
+
+def delete_now(storage, name):
+    # MediaStorage.delete() only queues the removal
+    getattr(storage, 'delete_now', storage.delete)(name)
+
+
+def generate_renditions(name, storage=default_storage):
+    from PIL import Image, ImageOps
+
+    with storage.open(name, 'rb') as original, Image.open(original) as source:
+        image = strip_metadata(ImageOps.exif_transpose(source))
+
+    for rendition, size in get_rendition_sizes().items():
+        resized = image.copy()
+        resized.thumbnail(size, Image.LANCZOS)
+        for extension, image_format in RENDITION_FORMATS:
+            rendition_file = rendition_name(name, rendition, extension)
+            if storage.exists(rendition_file):
+                delete_now(storage, rendition_file)
+            storage.save(rendition_file, ContentFile(encode(resized, image_format)))
+
+
+def delete_renditions(name, storage=default_storage):
+    for rendition in get_rendition_sizes():
+        for extension, _ in RENDITION_FORMATS:
+            delete_now(storage, rendition_name(name, rendition, extension))
+
+
+def has_renditions(name, storage=default_storage):
+    return all(
+        storage.exists(rendition_name(name, rendition, extension))
+        for rendition in get_rendition_sizes()
+        for extension, _ in RENDITION_FORMATS
+    )
+
+
+@task(priority=PRIORITY_HIGH)
+def render_image(name):
+    # The image may have been deleted before the task ran, and a deduplicated upload already
+    # has its renditions
+    if not default_storage.exists(name):
+        return
+    if is_content_addressed(name) and has_renditions(name):
+        return
+    generate_renditions(name)
+
+
+@task(priority=PRIORITY_LOW)
+def delete_media(names):
+    """Remove files (with renditions) that no row references any more."""
+    grace = timedelta(seconds=settings.MEDIA_DELETE_GRACE)
+    recent = []
+    for name in names:
+        if reference_count(name) or not default_storage.exists(name):
+            continue
+        # A file uploaded again moments ago may belong to a row that is not committed yet
+        if default_storage.get_modified_time(name) > timezone.now() - grace:
+            recent.append(name)
+            continue
+        delete_now(default_storage, name)
+        delete_renditions(name)
+    if recent:
+        delete_media.defer(recent, run_after=timezone.now() + grace)
+
+
+def rendition_urls(field_file, request=None):
+    if not field_file:
+        return None
+    return stored_rendition_urls(field_file.name, field_file.storage, request)
+
+
+def stored_rendition_urls(name, storage=default_storage, request=None):
+    """rendition_urls() for a stored file name, for code that reads columns rather than instances."""
+
+    def build(rendition_file):
+        url = storage.url(rendition_file)
+        return request.build_absolute_uri(url) if request is not None else url
+
+    return {
+        rendition: {
+            extension: build(rendition_name(name, rendition, extension))
+            for extension, _ in RENDITION_FORMATS
+        }
+        for rendition in get_rendition_sizes()
+    }
+
+
+def prepare_image_upload(instance, field_name):
+    """Normalize a not yet stored upload in place; returns True if there was one."""
+    field_file = getattr(instance, field_name)
+    if not field_file or field_file._committed:
+        return False
+    setattr(instance, field_name, normalize_upload(field_file))
+    return True
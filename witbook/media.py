@@ -0,0 +1,111 @@
+"""
+Serves MEDIA_ROOT in every mode, not only with DEBUG like django.conf.urls.static.
+
+Content-addressed files (see witbook.storage) never change, so they are cached for a year as
+immutable; other files (renditions, uploads from before content addressing) for
+MEDIA_CACHE_MAX_AGE. Single byte ranges are supported, so clients can resume downloads.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+from .storage import is_content_addressed
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header, size):
+    """(start, end) of a single satisfiable range, 'unsatisfiable', or None to send everything."""
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        # Malformed or multiple ranges may be ignored (RFC 9110, 14.2)
+        return None
+    first, last = match.groups()
+    if not first:
+        # A suffix range: the last N bytes
+        if int(last) == 0 or size == 0:
+            return 'unsatisfiable'
+        return max(size - int(last), 0), size - 1
+
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return 'unsatisfiable'
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def read_range(path, start, length):
+    with open(path, 'rb') as source:
+        source.seek(start)
+        while length > 0:
+            chunk = source.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@require_safe
+def serve(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404()
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404()
+    if not os.path.isfile(full_path) or posixpath.basename(path).startswith('.'):
+        raise Http404()
+
+    if is_content_addressed(path):
+        etag = '"%s"' % posixpath.splitext(posixpath.basename(path))[0]
+        cache_control = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        etag = '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+        cache_control = f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}'
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        response = file_response(request, full_path, stat.st_size, etag)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = cache_control
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def file_response(request, full_path, size, etag):
+    requested = request.META.get('HTTP_RANGE')
+    # If-Range: the range only applies to the version the client already has part of
+    if requested and request.META.get('HTTP_IF_RANGE', etag) == etag:
+        byte_range = parse_range(requested, size)
+    else:
+        byte_range = None
+
+    if byte_range == 'unsatisfiable':
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    if byte_range is None:
+        return FileResponse(open(full_path, 'rb'))
+
+    start, end = byte_range
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    response = StreamingHttpResponse(read_range(full_path, start, end - start + 1), status=206,
+                                     content_type=content_type)
+    response['Content-Length'] = end - start + 1
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
@@ -0,0 +1,312 @@
+"""
+Per-request instrumentation and a Prometheus endpoint.
+
+MetricsMiddleware times every request and, through a database execute wrapper and a hook on
+serializer ``.data``, the SQL and serialization done for it. It records them per view, adds a
+Server-Timing header and logs slow requests with their heaviest queries.
+
+Each process (gunicorn worker) keeps its own counters and periodically writes them to a file in
+METRICS['DIRECTORY']; the /metrics endpoint sums the files of all workers. Like any counter, a
+worker's numbers restart from zero when the worker does, which Prometheus treats as a reset.
+"""
+import contextvars
+import ipaddress
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+SLOW_QUERIES_LOGGED = 5
+
+METRICS = {
+    'witbook_http_requests_total': ('counter', 'Requests by view, method and status'),
+    'witbook_http_request_duration_seconds': ('histogram', 'Time to produce the response', LATENCY_BUCKETS),
+    'witbook_http_response_size_bytes': ('histogram', 'Size of non-streaming response bodies', SIZE_BUCKETS),
+    'witbook_db_queries_total': ('counter', 'SQL queries executed by requests'),
+    'witbook_db_query_duration_seconds_total': ('counter', 'Time spent in SQL queries'),
+    'witbook_serializer_duration_seconds_total': ('counter', 'Time spent in serializer .data'),
+    'witbook_books_cache_requests_total': ('counter', 'Books response cache lookups by outcome'),
+    'witbook_password_hashing_jobs_total': ('counter', 'Password hashing pool jobs by outcome'),
+    'witbook_password_hashing_seconds_total': ('counter', 'Password hashing pool time by phase'),
+}
+
+_current = contextvars.ContextVar('witbook_request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.query_breakdown = defaultdict(lambda: [0, 0.0])
+        self.serializer_time = 0.0
+        self.serializing = False
+
+
+def record_query(execute, sql, params, many, context):
+    state = _current.get()
+    if state is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        state.queries += 1
+        state.query_time += elapsed
+        breakdown = state.query_breakdown[sql]
+        breakdown[0] += 1
+        breakdown[1] += elapsed
+
+
+def timed_data(data_property):
+    def data(self):
+        state = _current.get()
+        # Nested serializers are part of the outermost one's time
+        if state is None or state.serializing:
+            return data_property.fget(self)
+        state.serializing = True
+        started = time.perf_counter()
+        try:
+            return data_property.fget(self)
+        finally:
+            state.serializer_time += time.perf_counter() - started
+            state.serializing = False
+
+    return property(data)
+
+
+def add_query_wrapper(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+_installed = False
+
+
+def install():
+    """Hook SQL execution and serializer .data once per process."""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    connection_created.connect(add_query_wrapper)
+    for connection in connections.all():
+        add_query_wrapper(connection)
+    # DRF has no hook around serialization, so .data is wrapped; only outermost calls are timed
+    serializers.Serializer.data = timed_data(serializers.Serializer.data)
+    serializers.ListSerializer.data = timed_data(serializers.ListSerializer.data)
+
+
+def label_string(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    return ','.join(f'{name}="{escape(value)}"' for name, value in labels.items())
+
+
+class Registry:
+    """Counters and histograms of this process, keyed by metric name and label string."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.flushed_at = 0.0
+
+    def inc(self, name, labels, value=1):
+        with self.lock:
+            self.counters[name, labels] += value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        with self.lock:
+            counts = self.histograms.setdefault((name, labels), [0] * len(buckets) + [0.0, 0])
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def snapshot(self):
+        from books import cache as books_cache
+        from users.hashing import password_pool
+
+        with self.lock:
+            snapshot = {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, labels, list(counts)] for (name, labels), counts in self.histograms.items()],
+            }
+        for outcome, value in books_cache.stats().items():
+            snapshot['counters'].append(['witbook_books_cache_requests_total', label_string(outcome=outcome), value])
+        pool = password_pool.stats()
+        for outcome in ('submitted', 'completed', 'rejected', 'timeouts'):
+            snapshot['counters'].append(
+                ['witbook_password_hashing_jobs_total', label_string(outcome=outcome), pool[outcome]]
+            )
+        for phase, key in (('queue_wait', 'queue_wait_seconds_total'), ('hash', 'hash_seconds_total')):
+            snapshot['counters'].append(['witbook_password_hashing_seconds_total', label_string(phase=phase), pool[key]])
+        return snapshot
+
+    def flush(self, force=False):
+        """Write this process's snapshot for the endpoint, at most every FLUSH_INTERVAL seconds."""
+        now = time.monotonic()
+        if not force and now - self.flushed_at < settings.METRICS['FLUSH_INTERVAL']:
+            return
+        self.flushed_at = now
+        directory = metrics_directory()
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=directory, prefix='.flush-')
+        with os.fdopen(descriptor, 'w') as snapshot_file:
+            json.dump(self.snapshot(), snapshot_file)
+        os.replace(temporary, os.path.join(directory, f'{os.getpid()}.json'))
+
+
+registry = Registry()
+
+
+def metrics_directory():
+    return settings.METRICS['DIRECTORY'] or os.path.join(tempfile.gettempdir(), 'witbook-metrics')
+
+
+def collect():
+    """Sum the snapshots of every worker."""
+    counters = defaultdict(float)
+    histograms = {}
+    directory = metrics_directory()
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except (OSError, ValueError):
+            continue
+        for name, labels, value in snapshot['counters']:
+            counters[name, labels] += value
+        for name, labels, counts in snapshot['histograms']:
+            total = histograms.setdefault((name, labels), [0] * len(counts))
+            for index, count in enumerate(counts):
+                total[index] += count
+    return counters, histograms
+
+
+def render(counters, histograms):
+    series = defaultdict(list)
+    for (name, labels), value in sorted(counters.items()):
+        series[name].append(f'{name}{{{labels}}} {value:g}' if labels else f'{name} {value:g}')
+    for (name, labels), counts in sorted(histograms.items()):
+        prefix = f'{labels},' if labels else ''
+        for bound, count in zip(METRICS[name][2], counts):
+            series[name].append(f'{name}_bucket{{{prefix}le="{bound:g}"}} {count}')
+        series[name].append(f'{name}_bucket{{{prefix}le="+Inf"}} {counts[-1]}')
+        series[name].append(f'{name}_sum{{{labels}}} {counts[-2]:g}')
+        series[name].append(f'{name}_count{{{labels}}} {counts[-1]}')
+
+    lines = []
+    for name in sorted(series):
+        lines.append(f'# HELP {name} {METRICS[name][1]}')
+        lines.append(f'# TYPE {name} {METRICS[name][0]}')
+        lines.extend(series[name])
+    return '\n'.join(lines) + '\n'
+
+
+def is_allowed(request):
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network) for network in settings.METRICS['ALLOWED_NETWORKS'])
+
+
+def metrics_view(request):
+    """Prometheus text exposition; only answers the networks in METRICS['ALLOWED_NETWORKS']."""
+    if not is_allowed(request):
+        raise Http404()
+    registry.flush(force=True)
+    return HttpResponse(render(*collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        install()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state = RequestMetrics()
+        token = _current.set(state)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, state, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        state = RequestMetrics()
+        token = _current.set(state)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, state, time.perf_counter() - started)
+
+    def finish(self, request, response, state, duration):
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unmatched'
+        labels = label_string(view=view)
+
+        registry.inc(
+            'witbook_http_requests_total',
+            label_string(view=view, method=request.method, status=response.status_code),
+        )
+        registry.observe('witbook_http_request_duration_seconds', labels, duration)
+        if not response.streaming:
+            registry.observe('witbook_http_response_size_bytes', labels, len(response.content))
+        registry.inc('witbook_db_queries_total', labels, state.queries)
+        registry.inc('witbook_db_query_duration_seconds_total', labels, state.query_time)
+        registry.inc('witbook_serializer_duration_seconds_total', labels, state.serializer_time)
+        registry.flush()
+
+        if settings.METRICS['SERVER_TIMING']:
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={state.query_time * 1000:.1f};desc="{state.queries} queries"',
+                f'serializer;dur={state.serializer_time * 1000:.1f}',
+                f'total;dur={duration * 1000:.1f}',
+            ])
+        if duration * 1000 >= settings.METRICS['SLOW_REQUEST_MS']:
+            self.log_slow(request, response, state, duration, view)
+        return response
+
+    def log_slow(self, request, response, state, duration, view):
+        heaviest = sorted(state.query_breakdown.items(), key=lambda item: item[1][1], reverse=True)
+        breakdown = ''.join(
+            f'\n  {count}x {total * 1000:.1f} ms  {sql[:200]}' for sql, (count, total) in heaviest[:SLOW_QUERIES_LOGGED]
+        )
+        logger.warning(
+            'Slow request %s %s (%s) -> %s in %.0f ms: %d queries in %.0f ms, serializer %.0f ms%s',
+            request.method, request.path, view, response.status_code, duration * 1000,
+            state.queries, state.query_time * 1000, state.serializer_time * 1000, breakdown,
+        )
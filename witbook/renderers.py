@@ -0,0 +1,40 @@
+"""
+DRF's JSONRenderer, with orjson doing the encoding where it gives the same bytes.
+
+For compact, non-ASCII, strict JSON (the REST_FRAMEWORK defaults) orjson writes what
+JSONRenderer writes, several times faster, except that:
+
+- JSONRenderer escapes U+2028 and U+2029, which is done here as well;
+- floats that Python writes with an exponent (|x| < 1e-4 or >= 1e16) are written differently,
+  so such a body is encoded again by JSONRenderer;
+- datetimes, dataclasses and anything else orjson cannot encode natively (Decimal, lazy
+  strings, integers beyond 64 bits) also go to JSONRenderer;
+- NaN and infinities, which JSONRenderer refuses, come out as null.
+"""
+import re
+
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# A number token that orjson writes with an exponent or as 0.0000..., where Python uses an exponent
+PYTHON_EXPONENT_RE = re.compile(rb'(?:^|[:,\[])-?(?:\d+(?:\.\d+)?e[-+]?\d+|0\.0000\d*)(?:[,\]}]|$)')
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None or data is None or self.ensure_ascii or not self.compact or not self.strict
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if PYTHON_EXPONENT_RE.search(ret):
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
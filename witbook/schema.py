@@ -0,0 +1,171 @@
+"""
+The OpenAPI document, generated once per code version instead of on every request.
+
+drf_yasg walks every view and swagger_auto_schema each time the document is requested. Here it
+is built once, by ``manage.py build_openapi_schema`` when the image is built or on first use,
+written to OPENAPI_SCHEMA['DIRECTORY'] under the code version and then served from memory,
+with an ETag and a gzipped copy. A new version (a deploy, a changed source file) builds a new
+document; the old files are left for the previous release's workers.
+
+The document is built without a request, so it has no host and Swagger UI uses the one it was
+loaded from. The generator, its inspectors and the codecs are imported only to build it.
+"""
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
+from functools import lru_cache
+from pathlib import Path
+
+import django
+import drf_yasg
+import rest_framework
+from django.apps import apps
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.views.decorators.http import require_safe
+from drf_yasg import openapi
+from rest_framework import permissions
+
+from .compression import accepted_encoding
+
+INFO = openapi.Info(
+    title="witbook API",
+    default_version='v1',
+    description="amir brat che tam",
+    terms_of_service="https://www.example.com",
+    contact=openapi.Contact(email="contact@example.com"),
+    license=openapi.License(name="Awesome License"),
+)
+
+# drf_yasg ?format= value -> (file extension, content type)
+FORMATS = {
+    'openapi': ('json', 'application/openapi+json; charset=utf-8'),
+    '.json': ('json', 'application/json; charset=utf-8'),
+    '.yaml': ('yaml', 'application/yaml; charset=utf-8'),
+}
+
+
+class Document:
+    def __init__(self, body):
+        self.body = body
+        self.gzipped = gzip.compress(body, mtime=0)
+        self.etag = '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+
+
+_documents = {}
+_lock = threading.Lock()
+_version = None
+
+
+def code_version():
+    """OPENAPI_SCHEMA['VERSION'] (e.g. the commit being deployed), else a digest of the project sources."""
+    global _version
+    if _version is None:
+        _version = settings.OPENAPI_SCHEMA['VERSION'] or source_digest()
+    return _version
+
+
+def source_digest():
+    digest = hashlib.sha256()
+    for package in (django, rest_framework, drf_yasg):
+        digest.update(f'{package.__name__}={package.__version__};'.encode())
+    digest.update(repr(getattr(settings, 'SWAGGER_SETTINGS', None)).encode())
+
+    base_dir = Path(settings.BASE_DIR).resolve()
+    project_dirs = {Path(__file__).resolve().parent}
+    project_dirs.update(
+        Path(config.path).resolve() for config in apps.get_app_configs()
+        if base_dir in Path(config.path).resolve().parents
+    )
+    for directory in sorted(project_dirs):
+        for source in sorted(directory.rglob('*.py')):
+            digest.update(str(source.relative_to(base_dir)).encode())
+            digest.update(source.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def document_path(extension):
+    return Path(settings.OPENAPI_SCHEMA['DIRECTORY']) / f'openapi-{code_version()}.{extension}'
+
+
+def generate():
+    """Encoded documents for every extension, built from the current urlconf."""
+    from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+    from drf_yasg.generators import OpenAPISchemaGenerator
+
+    schema = OpenAPISchemaGenerator(INFO).get_schema(request=None, public=True)
+    codecs = {'json': OpenAPICodecJson, 'yaml': OpenAPICodecYaml}
+    return {extension: codec(validators=[]).encode(schema) for extension, codec in codecs.items()}
+
+
+def build():
+    """Generate the documents and write them for this code version; returns their paths."""
+    bodies = generate()
+    directory = Path(settings.OPENAPI_SCHEMA['DIRECTORY'])
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for extension, body in bodies.items():
+        descriptor, temporary = tempfile.mkstemp(dir=directory, prefix='.openapi-')
+        with os.fdopen(descriptor, 'wb') as document_file:
+            document_file.write(body)
+        os.replace(temporary, document_path(extension))
+        paths.append(document_path(extension))
+    return paths
+
+
+def get_document(extension):
+    with _lock:
+        key = (code_version(), extension)
+        if key not in _documents:
+            path = document_path(extension)
+            if not path.exists():
+                build()
+            _documents[key] = Document(path.read_bytes())
+        return _documents[key]
+
+
+def reset():
+    """Forget the loaded documents and the code version (tests, or after build_openapi_schema)."""
+    global _version
+    with _lock:
+        _documents.clear()
+        _version = None
+
+
+@require_safe
+def serve(request, format):
+    extension, content_type = FORMATS[format]
+    document = get_document(extension)
+    compressed = accepted_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), ['gzip']) is not None
+    etag = document.etag[:-1] + '-gzip"' if compressed else document.etag
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(document.gzipped if compressed else document.body, content_type=content_type)
+        if compressed:
+            response['Content-Encoding'] = 'gzip'
+    response['ETag'] = etag
+    # Revalidated on every use: a deploy changes the document at the same URL
+    response['Cache-Control'] = 'no-cache'
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
+@lru_cache(maxsize=None)
+def ui_view():
+    """Only the HTML page; its generator is given no patterns, so rendering it is cheap."""
+    from drf_yasg.views import UI_RENDERERS, get_schema_view
+
+    schema_view = get_schema_view(INFO, public=True, permission_classes=(permissions.AllowAny,))
+    return schema_view.as_cached_view(renderer_classes=UI_RENDERERS['swagger'])
+
+
+def swagger(request):
+    """/swagger/ is the UI, /swagger/?format=openapi (or .json, .yaml) the document it loads."""
+    format = request.GET.get('format')
+    if format in FORMATS:
+        return serve(request, format)
+    return ui_view()(request)
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -22,10 +23,13 @@ INSTALLED_APPS = [
     'rest_framework_simplejwt',
     'drf_yasg',
     'users',
-    'books'
+    'books',
+    'tasks',
 ]
 
 MIDDLEWARE = [
+    'witbook.metrics.MetricsMiddleware',
+    'witbook.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,13 +59,43 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'witbook.wsgi.application'
 
+# 'asgi' routes the hot endpoints to the async views (books.async_views, users.async_views).
+# witbook/asgi.py sets it, so it only has to be given explicitly to force one mode
+SERVER_MODE = os.environ.get('WITBOOK_SERVER', 'wsgi')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3'
+        'NAME': os.environ.get('WITBOOK_DB_PATH', BASE_DIR / 'db.sqlite3')
     }
 }
 
+# WITBOOK_DB_PROFILE=production: WAL journal, tuned pragmas, connections kept between
+# requests and BEGIN IMMEDIATE for atomic blocks, so concurrent writers queue on
+# busy_timeout instead of failing with "database is locked"
+DB_PROFILE = os.environ.get('WITBOOK_DB_PROFILE', 'default')
+
+SQLITE_PRODUCTION_OPTIONS = {
+    'timeout': 20,
+    'transaction_mode': 'IMMEDIATE',
+    'pragmas': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 20000,
+        'cache_size': -20000,
+        'temp_store': 'MEMORY',
+        'mmap_size': 134217728,
+    },
+}
+
+if DB_PROFILE == 'production':
+    DATABASES['default'].update({
+        'ENGINE': 'witbook.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': SQLITE_PRODUCTION_OPTIONS,
+    })
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -77,6 +111,15 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Login/registration hash passwords on this pool; beyond WORKERS + MAX_QUEUE concurrent
+# requests they get 429, and a hash not done within TIMEOUT seconds gives 503
+PASSWORD_HASHING_POOL = {
+    'WORKERS': 2,
+    # WORKERS + MAX_QUEUE below gunicorn's threads per worker, or the bound is never reached
+    'MAX_QUEUE': 2,
+    'TIMEOUT': 5,
+}
+
 LANGUAGE_CODE = 'ru'
 TIME_ZONE = 'Asia/Almaty'
 USE_I18N = True
@@ -88,14 +131,101 @@ STATIC_ROOT = BASE_DIR / "static_root"
 MEDIA_URL = '/media/'
 MEDIA_ROOT = '/code/media'
 
+STORAGES = {
+    'default': {'BACKEND': 'witbook.storage.MediaStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+# Cache lifetime of media that is not content-addressed (renditions, older uploads), seconds
+MEDIA_CACHE_MAX_AGE = 24 * 60 * 60
+# A file is removed only if it was not uploaded again within this many seconds
+MEDIA_DELETE_GRACE = 60
+
+# Max (width, height) of the resized copies made for every uploaded cover and avatar
+IMAGE_RENDITIONS = {
+    'thumbnail': (200, 300),
+    'detail': (800, 1200),
+}
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'witbook.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
 }
 
+# In-process cache of authenticated users, see users.authentication. Other workers notice
+# a profile change only after TTL seconds, so keep it short
+AUTH_USER_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 10,
+}
+
+BOOKS_PAGE_SIZE = 50
+BOOKS_MAX_PAGE_SIZE = 200
+BOOKS_SYNC_MAX_SESSIONS = 500
+BOOKS_STATS_MAX_DAYS = 366
+BOOKS_SEARCH_LIMIT = 10
+BOOKS_SEARCH_MAX_LIMIT = 50
+BOOKS_EXPORT_CHUNK_SIZE = 200
+# The book list and details read columns with values() instead of running the serializers
+# (books.representations); the output is the same either way
+BOOKS_FAST_SERIALIZATION = True
+BOOKS_IMPORT = {
+    'BATCH_SIZE': 500,
+    'MAX_ROWS': 10000,
+    'MAX_FILE_SIZE': 10 * 2 ** 20,
+}
+
+# Response compression (witbook.compression): brotli when the Brotli package is installed, else gzip
+COMPRESSION = {
+    'MIN_SIZE': 1024,
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,
+}
+
+# Request metrics (witbook.metrics). Every worker writes its counters to DIRECTORY (default: a
+# witbook-metrics directory in the system temp dir) every FLUSH_INTERVAL seconds; /metrics sums them
+METRICS = {
+    'DIRECTORY': os.environ.get('WITBOOK_METRICS_DIR'),
+    'FLUSH_INTERVAL': 5,
+    'ALLOWED_NETWORKS': ['127.0.0.0/8', '::1/128', '10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16'],
+    'SERVER_TIMING': True,
+    'SLOW_REQUEST_MS': 500,
+}
+
+# Background tasks (tasks app, run by manage.py run_tasks); timeouts and delays in seconds
+TASKS = {
+    'MAX_ATTEMPTS': 3,
+    'VISIBILITY_TIMEOUT': 300,
+    'RETRY_DELAY': 10,
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Serialized BookListView/BookDetailsView payloads. Switch to FileBasedCache to share entries between workers
+    'books': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'books-api',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+}
+
+BOOKS_CACHE_ENABLED = True
+BOOKS_CACHE_ALIAS = 'books'
+
+# Part of every ETag; change it whenever the JSON format of a cached endpoint changes
+API_ETAG_SALT = 'v2'
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=365),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
@@ -113,6 +243,13 @@ SIMPLE_JWT = {
     'TOKEN_USER_CLASS': 'users.CustomUser',
 }
 
+# The OpenAPI document (witbook.schema) is generated once per VERSION and kept in DIRECTORY;
+# without WITBOOK_CODE_VERSION the version is a digest of the project's source files
+OPENAPI_SCHEMA = {
+    'DIRECTORY': os.environ.get('WITBOOK_OPENAPI_DIR', BASE_DIR / 'openapi'),
+    'VERSION': os.environ.get('WITBOOK_CODE_VERSION'),
+}
+
 SWAGGER_SETTINGS = {
     'DEFAULT_INFO': 'path.to.your.schema_view',
     'SECURITY_DEFINITIONS': {
@@ -0,0 +1,29 @@
+"""
+Preloading the application before gunicorn forks its workers (see gunicorn.conf.py).
+
+With preload_app the master imports the application once and every worker is forked from it, so
+the imported code and data are shared copy-on-write instead of loaded again by each worker.
+Loading the WSGI application does not import the urlconf (and with it every view): Django does
+that on a worker's first request, so warm_up() does it in the master as well. It then freezes
+the objects created so far, because the garbage collector writes to the objects it tracks, which
+would copy their pages into every worker that runs a collection.
+
+Modules only some requests need (Pillow for uploads, the drf_yasg schema generator) are imported
+where they are used instead, so neither the master nor the workers load them at start.
+"""
+import gc
+
+from django.db import connections
+from django.urls import get_resolver
+
+# Must not be imported at startup; ``manage.py startup_report`` checks it
+LAZY_MODULES = ('PIL.Image', 'drf_yasg.generators', 'drf_yasg.inspectors')
+
+
+def warm_up():
+    """Import everything a request needs; call in the master process right before forking."""
+    get_resolver().url_patterns
+    # A connection opened while loading must not be shared by the forked workers
+    connections.close_all()
+    gc.collect()
+    gc.freeze()
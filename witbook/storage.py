@@ -0,0 +1,75 @@
+"""
+Media storage for covers and avatars.
+
+Uploads are named by the SHA-256 of their (normalized) content, so an image uploaded twice is
+stored once and a name always means the same bytes, which lets media be cached as immutable.
+A stored file may then be referenced by several rows: delete() (also used by django_cleanup)
+only queues the removal, and the task worker removes the file once no row references it.
+"""
+import os
+import posixpath
+import re
+import tempfile
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+
+CONTENT_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def is_content_addressed(name):
+    return CONTENT_HASH_RE.match(posixpath.splitext(posixpath.basename(name))[0]) is not None
+
+
+def reference_count(name):
+    """Rows of any model whose file field points at ``name``."""
+    count = 0
+    for model in apps.get_models():
+        for field in model._meta.concrete_fields:
+            if isinstance(field, models.FileField):
+                count += model._default_manager.filter(**{field.attname: name}).count()
+    return count
+
+
+class MediaStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # The same content-addressed name means the same bytes, so it is reused, not suffixed
+        if is_content_addressed(name):
+            return name
+        return super().get_available_name(name, max_length)
+
+    def _save(self, name, content):
+        if not is_content_addressed(name):
+            return super()._save(name, content)
+
+        path = self.path(name)
+        if os.path.exists(path):
+            # Touching the file holds off a removal that was queued before this upload
+            os.utime(path)
+            return name
+
+        # Concurrent uploads of the same image write the same bytes, so whichever rename comes
+        # last is as good as the first
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.upload-')
+        try:
+            with os.fdopen(descriptor, 'wb') as destination:
+                for chunk in content.chunks():
+                    destination.write(chunk)
+            os.chmod(temporary, self.file_permissions_mode or 0o644)
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+            raise
+        return name
+
+    def delete(self, name):
+        from .images import delete_media
+
+        if name:
+            delete_media.defer([name])
+
+    def delete_now(self, name):
+        super().delete(name)
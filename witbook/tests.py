@@ -0,0 +1,336 @@
+import gzip
+import json
+import os
+import runpy
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db.utils import load_backend
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from books import cache as books_cache
+from witbook import compression, metrics, schema
+
+
+class ProductionSqliteBackendTests(SimpleTestCase):
+    def make_connection(self, engine='witbook.sqlite3', **options):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connection = load_backend(engine).DatabaseWrapper({
+            'ENGINE': engine,
+            'NAME': os.path.join(directory.name, 'db.sqlite3'),
+            'ATOMIC_REQUESTS': False,
+            'AUTOCOMMIT': True,
+            'CONN_MAX_AGE': 0,
+            'CONN_HEALTH_CHECKS': False,
+            'OPTIONS': options,
+            'TIME_ZONE': None,
+            'USER': '', 'PASSWORD': '', 'HOST': '', 'PORT': '',
+            'TEST': {},
+        }, alias='production-test')
+        self.addCleanup(connection.close)
+        return connection
+
+    def test_pragmas_are_applied_on_connect(self):
+        connection = self.make_connection(pragmas={'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 1234})
+        with connection.cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(cursor.execute('PRAGMA synchronous').fetchone()[0], 1)
+            self.assertEqual(cursor.execute('PRAGMA busy_timeout').fetchone()[0], 1234)
+
+    def test_transactions_begin_immediate(self):
+        connection = self.make_connection(transaction_mode='IMMEDIATE')
+        connection.ensure_connection()
+        executed = []
+        connection.connection.set_trace_callback(executed.append)
+        connection._start_transaction_under_autocommit()
+        connection.connection.rollback()
+        self.assertIn('BEGIN IMMEDIATE', executed)
+
+    def profile_connection(self, profile):
+        with mock.patch.dict(os.environ, {'WITBOOK_DB_PROFILE': profile}):
+            database = runpy.run_path(str(settings.BASE_DIR / 'witbook' / 'settings.py'))['DATABASES']['default']
+        return self.make_connection(database['ENGINE'], **database.get('OPTIONS', {}))
+
+    def transaction_statements(self, connection):
+        connection.ensure_connection()
+        executed = []
+        connection.connection.set_trace_callback(executed.append)
+        connection._start_transaction_under_autocommit()
+        connection.connection.rollback()
+        return [statement for statement in executed if statement.startswith('BEGIN')]
+
+    def pragmas(self, connection):
+        with connection.cursor() as cursor:
+            return [cursor.execute(f'PRAGMA {name}').fetchone()[0] for name in ('journal_mode', 'synchronous', 'busy_timeout')]
+
+    def test_default_profile_keeps_sqlite_defaults(self):
+        connection = self.profile_connection('default')
+        # rollback journal, synchronous=FULL, sqlite3.connect()'s 5 second timeout
+        self.assertEqual(self.pragmas(connection), ['delete', 2, 5000])
+        self.assertEqual(self.transaction_statements(connection), ['BEGIN'])
+
+        connection = self.profile_connection('production')
+        self.assertEqual(self.pragmas(connection), ['wal', 1, 20000])
+        self.assertEqual(self.transaction_statements(connection), ['BEGIN IMMEDIATE'])
+
+
+class MediaServeTests(SimpleTestCase):
+    content = bytes(range(256)) * 4
+    name = 'book_photos/' + 'a' * 64 + '.png'
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        override = override_settings(MEDIA_ROOT=media_root.name, MEDIA_CACHE_MAX_AGE=3600)
+        override.enable()
+        self.addCleanup(override.disable)
+        for name in (self.name, 'book_photos/cover.png'):
+            os.makedirs(os.path.dirname(os.path.join(media_root.name, name)), exist_ok=True)
+            with open(os.path.join(media_root.name, name), 'wb') as media_file:
+                media_file.write(self.content)
+
+    def get(self, name, **headers):
+        response = self.client.get('/media/' + name, **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_content_addressed_file_is_immutable(self):
+        response, body = self.get(self.name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['ETag'], '"%s"' % ('a' * 64))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(self.get(self.name, HTTP_IF_NONE_MATCH=response['ETag'])[0].status_code, 304)
+
+    def test_other_files_have_a_short_lifetime(self):
+        response, _ = self.get('book_photos/cover.png')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+
+    def test_ranges(self):
+        response, body = self.get(self.name, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.content[10:20])
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(response['Content-Length'], '10')
+
+        self.assertEqual(self.get(self.name, HTTP_RANGE='bytes=-4')[1], self.content[-4:])
+        self.assertEqual(self.get(self.name, HTTP_RANGE='bytes=1000-')[1], self.content[1000:])
+        self.assertEqual(self.get(self.name, HTTP_RANGE='bytes=1000-5000')[1], self.content[1000:])
+
+        response, _ = self.get(self.name, HTTP_RANGE='bytes=2048-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */1024'))
+
+        # several ranges, or a range for another version of the file, get the whole file
+        self.assertEqual(self.get(self.name, HTTP_RANGE='bytes=0-1,5-6')[0].status_code, 200)
+        self.assertEqual(self.get(self.name, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"other"')[0].status_code, 200)
+
+    def test_missing_and_outside_files(self):
+        self.assertEqual(self.get('book_photos/missing.png')[0].status_code, 404)
+        self.assertEqual(self.get('../settings.py')[0].status_code, 404)
+        self.assertEqual(self.get('book_photos/')[0].status_code, 404)
+        self.assertEqual(self.client.post('/media/' + self.name).status_code, 405)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        override = override_settings(METRICS={
+            'DIRECTORY': self.directory,
+            'FLUSH_INTERVAL': 0,
+            'ALLOWED_NETWORKS': ['127.0.0.0/8'],
+            'SERVER_TIMING': True,
+            'SLOW_REQUEST_MS': 60 * 1000,
+        })
+        override.enable()
+        self.addCleanup(override.disable)
+        metrics.registry.counters.clear()
+        metrics.registry.histograms.clear()
+        books_cache.get_cache().clear()
+
+        user = get_user_model().objects.create_user(username='m@example.com', email='m@example.com', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def test_server_timing_and_prometheus_output(self):
+        response = self.client.get(reverse('book_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", serializer;dur=[\d.]+, total;dur=')
+
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('# TYPE witbook_http_request_duration_seconds histogram', body)
+        self.assertIn('witbook_http_requests_total{view="book_list",method="GET",status="200"} 1\n', body)
+        self.assertIn('witbook_http_request_duration_seconds_bucket{view="book_list",le="+Inf"} 1\n', body)
+        self.assertRegex(body, r'witbook_db_queries_total\{view="book_list"\} [1-9]')
+        self.assertIn('witbook_books_cache_requests_total{outcome="misses"}', body)
+
+    def test_workers_are_summed(self):
+        self.client.get(reverse('book_list'))
+        other_worker = {
+            'counters': [['witbook_http_requests_total', 'view="book_list",method="GET",status="200"', 2]],
+            'histograms': [],
+        }
+        with open(os.path.join(self.directory, '1.json'), 'w') as snapshot_file:
+            json.dump(other_worker, snapshot_file)
+
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('witbook_http_requests_total{view="book_list",method="GET",status="200"} 3\n', body)
+
+    def test_endpoint_is_internal(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.5').status_code, 404)
+
+    def test_slow_requests_are_logged_with_queries(self):
+        with override_settings(METRICS={**settings.METRICS, 'SLOW_REQUEST_MS': 0}):
+            with self.assertLogs('witbook.metrics', 'WARNING') as logs:
+                self.client.get(reverse('book_list'))
+        self.assertIn('Slow request GET /books/list/ (book_list) -> 200', logs.output[0])
+        self.assertIn('1x', logs.output[0])
+        self.assertIn('SELECT "books_book"."id"', logs.output[0])
+
+
+class OpenApiSchemaTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.use_version('first')
+
+    def use_version(self, version):
+        override = override_settings(OPENAPI_SCHEMA={'DIRECTORY': self.directory, 'VERSION': version})
+        override.enable()
+        self.addCleanup(override.disable)
+        schema.reset()
+        self.addCleanup(schema.reset)
+
+    def test_document_is_generated_once_per_version(self):
+        with mock.patch.object(schema, 'generate', wraps=schema.generate) as generate:
+            response = self.client.get('/swagger/', {'format': 'openapi'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/openapi+json; charset=utf-8')
+            document = json.loads(response.content)
+            self.assertIn('/books/list/', document['paths'])
+            self.assertNotIn('host', document)
+
+            self.assertEqual(self.client.get('/swagger/', {'format': '.yaml'}).status_code, 200)
+            self.assertEqual(self.client.get('/swagger/', {'format': 'openapi'}).content, response.content)
+            self.assertEqual(generate.call_count, 1)
+
+            # Another worker of the same version reads the file
+            schema.reset()
+            self.assertEqual(self.client.get('/swagger/', {'format': '.json'}).content, response.content)
+            self.assertEqual(generate.call_count, 1)
+
+            self.use_version('second')
+            self.client.get('/swagger/', {'format': 'openapi'})
+            self.assertEqual(generate.call_count, 2)
+        self.assertEqual(sorted(os.listdir(self.directory)), [
+            'openapi-first.json', 'openapi-first.yaml', 'openapi-second.json', 'openapi-second.yaml',
+        ])
+
+    def test_etag_and_compression(self):
+        plain = self.client.get('/swagger/', {'format': 'openapi'})
+        compressed = self.client.get('/swagger/', {'format': 'openapi'}, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        self.assertNotEqual(plain['ETag'], compressed['ETag'])
+        self.assertIn('Accept-Encoding', compressed['Vary'])
+
+        refused = self.client.get('/swagger/', {'format': 'openapi'}, HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(refused.has_header('Content-Encoding'))
+        self.assertEqual((refused.content, refused['ETag']), (plain.content, plain['ETag']))
+
+        response = self.client.get('/swagger/', {'format': 'openapi'}, HTTP_IF_NONE_MATCH=plain['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_ui_and_build_command(self):
+        response = self.client.get('/swagger/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'swagger-ui')
+
+        out = StringIO()
+        call_command('build_openapi_schema', stdout=out)
+        self.assertIn('openapi-first.json', out.getvalue())
+        self.assertTrue(os.path.exists(os.path.join(self.directory, 'openapi-first.yaml')))
+
+
+class StartupTests(SimpleTestCase):
+    def test_report_and_lazy_imports(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        baseline = os.path.join(directory.name, 'startup.json')
+
+        out = StringIO()
+        call_command('startup_report', repeat=1, top=3, save_baseline=baseline, stdout=out)
+        self.assertNotIn('импортируется при старте', out.getvalue())
+        with open(baseline) as baseline_file:
+            result = json.load(baseline_file)
+        self.assertGreater(result['import_ms'], 0)
+        self.assertGreater(result['rss_mb'], 0)
+
+        result['rss_mb'] = 1
+        with open(baseline, 'w') as baseline_file:
+            json.dump(result, baseline_file)
+        with self.assertRaisesMessage(CommandError, 'rss_mb'):
+            call_command('startup_report', repeat=1, baseline=baseline, stdout=StringIO())
+
+
+@override_settings(COMPRESSION={'MIN_SIZE': 100, 'GZIP_LEVEL': 6, 'BROTLI_QUALITY': 5})
+class CompressionTests(SimpleTestCase):
+    body = json.dumps([{'name': 'Мастер и Маргарита', 'author': 'Булгаков'}] * 20).encode()
+
+    def compress(self, accept_encoding, content=None, content_type='application/json', **headers):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        response = HttpResponse(self.body if content is None else content, content_type=content_type, headers=headers)
+        return compression.CompressionMiddleware(lambda request: response)(request)
+
+    def test_negotiation(self):
+        available = {'br': None, 'gzip': None}
+        for header, expected in (
+            ('gzip, deflate, br', 'br'),
+            ('gzip;q=1.0, br;q=0.5', 'gzip'),
+            ('br;q=0, *', 'gzip'),
+            ('identity', None),
+            ('', None),
+        ):
+            with self.subTest(header=header):
+                self.assertEqual(compression.accepted_encoding(header, available), expected)
+
+    def test_gzip(self):
+        with mock.patch.object(compression, 'brotli', None):
+            response = self.compress('gzip, br', ETag='"v1"')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['ETag'], 'W/"v1"')
+        self.assertEqual(gzip.decompress(response.content), self.body)
+
+    def test_brotli(self):
+        if compression.brotli is None:
+            self.skipTest('Brotli is not installed')
+        response = self.compress('gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(compression.brotli.decompress(response.content), self.body)
+
+    def test_left_alone(self):
+        for accept_encoding, content, headers in (
+            ('gzip', b'{}', {}),
+            ('gzip', None, {'content_type': 'text/html'}),
+            ('gzip', None, {'content_type': 'image/jpeg'}),
+            ('gzip', None, {'Content-Encoding': 'gzip'}),
+            ('identity', None, {}),
+        ):
+            with self.subTest(accept_encoding=accept_encoding, content=content, headers=headers):
+                response = self.compress(accept_encoding, content, **headers)
+                self.assertEqual(response.content, self.body if content is None else content)
+                self.assertEqual(response.get('Content-Encoding'), headers.get('Content-Encoding'))
+
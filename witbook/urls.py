@@ -14,31 +14,18 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
-from django.conf.urls.static import static
+from django.urls import path, include, re_path
 from django.conf import settings
-schema_view = get_schema_view(
-    openapi.Info(
-        title="witbook API",
-        default_version='v1',
-        description="amir brat che tam",
-        terms_of_service="https://www.example.com",
-        contact=openapi.Contact(email="contact@example.com"),
-        license=openapi.License(name="Awesome License"),
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
+from witbook import media, metrics, schema
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('users/', include('users.urls')),
     path('books/', include('books.urls')),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui')
+    path('swagger/', schema.swagger, name='schema-swagger-ui'),
+    path('metrics', metrics.metrics_view, name='metrics'),
+    re_path(r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), media.serve, name='media'),
 ]
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file